@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs conversion backend benchmark
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+#
+#Converts the given tracks with each available backend and reports the
+#  wall-clock time, so the FFmpeg subprocess and in-process PyAV backends
+#  can be compared on real files
+#
+#usage: python benchmarks/convert_backends.py [--workers N] [--repeat N] track [track ...]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.definitions import ConvertBackend, DiscListEntryContents
+from src.generator.base import VirtualGenerator
+from src.generator.pyav import is_available
+import src.generator.executor as executor_factory
+
+
+
+def run(tracks: list, backend: ConvertBackend, workers: int) -> float:
+    generator = VirtualGenerator()
+    generator.backend = backend
+    generator.tmp_path = tempfile.mkdtemp(prefix='.imd_bench_')
+
+    settings = {'proc_ogg': True}
+    tasks = [generator.prepare_for_convert(DiscListEntryContents(track_file=t, internal_name=f'track{i}'), settings)
+             for (i, t) in enumerate(tracks)]
+
+    try:
+        start = time.perf_counter()
+
+        with executor_factory.get({'par_proc': workers > 1, 'workers': workers}) as executor:
+            for r in executor.imap_unordered(generator.convert_with_retry, tasks):
+                if r.size == 0:
+                    print(f"  failed: {r.out_track}")
+
+        return time.perf_counter() - start
+
+    finally:
+        shutil.rmtree(generator.tmp_path, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare track conversion backends')
+    parser.add_argument('tracks', nargs='+')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    backends = [ConvertBackend.FFMPEG]
+    if is_available():
+        backends.append(ConvertBackend.PYAV)
+    else:
+        print("PyAV with libvorbis is not available, only benchmarking FFmpeg")
+
+    #every track is re-encoded, so the backends do the same work
+    for backend in backends:
+        times = [run(args.tracks, backend, args.workers) for i in range(args.repeat)]
+        print(f"{backend.value:8s} best {min(times):.3f}s  mean {sum(times) / len(times):.3f}s  ({len(args.tracks)} tracks, {args.workers} workers)")
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs template rendering benchmark
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+#
+#Renders every datapack and resourcepack file for a number of discs, once
+#  by recursively formatting the templates from src.contents for each file
+#  (how packs used to be generated) and once with the templates compiled by
+#  src.generator.template, checks both give the same text, and reports the
+#  time each takes. Nothing is written to disk
+#
+#usage: python benchmarks/render_templates.py [--discs N] [--repeat N] [--version VERSION]
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.contents.base import thaw
+from src.contents.datapack.factory import AbstractDatapackFactory
+from src.contents.resourcepack.factory import AbstractResourcepackFactory
+from src.definitions import Constants, DiscListContents, DiscListEntryContents, DisplayStrings, PackFormatsDict
+from src.generator.template import JSONTemplate, PackFileTemplate, compile_items
+
+
+
+#the recursive formatter templates were rendered with before they were compiled
+def legacy_json(obj, fmt_dict: dict):
+    if type(obj) == list:
+        iterator = [i for i in range(len(obj))]
+        fmt_obj = list(obj)
+    else:
+        iterator = [k for k in obj]
+        fmt_obj = dict(obj)
+
+    for k in iterator:
+        if type(obj[k]) == str:
+            if '(int){' in obj[k]:
+                fmt_obj[k] = int(obj[k].replace('(int){', '{').format(**fmt_dict))
+            elif '(float){' in obj[k]:
+                fmt_obj[k] = float(obj[k].replace('(float){', '{').format(**fmt_dict))
+            else:
+                fmt_obj[k] = obj[k].format(**fmt_dict)
+
+        elif type(obj[k]) in [dict, list]:
+            fmt_obj[k] = legacy_json(obj[k], fmt_dict)
+
+        if type(k) == str:
+            fmt_obj[k.format(**fmt_dict)] = fmt_obj.pop(k)
+
+    return fmt_obj
+
+def legacy_file(src: dict, fmt_dict: dict) -> tuple:
+    path = os.path.join(*[p.format(**fmt_dict) for p in src['path']])
+
+    if type(src['contents']) == str:
+        text = src['contents'].lstrip()
+        return (path, text.format(**fmt_dict) if src.get('format_contents', True) else text)
+
+    if src.get('format_contents', True):
+        return (path, json.dumps(legacy_json(src['contents'], fmt_dict), indent=4))
+
+    return (path, json.dumps(src['contents'], indent=4))
+
+def legacy_files(files: list, entry_list: DiscListContents, fmt_dict: dict) -> list:
+    out = []
+
+    for src in files:
+        if src['repeat'] == 'single':
+            out.append(legacy_file(src, fmt_dict))
+
+        elif src['repeat'] == 'copy':
+            for entry in entry_list.entries:
+                fmt_dict['entry'] = entry
+                out.append(legacy_file(src, fmt_dict))
+
+        elif src['repeat'] == 'copy_within':
+            parts = []
+            for entry in entry_list.entries:
+                fmt_dict['entry'] = entry
+                (path, text) = legacy_file(src, fmt_dict)
+                parts.append(text)
+
+            out.append((path, ''.join(parts)))
+
+    return out
+
+def render_legacy(dp, rp, entry_list: DiscListContents, ctx: dict) -> list:
+    ctx = dict(ctx)
+
+    creeper_entries = [dp.get_creeper_music_entry_base()]
+    sounds_entries = {}
+    music_disc_11_entries = []
+
+    for entry in entry_list.entries:
+        ctx['entry'] = entry
+        creeper_entries.append(legacy_json(dp.get_creeper_music_entry_custom(), ctx))
+        sounds_entries.update(legacy_json(rp.get_sounds_json_entry(), ctx))
+        music_disc_11_entries.append(legacy_json(rp.get_music_disc_11_entry(), ctx))
+
+    files = [dp.get_creeper_json(creeper_entries), rp.get_sounds_json(sounds_entries),
+             rp.get_music_disc_11_json(music_disc_11_entries)]
+
+    return legacy_files(files + [thaw(f) for f in dp.contents + rp.contents], entry_list, ctx)
+
+
+
+#the same files, rendered from compiled templates
+def render_compiled(dp, rp, entry_list: DiscListContents, ctx: dict) -> list:
+    ctx = dict(ctx)
+
+    creeper_entry = JSONTemplate(dp.get_creeper_music_entry_custom())
+    sounds_entry = compile_items(rp.get_sounds_json_entry())
+    music_disc_11_entry = JSONTemplate(rp.get_music_disc_11_entry())
+
+    creeper_entries = [dp.get_creeper_music_entry_base()]
+    sounds_entries = {}
+    music_disc_11_entries = []
+
+    for entry in entry_list.entries:
+        ctx['entry'] = entry
+        creeper_entries.append(creeper_entry.render_json(ctx))
+        sounds_entries.update(sounds_entry(ctx))
+        music_disc_11_entries.append(music_disc_11_entry.render_json(ctx))
+
+    files = [dp.get_creeper_json(creeper_entries), rp.get_sounds_json(sounds_entries),
+             rp.get_music_disc_11_json(music_disc_11_entries)]
+
+    out = []
+
+    for src in [PackFileTemplate(f) for f in files + [thaw(f) for f in dp.contents + rp.contents]]:
+        if src.repeat == 'single':
+            out.append((src.get_path(ctx), src.render(ctx)))
+
+        elif src.repeat == 'copy':
+            for entry in entry_list.entries:
+                ctx['entry'] = entry
+                out.append((src.get_path(ctx), src.render(ctx)))
+
+        elif src.repeat == 'copy_within':
+            parts = []
+            for entry in entry_list.entries:
+                ctx['entry'] = entry
+                parts.append(src.render(ctx))
+
+            out.append((src.get_path(ctx), ''.join(parts)))
+
+    return out
+
+
+
+def make_entries(count: int) -> DiscListContents:
+    entry_list = DiscListContents([DiscListEntryContents(title=f'Track {i} – \\"{{x}}\\"', internal_name=f'track{i}')
+                                   for i in range(count)])
+
+    for (i, entry) in enumerate(entry_list.entries):
+        entry.custom_model_data = i + 1
+        entry.length_s = 120.0 + i % 60
+        entry.length_t = int(entry.length_s * 20)
+
+    return entry_list
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare recursive and compiled template rendering')
+    parser.add_argument('--discs', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--version', default=list(PackFormatsDict)[0], choices=list(PackFormatsDict))
+    args = parser.parse_args()
+
+    version = PackFormatsDict[args.version]
+    dp = AbstractDatapackFactory().get(version['dp'])
+    rp = AbstractResourcepackFactory().get(version['rp'])
+
+    pack_name = Constants.DEFAULT_PACK_NAME
+    ctx = {
+        'pack_format': version['dp'],
+        'pack_name': pack_name,
+        'datapack_name': pack_name + Constants.DATAPACK_SUFFIX,
+        'resourcepack_name': pack_name + Constants.RESOURCEPACK_SUFFIX,
+        'dp_version_str': dp.version_str,
+        'dp_num_discs': args.discs,
+        'rp_num_discs': args.discs,
+        'mix_mono_title': DisplayStrings.STR_MIXMONO_TITLE,
+    }
+
+    entry_list = make_entries(args.discs)
+
+    if render_legacy(dp, rp, entry_list, ctx) != render_compiled(dp, rp, entry_list, ctx):
+        print("compiled templates don't match the recursive formatter")
+        sys.exit(1)
+
+    results = {}
+    for (name, render) in [('legacy', render_legacy), ('compiled', render_compiled)]:
+        times = []
+
+        for i in range(args.repeat):
+            start = time.perf_counter()
+            render(dp, rp, entry_list, ctx)
+            times.append(time.perf_counter() - start)
+
+        results[name] = min(times)
+        print(f"{name:8s} best {min(times):.3f}s  mean {sum(times) / len(times):.3f}s  ({args.discs} discs, {args.version})")
+
+    print(f"speedup  {results['legacy'] / results['compiled']:.2f}x")
+
+
+
+if __name__ == '__main__':
+    main()
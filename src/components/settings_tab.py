@@ -114,12 +114,15 @@ class PackPngSettingSelector(VirtualSettingSelector):
         return self._widget.getFile()
 
 class CheckSettingSelector(VirtualSettingSelector):
-    def __init__(self, parent = None):
+    def __init__(self, params = False, parent = None):
         super().__init__(parent=parent)
 
         self._parent.setObjectName("CHECK")
         self._widget = QtWidgets.QCheckBox(self)
 
+        #params sets the default state, unchecked if not given
+        self._widget.setChecked(bool(params))
+
         self._widget.stateChanged.connect(self.changed)
 
     def forceValue(self, value: bool):
@@ -213,7 +216,7 @@ class SettingsListEntry(QtWidgets.QFrame):
         self._label = QtWidgets.QLabel(label)
 
         if(settingType == SettingType.PACKPNG):         self._selector = PackPngSettingSelector(self)
-        elif(settingType == SettingType.CHECK):         self._selector = CheckSettingSelector(self)
+        elif(settingType == SettingType.CHECK):         self._selector = CheckSettingSelector(params, self)
         elif(settingType == SettingType.NUM_ENTRY):     self._selector = NumEntrySettingSelector(params, self)
         elif(settingType == SettingType.TXT_ENTRY):     self._selector = TextEntrySettingSelector(params, self)
         elif(settingType == SettingType.DROPDOWN):      self._selector = DropdownDictSettingSelector(params, self)
@@ -3,7 +3,8 @@
 #Infinite Music Discs top-level GUI components module
 #Generation tool, datapack design, and resourcepack design by link2_thepast
 
-from typing import Any
+from math import ceil
+from typing import Any, Optional
 
 from PySide6 import QtCore, QtGui, QtWidgets
 from PySide6.QtCore import QPoint, QRect, QSize, Qt, Signal
@@ -13,8 +14,14 @@ from src.components.common import QRepolishMixin
 from src.components.save_load_tab import SaveLoadTab
 from src.components.settings_tab import SettingsList
 from src.components.tracks_tab import DiscList
+from src.generator.preconvert import PreconvertService
+from src.generator.probe import ProbeService, get_probe_cache
+from src.generator.estimate import estimate_pack
+from src.generator.analysis import get_analysis_cache
+from src.generator.fingerprint import find_near_duplicates, pick_best_copy
 from src.definitions import (CSS_STYLESHEET, Assets, Constants,
-                             DiscListContents, GenerateButtonColorsDict,
+                             DiscListContents, DisplayStrings,
+                             GenerateButtonColorsDict,
                              IMDException, Status, StatusMessageDict,
                              StatusStickyDict, StyleProperties)
 
@@ -30,6 +37,7 @@ class GenerateButton(QRepolishMixin, QtWidgets.QPushButton):
     BD_SIDE_FULL_WIDTH = BD_OUTER_WIDTH + BD_SIDE_WIDTH
 
     generate = Signal()
+    cancel = Signal()
     setCurrentIndex = Signal(int)
 
     def __init__(self, parent = None):
@@ -44,6 +52,10 @@ class GenerateButton(QRepolishMixin, QtWidgets.QPushButton):
         self.setProperty(StyleProperties.DISABLED, False)
         self.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.Preferred)
 
+        #clicking while packs are generating cancels them
+        self._building = False
+        self._cancelling = False
+
         #load custom font
         font_id = QtGui.QFontDatabase.addApplicationFont(Assets.FONT_MC_LARGE)
         font_str = QtGui.QFontDatabase.applicationFontFamilies(font_id)[0]
@@ -89,6 +101,30 @@ class GenerateButton(QRepolishMixin, QtWidgets.QPushButton):
         self._label.setObjectName('GenLabel')
         self._progress.setObjectName('GenProgress')
 
+    def setBuilding(self, building: bool):
+        self._building = building
+        self._cancelling = False
+        self.setToolTip(DisplayStrings.STR_CANCEL if building else '')
+
+    def showCancelling(self):
+        self._cancelling = True
+        self._progress.setFormat(DisplayStrings.STR_CANCELLING)
+        self._progress.setTextVisible(True)
+
+    #show an estimate of the remaining time on the progress bar
+    #estimates of 0 or less hide it
+    def showEstimate(self, seconds: float):
+        if self._cancelling:
+            return
+
+        if seconds <= 0:
+            self._progress.setTextVisible(False)
+            return
+
+        seconds = int(ceil(seconds))
+        self._progress.setFormat(DisplayStrings.STR_ESTIMATE % (seconds // 60, seconds % 60))
+        self._progress.setTextVisible(True)
+
     def sizeHint(self) -> QSize:
         return QSize(350, 66)
 
@@ -99,7 +135,11 @@ class GenerateButton(QRepolishMixin, QtWidgets.QPushButton):
     def mouseReleaseEvent(self, event: QtGui.QMouseEvent):
         event.accept()
         self.setPropertyComplete(StyleProperties.PRESSED, False)
-        self.generate.emit()
+
+        if self._building:
+            self.cancel.emit()
+        else:
+            self.generate.emit()
 
     def enterEvent(self, event: QtGui.QEnterEvent):
         event.accept()
@@ -371,10 +411,14 @@ class StatusDisplayWidget(QRepolishMixin, QtWidgets.QLabel):
     def unsetVisible(self):
         self.setVisible(False)
 
-    def show(self, status: Status):
+    def show(self, status: Status, details: str = ''):
         #use status to decide text and bg color
         #resize widget to fit text
-        self.setText(StatusMessageDict.get(status, 'Unknown error.'))
+        text = StatusMessageDict.get(status, 'Unknown error.')
+        if details:
+            text += '\n' + details
+
+        self.setText(text)
         self.adjustSize()
 
         #errors during generation are marked 'sticky' so the user doesn't miss them
@@ -418,6 +462,7 @@ class StatusDisplayWidget(QRepolishMixin, QtWidgets.QLabel):
 #primary container widget
 class CentralWidget(QtWidgets.QWidget):
     windowMoved = QtCore.Signal()
+    trackProbed = QtCore.Signal(str)
 
     def __init__(self, parent = None):
         super().__init__(parent=parent)
@@ -425,6 +470,10 @@ class CentralWidget(QtWidgets.QWidget):
         self.setObjectName(type(self).__name__)
         self._parent = parent
 
+        #workers of the build and duplicate scan in progress, if any
+        self._worker: Optional[GeneratePackWorker] = None
+        self._dupWorker: Optional[FindDuplicatesWorker] = None
+
         layout = QtWidgets.QVBoxLayout()
         layout.setSpacing(0)
         layout.setContentsMargins(0, 0, 0, 0)
@@ -437,6 +486,30 @@ class CentralWidget(QtWidgets.QWidget):
         self._settingsList = SettingsList(self)
         self._settingsList.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.MinimumExpanding)
 
+        #convert tracks in the background while the user edits the list
+        self._preconvert = PreconvertService(self._settingsList.getUserSettings)
+        self._discList.trackAdded.connect(self._preconvert.add)
+        self._discList.trackRemoved.connect(self._preconvert.remove)
+
+        #read tracks' headers as they're added, to estimate the pack before it's generated
+        #  estimates are made at most once per interval, since adding many tracks at
+        #  once probes them all in quick succession
+        self._probes = ProbeService(self.trackProbed.emit)
+        self._discList.trackAdded.connect(self._probes.add)
+
+        self._estimateTimer = QtCore.QTimer(self)
+        self._estimateTimer.setInterval(Constants.ESTIMATE_INTERVAL_MS)
+        self._estimateTimer.setSingleShot(True)
+        self._estimateTimer.timeout.connect(self.showEstimate)
+
+        self.trackProbed.connect(self._estimateTimer.start)
+        self._discList.trackRemoved.connect(self._estimateTimer.start)
+        self._settingsList.settingChanged.connect(self._estimateTimer.start)
+
+        self._discList.findDuplicates.connect(self.findDuplicates)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self._preconvert.shutdown)
+        QtWidgets.QApplication.instance().aboutToQuit.connect(self._probes.shutdown)
+
         self._saveLoadTab = SaveLoadTab(self)
         self._saveLoadTab.setSizePolicy(QtWidgets.QSizePolicy.Preferred, QtWidgets.QSizePolicy.MinimumExpanding)
 
@@ -460,14 +533,19 @@ class CentralWidget(QtWidgets.QWidget):
         #button to generate datapack/resourcepack
         self._btnGen = GenerateButton(self)
         self._btnGen.generate.connect(self.generatePacks)
+        self._btnGen.cancel.connect(self.cancelPacks)
 
         #wrap inside container frame and layout, for aesthetics
         btnLayout = QtWidgets.QHBoxLayout(self)
         btnLayout.setSpacing(0)
         btnLayout.setContentsMargins(0, 5, 0, 5)
-        btnLayout.addStretch()
+        #rough size and conversion time of the pack, to the right of the button
+        #  the stretch on the left matches it, keeping the button centered
+        self._estimate = QtWidgets.QLabel('', self)
+
+        btnLayout.addStretch(1)
         btnLayout.addWidget(self._btnGen, 0, Qt.AlignBottom)
-        btnLayout.addStretch()
+        btnLayout.addWidget(self._estimate, 1, Qt.AlignVCenter)
 
         btnFrame = QtWidgets.QFrame(self)
         btnFrame.setLayout(btnLayout)
@@ -476,6 +554,7 @@ class CentralWidget(QtWidgets.QWidget):
 
         tabs.setObjectName('AnimatedTabs')
         btnFrame.setObjectName('GenFrame')
+        self._estimate.setObjectName('PackEstimate')
 
         self.setStyleSheet(CSS_STYLESHEET)
 
@@ -498,10 +577,39 @@ class CentralWidget(QtWidgets.QWidget):
         self._status.adjustSize()
         self._status.setBasePos()
 
+    #estimate the pack from the tracks probed so far
+    def showEstimate(self):
+        entry_list = self._discList.getDiscEntries()
+        settings = self._settingsList.getUserSettings()
+
+        cache = get_probe_cache()
+        probes = {}
+
+        for f in entry_list.track_files:
+            probe = cache.fetch(f)
+            if probe is not None:
+                probes[f] = probe
+
+        if not probes:
+            self._estimate.setText('')
+            return
+
+        estimate = estimate_pack(entry_list, probes, settings)
+        seconds = int(ceil(estimate.convert_s))
+
+        text = DisplayStrings.STR_PACK_ESTIMATE % (estimate.size_bytes / (1024 * 1024), seconds // 60, seconds % 60)
+        if estimate.pending:
+            text += '\n' + DisplayStrings.STR_PROBING % estimate.pending
+
+        self._estimate.setText(text)
+
     def generatePacks(self):
         entry_list = self._discList.getDiscEntries()
         settings = self._settingsList.getUserSettings()
 
+        #don't let queued background work compete with the build
+        self._preconvert.cancel_pending()
+
         #launch worker thread to generate packs
         #   FFmpeg conversion is slow, don't want to lock up UI
         self._thread = QtCore.QThread(self)
@@ -516,28 +624,124 @@ class CentralWidget(QtWidgets.QWidget):
         self._worker.min_prog.connect(self._btnGen._progress.setMinimum)
         self._worker.progress.connect(self._btnGen._progress.setValue)
         self._worker.max_prog.connect(self._btnGen._progress.setMaximum)
+        self._worker.estimate.connect(self._btnGen.showEstimate)
+        self._worker.eta.connect(self._btnGen.showEstimate)
 
+        #the worker is deleted from this thread once it's finished, so a cancel
+        #  click can never reach a worker that's already gone
         self._thread.started.connect(self._worker.generate)
-        self._worker.finished.connect(self._worker.deleteLater)
+        self._worker.finished.connect(self.generateFinished)
         self._worker.destroyed.connect(self._thread.quit)
         self._thread.finished.connect(self._thread.deleteLater)
 
-        self._btnGen.setEnabled(False)
-        self._thread.finished.connect(lambda: self._btnGen.setEnabled(True))
+        #the button stays enabled, so it can be clicked to cancel
+        self._btnGen.setBuilding(True)
 
         self._thread.start()
 
+    def generateFinished(self):
+        self._btnGen.setBuilding(False)
+
+        self._worker.deleteLater()
+        self._worker = None
+
+    #the worker's thread is busy generating, so call it directly instead
+    #  of through a signal
+    def cancelPacks(self):
+        if self._worker is None:
+            return
+
+        self._btnGen.showCancelling()
+        self._worker.cancel()
+
+    #only one scan runs at a time, the menu action is disabled until it's done
+    def findDuplicates(self):
+        if self._dupWorker is not None:
+            return
+
+        tracks = [e.track_file for e in self._discList.getDiscEntries().entries if e.track_file != '']
+        settings = self._settingsList.getUserSettings()
+
+        #decoding tracks to compare them is slow, don't want to lock up UI
+        self._dupThread = QtCore.QThread(self)
+        self._dupWorker = FindDuplicatesWorker(tracks, settings, get_analysis_cache())
+        self._dupWorker.moveToThread(self._dupThread)
+
+        self._dupWorker.found.connect(self.mergeDuplicates)
+
+        self._dupThread.started.connect(self._dupWorker.run)
+        self._dupWorker.finished.connect(self.findDuplicatesFinished)
+        self._dupWorker.destroyed.connect(self._dupThread.quit)
+        self._dupThread.finished.connect(self._dupThread.deleteLater)
+
+        self._discList.setScanning(True)
+        self._dupThread.start()
+
+    def findDuplicatesFinished(self):
+        self._discList.setScanning(False)
+
+        self._dupWorker.deleteLater()
+        self._dupWorker = None
+
+    #show groups of tracks that sound the same, and replace every track in
+    #  a group with its best copy if the user agrees
+    #each group is a list of files, best copy first
+    def mergeDuplicates(self, groups: list):
+        if not groups:
+            QtWidgets.QMessageBox.information(self, DisplayStrings.STR_FIND_DUPLICATES, DisplayStrings.STR_NO_DUPLICATES)
+            return
+
+        lines = [', '.join(QtCore.QFileInfo(f).fileName() for f in group) for group in groups]
+        text = '\n\n'.join([DisplayStrings.STR_DUPLICATES_FOUND, '\n'.join(lines), DisplayStrings.STR_MERGE_DUPLICATES])
+
+        answer = QtWidgets.QMessageBox.question(self, DisplayStrings.STR_FIND_DUPLICATES, text)
+        if answer != QtWidgets.QMessageBox.StandardButton.Yes:
+            return
+
+        self._discList.replaceTracks({f: group[0] for group in groups for f in group[1:]})
+
 
 
 #worker object that generates the datapack/resourcepack in a separate QThread
+class FindDuplicatesWorker(QtCore.QObject):
+    found = Signal(list)
+    finished = Signal()
+
+    def __init__(self, tracks: list, settings: dict, cache):
+        super().__init__()
+
+        self._tracks = tracks
+        self._settings = settings
+        self._cache = cache
+
+    def run(self):
+        try:
+            groups = []
+
+            for indexes in find_near_duplicates(self._tracks, self._cache, self._settings):
+                files = list(dict.fromkeys(self._tracks[i] for i in indexes))
+                best = pick_best_copy(files)
+                groups.append([best] + [f for f in files if f != best])
+
+            self.found.emit(groups)
+
+        finally:
+            self.finished.emit()
+
+
+
 class GeneratePackWorker(QtCore.QObject):
     started = Signal()
     finished = Signal()
     valid = Signal()
-    status = Signal(Status)
+    status = Signal(Status, str)
     min_prog = Signal(int)
     progress = Signal(int)
     max_prog = Signal(int)
+    estimate = Signal(float)
+    percent = Signal(float)
+    throughput = Signal(float)
+    eta = Signal(float)
 
     def __init__(self, entry_list: DiscListContents, settings: dict):
         super().__init__()
@@ -547,10 +751,26 @@ class GeneratePackWorker(QtCore.QObject):
         self._entry_list = entry_list
         self._settings = settings
         self._progress = 0
+        self._convert_value = 0
 
     def emit_update_progress(self):
         self._progress += 1
-        self.progress.emit(self._progress)
+        self.progress.emit(max(self._progress * Constants.PROGRESS_SCALE, self._convert_value))
+
+    # overall conversion progress, sent from conversion threads at most a
+    #   few times a second
+    # moves the progress bar partway through the conversion steps, but never
+    #   behind the tracks that have actually finished
+    def emit_convert_progress(self, percent: float, throughput: float, eta: float):
+        self.percent.emit(percent)
+        self.throughput.emit(throughput)
+
+        #nothing to base an estimate on until some audio has been converted
+        if throughput > 0:
+            self.eta.emit(eta)
+
+        self._convert_value = int((1 + len(self._entry_list) * percent / 100.0) * Constants.PROGRESS_SCALE)
+        self.progress.emit(max(self._convert_value, self._progress * Constants.PROGRESS_SCALE))
 
     # multiprocessing's apply_async needs a callback
     #   that accepts 1 argument, even if you don't do
@@ -562,23 +782,42 @@ class GeneratePackWorker(QtCore.QObject):
         try:
             self.run()
 
+        #whatever went wrong, keep finished tracks so generating again can
+        #  pick up from them, and clear out everything else (partly written
+        #  tracks, segments, etc.) before the button comes back
         except IMDException as e:
-            self.status.emit(e.status)
+            self._generator.cleanup_tmp(keep_completed=True)
+            self.status.emit(e.status, e.details)
         else:
-            self.status.emit(Status.SUCCESS)
+            self.status.emit(Status.SUCCESS, self.get_summary())
 
         finally:
             self.finished.emit()
 
+    # stop generating as soon as possible. Called from another thread
+    # once the packs themselves are being written, they're finished
+    #   instead, so they're never left half-written
+    def cancel(self):
+        self._generator.cancel()
+
+    #extra details shown when the packs are done
+    def get_summary(self) -> str:
+        limit_mb = self._settings.get('size_budget', 0)
+        if not limit_mb:
+            return ''
+
+        return DisplayStrings.STR_PACK_SIZE % (self._generator.pack_size / (1024 * 1024), limit_mb)
+
     def run(self):
         self.started.emit()
 
         #total steps = validate + num track conversions + generate dp + generate rp
         self.min_prog.emit(0)
         self.progress.emit(0)
-        self.max_prog.emit(1 + len(self._entry_list) + 1 + 1)
+        self.max_prog.emit((1 + len(self._entry_list) + 1 + 1) * Constants.PROGRESS_SCALE)
 
         self._progress = 0
+        self._convert_value = 0
 
         #make sure data is valid before continuing
         self._generator.validate(self._entry_list, self._settings)
@@ -586,24 +825,19 @@ class GeneratePackWorker(QtCore.QObject):
         self.valid.emit()
 
         #process tracks
-        self._generator.create_tmp()
-        self._generator.convert_all_to_ogg(self._entry_list, self._settings, self.emit_update_progress)
+        self._generator.create_tmp(self._settings)
+        self._generator.convert_all_to_ogg(self._entry_list, self._settings, self.emit_update_progress,
+                                           self.estimate.emit, self.emit_convert_progress)
+        self.estimate.emit(0)
 
-        #post-process tracks individually       
+        #track lengths are filled in by the conversion workers
         for e in self._entry_list.entries:
-            # e.track_file = self._generator.convert_to_ogg(e, self._settings)
-            e.length_s = self._generator.get_track_length(e)
-            e.length_t = self._generator.seconds_to_ticks(e.length_s)
             e.title = self._generator.sanitize(e)
-            self.emit_update_progress()
 
-        #generate datapack
-        self._generator.generate_datapack(self._entry_list, self._settings)
-        self.emit_update_progress()
+        self._generator.job.check()
 
-        #generate resourcepack
-        self._generator.generate_resourcepack(self._entry_list, self._settings)
-        self.emit_update_progress()
+        #generate datapack and resourcepack
+        self._generator.generate_packs(self._entry_list, self._settings, self.emit_update_progress)
 
         #finish up and return to generate()
         self._generator.cleanup_tmp()
@@ -9,7 +9,7 @@ from PySide6 import QtGui
 from PySide6 import QtWidgets
 from PySide6.QtCore import Qt, Signal, QSize
 
-from src.definitions import Assets, Constants, ButtonType, SupportedFormats, Helpers, StyleProperties, DiscListEntryContents, DiscListContents
+from src.definitions import Assets, Constants, ButtonType, SupportedFormats, Helpers, StyleProperties, DiscListEntryContents, DiscListContents, DisplayStrings
 from src.components.common import QFocusLineEdit, DragDropButton, MultiDragDropButton
 
 
@@ -186,6 +186,9 @@ class DiscListEntry(VirtualDiscListEntry):
 
         layout = QtWidgets.QHBoxLayout()
 
+        #track file last reported to the list
+        self._track = ''
+
         #child widgets
         self._btnIcon = MultiDragDropButton(ButtonType.IMAGE, self)
         self._btnTrack = MultiDragDropButton(ButtonType.TRACK, self)
@@ -271,6 +274,7 @@ class DiscListEntry(VirtualDiscListEntry):
         #bind other signals
         self._btnDelete.clicked.connect(self.deleteSelf)
         self._btnTrack.fileChanged.connect(self.setTitle)
+        self._btnTrack.fileChanged.connect(self.setTrack)
         self._leTitle.textChanged.connect(self.setSubtitle)
 
         self._btnIcon.setObjectName('ImageButton')
@@ -307,6 +311,22 @@ class DiscListEntry(VirtualDiscListEntry):
         self._btnTrack.setFile(entry_contents.track_file)
 
         self.setTitle([ entry_contents.track_file ])
+        self.setTrack([ entry_contents.track_file ])
+
+    #swap in a different file for the same track, keeping the title
+    def replaceTrack(self, file: str):
+        self._btnTrack.setFile(file)
+        self.setTrack([ file ])
+
+    #let the list know this entry's track was added or replaced
+    def setTrack(self, fFileList: List[str]):
+        if self._track != '':
+            self._parent.trackRemoved.emit(self._track)
+
+        self._track = fFileList[0]
+
+        if self._track != '':
+            self._parent.trackAdded.emit(self._track)
 
     def setTitle(self, fFileList: List[str]):
         title = QtCore.QFileInfo(fFileList[0]).completeBaseName()
@@ -337,6 +357,9 @@ class NewDiscEntry(VirtualDiscListEntry):
 class DiscList(QtWidgets.QWidget):
 
     reordered = Signal(int)
+    trackAdded = Signal(str)
+    trackRemoved = Signal(str)
+    findDuplicates = Signal()
 
     icon_multiDragEnter = Signal(int, int)
     icon_multiDragLeave = Signal(int, int)
@@ -393,6 +416,21 @@ class DiscList(QtWidgets.QWidget):
         widget.setObjectName('DiscListChildWidget')
         scrollArea.setObjectName('DiscListScrollArea')
 
+        self._scanning = False
+
+    def contextMenuEvent(self, event: QtGui.QContextMenuEvent):
+        menu = QtWidgets.QMenu(self)
+        action = QtGui.QAction(DisplayStrings.STR_FIND_DUPLICATES, menu)
+        action.triggered.connect(self.findDuplicates.emit)
+        action.setEnabled(not self._scanning)
+
+        menu.addAction(action)
+        menu.exec(event.globalPos())
+
+    #disable finding duplicates while a scan is already running
+    def setScanning(self, scanning: bool):
+        self._scanning = scanning
+
     def discMoveUpEvent(self, index: int):
         if(index == 0):
             pass
@@ -476,9 +514,25 @@ class DiscList(QtWidgets.QWidget):
         if(remainingTracks > 0):
             self.addDiscEntries(fTrackList[remainingIndex:])
 
+    #point entries at different track files, given as {old file : new file}
+    def replaceTracks(self, replacements: dict):
+        for i in range(self._childLayout.count()):
+            widget = self._childLayout.itemAt(i).widget()
+
+            if(type(widget) == DiscListEntry):
+                track = widget.getEntry().track_file
+
+                if track in replacements:
+                    widget.replaceTrack(replacements[track])
+
     def removeDiscEntry(self, index: int):
         w = self._childLayout.itemAt(index).widget()
         self._childLayout.removeWidget(w)
+
+        track = w.getEntry().track_file
+        if track != '':
+            self.trackRemoved.emit(track)
+
         w.deleteLater()
         w = None
 
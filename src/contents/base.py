@@ -3,6 +3,10 @@
 #Infinite Music Discs datapack/resourcepack contents base class
 #Generation tool, datapack design, and resourcepack design by link2_thepast
 
+from types import MappingProxyType
+
+
+
 # Virtual class that forms the beginning of a chain of classes that
 #   inherit each other to define the pack contents
 # virtual -> v2.0 -> v2.1 -> ...
@@ -16,15 +20,60 @@ class VirtualPackContents():
     def __init__(self):
         self.add_contents()
 
+        #use list comprehension to collect the contents of all instance attributes in
+        #  self.__dict__ (a list of all 'self.x' variables from this class instance)
+        #contents don't change once they're added, so this only happens once
+        #every build shares this instance, so each file is replaced by a read-only
+        #  copy: changing one would change it in every later pack
+        keys = [k for k in self.__dict__ if not k.startswith('__') and not callable(getattr(self, k))]
+
+        for k in keys:
+            setattr(self, k, freeze(getattr(self, k)))
+
+        self._contents = tuple(getattr(self, k) for k in keys)
+
     def add_contents(self):
         pass
 
-    #use list comprehension to collect the contents of all instance attributes in
-    #  self.__dict__ (returns a list of all 'self.x' variables from this class instance)
     @property
-    def contents(self):
-        attr_dict = self.__dict__
-        return [attr_dict[k] for k in attr_dict \
-                if not k.startswith('__') and not callable(getattr(self, k))]
+    def contents(self) -> tuple:
+        return self._contents
+
+
+
+# copy of a file from contents with the given value put at keys, e.g.
+#   ['contents', 'pools', 1, 'entries']. Used to put each build's entries
+#   into a file without changing the file other builds use
+# only the dicts and lists on the way to the value are copied, the rest is
+#   shared with the original
+def with_value(src, keys: list, value):
+    if not keys:
+        return value
+
+    copy = dict(src) if type(src) == dict else list(src)
+    copy[keys[0]] = with_value(src[keys[0]], keys[1:], value)
+
+    return copy
+
+
+
+# read-only copy of a file from contents: dicts become mappingproxies and
+#   lists become tuples, all the way down
+def freeze(src):
+    if type(src) == dict:
+        return MappingProxyType({k: freeze(v) for (k, v) in src.items()})
+
+    if type(src) == list:
+        return tuple(freeze(v) for v in src)
+
+    return src
+
+# plain dicts and lists again, for code that reads contents as JSON
+def thaw(src):
+    if type(src) == MappingProxyType:
+        return {k: thaw(v) for (k, v) in src.items()}
 
+    if type(src) == tuple:
+        return [thaw(v) for v in src]
 
+    return src
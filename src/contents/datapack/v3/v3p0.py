@@ -3,7 +3,7 @@
 #Infinite Music Discs datapack v3.0 contents
 #Generation tool, datapack design, and resourcepack design by link2_thepast
 
-from src.contents.base import VirtualPackContents
+from src.contents.base import VirtualPackContents, with_value
 
 
 
@@ -208,9 +208,8 @@ class DatapackContents_v3p0(VirtualPackContents):
         return creeper_music_entry_custom
 
     def get_creeper_json(self, creeper_music_entries: list):
-        #reach inside and set the music disc entries manually since it's
-        #  hard to elegantly generate this file
-        creeper_json['contents']['pools'][1]['entries'] = creeper_music_entries
-        return creeper_json
+        #put the music disc entries into a copy of the file manually since
+        #  it's hard to elegantly generate this file
+        return with_value(creeper_json, ['contents', 'pools', 1, 'entries'], creeper_music_entries)
 
 
@@ -3,7 +3,7 @@
 #Infinite Music Discs resourcepack v1.0 contents
 #Generation tool, datapack design, and resourcepack design by link2_thepast
 
-from src.contents.base import VirtualPackContents
+from src.contents.base import VirtualPackContents, with_value
 
 
 
@@ -68,7 +68,7 @@ sounds_json_entry = {
     "music_disc.{entry.internal_name}": {
         "sounds": [
             {
-                "name": "{pack_name}:records/{entry.internal_name}",
+                "name": "{pack_name}:records/{entry.sound_name}",
                 "stream": True
             }
         ]
@@ -89,7 +89,7 @@ music_disc_track_json = {
 {
     "parent": "item/generated",
     "textures": {
-        "layer0": "{pack_name}:item/music_disc_{entry.internal_name}"
+        "layer0": "{pack_name}:item/music_disc_{entry.texture_name}"
     }
 }
 }
@@ -124,18 +124,16 @@ class ResourcepackContents_v2p0(VirtualPackContents):
         return sounds_json_entry
 
     def get_sounds_json(self, sounds_json_entries: dict):
-        #reach inside and set the music disc entries manually since it's
-        #  hard to elegantly generate this file
-        sounds_json['contents'] = sounds_json_entries
-        return sounds_json
+        #put the music disc entries into a copy of the file manually since
+        #  it's hard to elegantly generate this file
+        return with_value(sounds_json, ['contents'], sounds_json_entries)
 
     #music_disc_11.json
     def get_music_disc_11_entry(self):
         return music_disc_11_entry
 
     def get_music_disc_11_json(self, music_disc_11_entries: list):
-        music_disc_11_json['contents']['overrides'] = music_disc_11_entries
-        return music_disc_11_json
+        return with_value(music_disc_11_json, ['contents', 'overrides'], music_disc_11_entries)
 
     #asset file locations
     def get_sound_path(self):
@@ -6,16 +6,22 @@
 # See src.contents.datapack.v2.factory for a concrete factory implementation
 # See src.contents.datapack.factory for an abstract factory implementation
 # See src.generator.v2 for an example of how to use the abstract factory
-# TODO: can static classes have @properties? Would be nice not to have to instantiate these, save memory
+
+# Every VirtualPackContents class that's been used, and its one instance
+# Contents are frozen once they're added, so all builds share the same
+#   instance of each version, including builds running at the same time
+REGISTRY: dict[type, object] = {}
+
+
 
 # Virtual implementation of a concrete "pack factory"
 #
 # Pack factories are used to select between different DatapackContents or
 #   ResourcepackContents. Uses pack_format to pick which version to use,
-#   and returns an instance of the selected class
+#   and returns the registered instance of the selected class
 # If 'versions' is sorted in ascending order (v0 -> v1 -> v2 -> etc)
 #   then the factory will pick the latest pack version compatible
-#   with the given pack_format and return an instance of it
+#   with the given pack_format and return its instance
 class VirtualPackFactory():
 
     versions = []
@@ -29,7 +35,12 @@ class VirtualPackFactory():
             if v.min_pack_format <= pack_format:
                 sel_version = v
 
-        return sel_version()
+        contents = REGISTRY.get(sel_version, None)
+
+        if contents is None:
+            contents = REGISTRY.setdefault(sel_version, sel_version())
+
+        return contents
 
 
 
@@ -44,7 +55,7 @@ class VirtualAbstractPackFactory():
 
     factories = []
 
-    # Return an instance of VirtualPackContents (or a derived class)
+    # Return the instance of VirtualPackContents (or a derived class)
     #   selected by one of the factories
     def get(self, pack_format: int):
         for f in self.factories:
@@ -10,7 +10,7 @@ import unidecode
 
 from enum import Enum
 from datetime import datetime
-from typing import List, Any
+from typing import List, Any, Optional
 from dataclasses import dataclass, field
 
 from PySide6.QtGui import QColor
@@ -45,6 +45,61 @@ class Constants():
     RESOURCEPACK_DESC = 'Adds %d custom music discs'
     DEFAULT_PACK_FORMAT = 8     #TODO: can this come from PackFormatsDict automatically?
 
+    CACHE_DIR_NAME = 'imd_cache'
+    CACHE_MAX_MB = 4096
+    CACHE_VERSION = 4           #increment when conversion output changes, to invalidate old cache entries
+    HASH_CHUNK_SIZE = 1024 * 1024
+    PROBE_WORKERS = 4                       #tracks whose headers are read at once when added
+    ESTIMATE_INTERVAL_MS = 100
+    MAX_SAMPLE_RATE = 48000
+    WORKER_MEM_BYTES = 256 * 1024 * 1024    #rough upper bound on memory used by one FFmpeg conversion
+
+    #rough conversion speeds on one core, used to schedule and estimate conversion time
+    ENCODE_SPEED = 40.0                     #seconds of audio encoded per second
+    REMUX_BYTES_PER_S = 200 * 1024 * 1024
+    JOB_OVERHEAD_S = 0.1                    #FFmpeg startup, probing, etc.
+    FALLBACK_BITRATE = 128000               #used to guess length if a track's headers don't report it
+    SEGMENT_MIN_LENGTH_S = 300              #tracks are only split into segments at least this long
+    SEGMENT_WARMUP_S = 15.0                 #audio encoded before a segment, so the encoder has settled where it's joined
+    SEGMENT_LEADOUT_S = 1.0                 #audio encoded after a segment, past where it's joined
+    SEGMENT_ALIGN_SAMPLES = 8192            #largest Vorbis block; segments start a multiple of this apart
+    CONVERT_ATTEMPTS = 3
+    CONVERT_RETRY_DELAY_S = 0.5             #doubles after each failed attempt
+    JOURNAL_NAME = 'journal.jsonl'
+    BATCH_CLIP_MAX_S = 30                   #tracks at most this long are converted in batches
+    BATCH_MAX_LENGTH_S = 300                #seconds of audio converted by one batch, at most
+    BATCH_MAX_FILES = 32
+    REMOTE_KEY_ENV = 'IMD_REMOTE_KEY'       #environment variable holding the key for remote workers
+    REMOTE_CONNECT_TIMEOUT_S = 5
+    REMOTE_HEARTBEAT_S = 2                  #workers report in this often while converting
+    REMOTE_TIMEOUT_S = 20                   #workers that aren't heard from for this long are given up on
+    REMOTE_CHUNK_BYTES = 1024 * 1024        #files are sent to and from workers in pieces this big
+    CANCEL_POLL_S = 0.05                    #how often waits that can't be interrupted check for cancellation
+    ANALYSIS_DIR_NAME = 'imd_analysis'      #next to the cache directory, so its size limit never evicts measurements
+    ANALYSIS_VERSION = 1                    #increment when analysis results change, to invalidate old ones
+    LOUDNESS_TARGET_LUFS = -16.0
+    LOUDNESS_MAX_PEAK_DB = -1.0             #gain is limited so tracks don't clip
+    LOUDNESS_MAX_GAIN_DB = 20.0
+    LOUDNESS_MIN_GAIN_DB = 0.5              #smaller adjustments aren't worth re-encoding for
+    SILENCE_BLOCK_S = 0.05
+    SILENCE_THRESHOLD_DB = -60.0            #blocks quieter than this (RMS, dBFS) count as silence
+    TRIM_PADDING_S = 0.25                   #silence kept at each end of a trimmed track
+    TRIM_MIN_S = 0.5                        #trimming less than this isn't worth re-encoding for
+    SIZE_BUDGET_MAX_MB = 100000
+    BUDGET_HEADROOM = 0.97                  #fraction of the size limit tracks are planned to fill
+    BUDGET_OVERHEAD_BYTES = 64 * 1024       #pack files besides tracks and textures
+    OGG_HEADER_BYTES = 4 * 1024             #Vorbis setup headers, added to every track
+    FINGERPRINT_MAX_S = 120                 #only the start of a track is fingerprinted
+    FINGERPRINT_MAX_OFFSET = 20             #frames two fingerprints may be shifted by, about 2s
+    FINGERPRINT_MIN_FRAMES = 100            #least overlap worth comparing
+    FINGERPRINT_MAX_ERROR = 0.25            #fraction of differing bits at which tracks still sound the same
+    FINGERPRINT_LENGTH_TOL_S = 2.0          #tracks that sound the same are about as long as
+    FINGERPRINT_LENGTH_TOL = 0.02           #  each other, in seconds or as a fraction
+    PROGRESS_INTERVAL_S = 0.25              #minimum time between conversion progress updates sent to the UI
+    PROGRESS_SCALE = 100                    #progress bar units per step, so it can move during a conversion
+    VFS_WRITE_WORKERS = 8                   #pack files written to disk at once
+    VFS_BATCH_BYTES = 1024 * 1024           #rendered pack files are handed to the writers in batches of about this size
+
 class Regexes():
     # QPosIntLineEdit
     LE_POS_INT = '(^[0-9]{0,8}$|^$)'
@@ -92,11 +147,51 @@ class Status(Enum):
     DUP_INTERNAL_NAME = 17
     BAD_OGG_META = 18
     PACK_DIR_IN_USE = 19
+    PARTIAL_CONVERT = 20
+    CANCELLED = 21
+    BUILD_IN_PROGRESS = 22
+
+class AudioCodec(Enum):
+    UNKNOWN = 0
+    VORBIS = 1
+    OPUS = 2
+    MP3 = 3
+    WAV = 4
+
+class ConvertMode(Enum):
+    REMUX = 1
+    ENCODE = 2
+
+class StagingPolicy(Enum):
+    OUTPUT = 'output'
+    TMPFS = 'tmpfs'
+    SYSTEM = 'system'
+
+class ExecutorType(Enum):
+    SERIAL = 'serial'
+    THREAD = 'thread'
+    PROCESS = 'process'
+    REMOTE = 'remote'
+
+class RemoteMessage(Enum):
+    HELLO = 1
+    PROBE = 2
+    JOB = 3
+    ALIVE = 4
+    DONE = 5
+    ERROR = 6
+    BYE = 7
+    FILE = 8
+
+class ConvertBackend(Enum):
+    FFMPEG = 'ffmpeg'
+    PYAV = 'pyav'
 
 class IMDException(Exception):
-    def __init__(self, status):
+    def __init__(self, status, details: str = ''):
         super().__init__(status)
         self.status = status
+        self.details = details
 
 class FileExt():
     PNG = 'png'
@@ -172,8 +267,17 @@ class DisplayStrings():
     STR_MIXMONO_TITLE =     "Play tracks from the jukebox block"
     STR_DP_VER_TITLE =      "Use legacy datapack"
     STR_KEEPTMP_TITLE =     "Keep intermediate converted files"
-    STR_PAR_PROC_TITLE =    "Convert tracks to .ogg all at once (experimental)"
-    STR_PROC_OGG =          "Convert .ogg files instead of copying"
+    STR_PAR_PROC_TITLE =    "Convert several tracks to .ogg at once"
+    STR_PRECONVERT_TITLE =  "Convert tracks in the background"
+    STR_PROC_OGG =          "Always re-encode .ogg files"
+    STR_NORMALIZE_TITLE =   "Make all tracks equally loud"
+    STR_TRIM_TITLE =        "Trim silence from the start and end of tracks"
+    STR_BUDGET_TITLE =      "Resourcepack size limit in MB (0 for no limit)"
+    STR_ESTIMATE =          "Converting, about %d:%02d left"
+    STR_CANCEL =            "Click to cancel"
+    STR_CANCELLING =        "Cancelling..."
+    STR_PACK_ESTIMATE =     "About %.1f MB\n%d:%02d to convert"
+    STR_PROBING =           "Reading %d tracks..."
 
     STR_PACKPNG_TOOLTIP =   "Optional in-game icon. Auto-fills if you put a 'pack.png' in the same folder as the app."
     STR_PACKNAME_TOOLTIP =  "The name Minecraft will use to reference your pack."
@@ -183,8 +287,17 @@ class DisplayStrings():
     STR_MIXMONO_TOOLTIP =   "Mixes stereo tracks to mono. May increase generation time and reduce sound quality."
     STR_DP_VER_TOOLTIP =    "1.19.3 and earlier only supports the legacy datapack."
     STR_KEEPTMP_TOOLTIP =   "Save a copy of converted files so pack generation can go faster next time."
-    STR_PAR_PROC_TOOLTIP =  "Much faster, but doesn't work on some computers."
-    STR_PROC_OGG_TOOLTIP =  "Sometimes fixes \"Can't detect ogg file length\" errors by removing bad header data."
+    STR_PAR_PROC_TOOLTIP =  "Much faster. Uncheck if pack generation fails on your computer."
+    STR_PRECONVERT_TOOLTIP ="Start converting tracks as soon as they're added, so generating packs goes faster."
+    STR_PROC_OGG_TOOLTIP =  "Sometimes fixes broken .ogg files. Otherwise, compatible .ogg files are copied without re-encoding."
+    STR_NORMALIZE_TOOLTIP = "Adjusts each track's volume so discs are about as loud as each other. Each track is measured once, then remembered."
+    STR_TRIM_TOOLTIP =      "Makes packs smaller, and lets the jukebox finish as soon as the music does."
+    STR_BUDGET_TOOLTIP =    "Lowers track quality as much as needed for the resourcepack to fit, e.g. in a server's resourcepack size limit. Longer packs get lower quality."
+    STR_PACK_SIZE =         "Resourcepack is %.1f MB (limit %d MB)"
+    STR_FIND_DUPLICATES =   "Find duplicate tracks"
+    STR_NO_DUPLICATES =     "No duplicate tracks found."
+    STR_DUPLICATES_FOUND =  "These tracks sound the same:"
+    STR_MERGE_DUPLICATES =  "Use the best copy of each for all of its discs? Titles and textures are kept."
 
 #dictionary to associate Status : status message string
 StatusMessageDict = {
@@ -207,7 +320,10 @@ StatusMessageDict = {
     Status.FFMPEG_CONVERT_FAIL:     "FFmpeg failed while converting a track to '.ogg' format.",
     Status.DUP_INTERNAL_NAME:       "Some tracks have the same name. Try removing duplicate tracks.",
     Status.BAD_OGG_META:            "Can't detect .ogg file length while converting.",
-    Status.PACK_DIR_IN_USE:         "Couldn't remove pack folder. Is something else using it?"
+    Status.PACK_DIR_IN_USE:         "Couldn't remove pack folder. Is something else using it?",
+    Status.PARTIAL_CONVERT:         "Failed to convert some tracks. Finished tracks were kept, generate again to retry:",
+    Status.CANCELLED:               "Generation cancelled. Finished tracks were kept for next time.",
+    Status.BUILD_IN_PROGRESS:       "This pack is already being generated to the same folder. Wait for that to finish first."
 }
 
 #dictionary to associate Status : sticky state
@@ -231,7 +347,10 @@ StatusStickyDict = {
     Status.FFMPEG_CONVERT_FAIL:     True,
     Status.DUP_INTERNAL_NAME:       True,
     Status.BAD_OGG_META:            True,
-    Status.PACK_DIR_IN_USE:         True
+    Status.PACK_DIR_IN_USE:         True,
+    Status.PARTIAL_CONVERT:         True,
+    Status.CANCELLED:               False,
+    Status.BUILD_IN_PROGRESS:       False
 }
 
 #dictionary to associate digit : digit name
@@ -288,6 +407,12 @@ class DiscListEntryContents:
     length_s:           float = 0.0
     length_t:           int = 0
     custom_model_data:  int = 0
+    channels:           int = 0
+    sample_rate:        int = 0
+    size:               int = 0
+    sha256:             str = ""
+    sound_name:         str = ""    #names of the track and texture in the resourcepack, shared
+    texture_name:       str = ""    #  by entries with the same audio or image
 
 #TODO: use iter and next so you don't have to iterate over entries?
 @dataclass
@@ -313,18 +438,90 @@ class DiscListContents:
     def internal_names(self):
         return [entry.internal_name for entry in self.entries]
 
+#dataclass to store stream info read from a track's headers
+@dataclass
+class TrackProbeContents:
+    codec:              AudioCodec = AudioCodec.UNKNOWN
+    channels:           int = 0
+    sample_rate:        int = 0
+    length_s:           float = 0.0
+    bitrate:            int = 0
+
+#dataclass to store Vorbis encoder settings chosen to fit a size limit
+#bitrate is the expected average, used to plan the pack's size
+@dataclass
+class EncodeProfileContents:
+    quality:            float = 3.0
+    sample_rate:        int = 44100
+    channels:           int = 2
+    bitrate:            int = 112000
+
+#dataclass to store a rough estimate of a pack, made before generating it
+#pending is how many tracks weren't probed yet, and aren't included
+@dataclass
+class PackEstimateContents:
+    size_bytes:         int = 0
+    convert_s:          float = 0.0
+    pending:            int = 0
+
+#dataclass to store what writing a pack to disk took
+#dirs counts the directories made, files the rendered files and assets the
+#  tracks and textures; write_s is the time spent writing them all, added up
+#  across writer threads
+@dataclass
+class WriteMetricsContents:
+    dirs:               int = 0
+    files:              int = 0
+    assets:             int = 0
+    bytes:              int = 0
+    write_s:            float = 0.0
+
 #dataclass to store data to be passed to multiprocessing
 #  workers while converting files to ogg
-#also tells the process whether it should convert ogg files
-#  or not, TODO: redesign so that this doesn't need to contain
-#  the setting, or contains all settings
+#also tells the process whether it should always re-encode ogg
+#  files, and whether the output must be mono
+#  TODO: redesign so that this doesn't need to contain
+#  the settings, or contains all settings
 @dataclass
 class MpTaskContents:
     args: str
     proc_ogg: bool
+    mix_mono: bool
     src_track: str
-    tmp_track: str
     out_track: str
+    probe: TrackProbeContents = field(default_factory=TrackProbeContents)
+    seg_start_s: float = 0.0                #time range to convert, if this task is one segment
+    seg_length_s: float = 0.0               #  of a longer track. 0 converts until the end
+    index: int = 0                          #position of the track in the entry list
+    gain_db: float = 0.0                    #volume change applied while converting
+    trim_start_s: float = 0.0               #part of the track to keep, if silence is trimmed
+    trim_length_s: float = 0.0              #  from its ends. 0 keeps it all
+    profile: Optional[EncodeProfileContents] = None     #encoder settings, if the pack has a size limit
+    src_hash: str = ''                      #hash of the source's contents, if it's needed for a cache key
+
+#dataclass to store info about a converted track, returned by
+#  multiprocessing workers so the main thread doesn't have to
+#  open every converted file again
+@dataclass
+class ConvertResultContents:
+    index:              int = 0
+    out_track:          str = ""
+    length_s:           float = 0.0
+    length_t:           int = 0
+    channels:           int = 0
+    sample_rate:        int = 0
+    size:               int = 0
+    sha256:             str = ""
+    status:             Status = Status.SUCCESS
+
+#dataclass to store measurements of a source track, made before
+#  converting it. Measurements that weren't made are None
+@dataclass
+class TrackAnalysisContents:
+    index:              int = 0
+    loudness_lufs:      Optional[float] = None      #integrated loudness
+    peak_db:            Optional[float] = None      #true peak
+    silence:            Optional[dict] = None       #audible part of the track, see SilenceDetector
 
 
 
@@ -346,9 +543,13 @@ SettingsListContents = [
     SettingContents(key='zip',          type=SettingType.CHECK,     label=DisplayStrings.STR_ZIP_TITLE,         tooltip=DisplayStrings.STR_ZIP_TOOLTIP          ),
     SettingContents(key='mix_mono',     type=SettingType.CHECK,     label=DisplayStrings.STR_MIXMONO_TITLE,     tooltip=DisplayStrings.STR_MIXMONO_TOOLTIP      ),
     SettingContents(key='legacy_dp',    type=SettingType.CHECK,     label=DisplayStrings.STR_DP_VER_TITLE,      tooltip=DisplayStrings.STR_DP_VER_TOOLTIP       ),
-#   SettingContents(key='keep_tmp',     type=SettingType.CHECK,     label=DisplayStrings.STR_KEEPTMP_TITLE,     tooltip=DisplayStrings.STR_KEEPTMP_TOOLTIP      )
-    SettingContents(key='par_proc',     type=SettingType.CHECK,     label=DisplayStrings.STR_PAR_PROC_TITLE,    tooltip=DisplayStrings.STR_PAR_PROC_TOOLTIP     ),
-    SettingContents(key='proc_ogg',     type=SettingType.CHECK,     label=DisplayStrings.STR_PROC_OGG,          tooltip=DisplayStrings.STR_PROC_OGG_TOOLTIP,    )
+    SettingContents(key='keep_tmp',     type=SettingType.CHECK,     label=DisplayStrings.STR_KEEPTMP_TITLE,     tooltip=DisplayStrings.STR_KEEPTMP_TOOLTIP      ),
+    SettingContents(key='par_proc',     type=SettingType.CHECK,     label=DisplayStrings.STR_PAR_PROC_TITLE,    tooltip=DisplayStrings.STR_PAR_PROC_TOOLTIP,    params=True),
+    SettingContents(key='preconvert',   type=SettingType.CHECK,     label=DisplayStrings.STR_PRECONVERT_TITLE,  tooltip=DisplayStrings.STR_PRECONVERT_TOOLTIP,  params=True),
+    SettingContents(key='proc_ogg',     type=SettingType.CHECK,     label=DisplayStrings.STR_PROC_OGG,          tooltip=DisplayStrings.STR_PROC_OGG_TOOLTIP,    ),
+    SettingContents(key='normalize',    type=SettingType.CHECK,     label=DisplayStrings.STR_NORMALIZE_TITLE,   tooltip=DisplayStrings.STR_NORMALIZE_TOOLTIP    ),
+    SettingContents(key='trim_silence', type=SettingType.CHECK,     label=DisplayStrings.STR_TRIM_TITLE,        tooltip=DisplayStrings.STR_TRIM_TOOLTIP         ),
+    SettingContents(key='size_budget',  type=SettingType.NUM_ENTRY, label=DisplayStrings.STR_BUDGET_TITLE,      tooltip=DisplayStrings.STR_BUDGET_TOOLTIP,      params=Constants.SIZE_BUDGET_MAX_MB)
 ]
 
 
@@ -427,6 +628,11 @@ QProgressBar#GenProgress::chunk {
     background-color: rgb(46, 170, 78);
 }
 
+QLabel#PackEstimate {
+    color: lightgray;
+    padding-left: 12px;
+}
+
 QLabel#GenLabel {
     color: white;
     font-size: 32px;
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs track analysis module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import re
+import json
+import tempfile
+
+from typing import Optional
+
+from src.definitions import Constants
+from src.generator.ffmpeg import FFmpegJob, run_ffmpeg
+from src.generator.cache import hash_source
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  #type: ignore[assignment]
+
+
+
+# FFmpeg's ebur128 filter prints a summary when it's done, e.g.
+#   I:         -22.2 LUFS
+#   ...
+#   Peak:      -21.5 dBFS
+# silent tracks are reported as -70 LUFS and -inf dBFS
+LOUDNESS_REGEX = re.compile(r'^\s*I:\s+(-?[\d.]+|-inf) LUFS', re.MULTILINE)
+PEAK_REGEX = re.compile(r'^\s*Peak:\s+(-?[\d.]+|-inf) dBFS', re.MULTILINE)
+
+# ebur128 never reports integrated loudness below this
+SILENCE_LUFS = -70.0
+
+# silence is detected on a mono mix of the track, at its own sample rate
+#   (or this one, if the headers don't say)
+PCM_FORMAT = 'f32le'
+PCM_SAMPLE_RATE = 48000
+
+
+
+# On-disk store of measurements made on source tracks, so each track is
+#   only measured once no matter how many builds use it
+#
+# Measurements are kept as one small JSON file per source, named after a
+#   hash of the source's contents, in a directory next to the transcode
+#   cache so they never count towards its size limit. Different kinds of
+#   measurements are stored side by side in that file
+class AnalysisCache():
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def make_key(self, src_track: str) -> str:
+        return f"{hash_source(src_track)}-{Constants.ANALYSIS_VERSION}"
+
+    # sharded the same way as the transcode cache
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + '.json')
+
+    # returns a dictionary of kind : measurement, empty if nothing was cached
+    def fetch(self, key: str) -> dict:
+        try:
+            with open(self.get_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        except (OSError, ValueError):
+            return {}
+
+    # add measurements of a source, keeping any already cached
+    # failing to cache is not an error, the source is just measured again
+    def store(self, key: str, measurements: dict):
+        entry = self.get_path(key)
+        merged = self.fetch(key)
+        merged.update(measurements)
+
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix='.part', dir=os.path.dirname(entry))
+
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(merged, f)
+
+            os.replace(tmp, entry)
+
+        except OSError:
+            pass
+
+def get_analysis_cache() -> AnalysisCache:
+    return AnalysisCache(Constants.ANALYSIS_DIR_NAME)
+
+
+
+# measure a track, decoding it only once no matter how many measurements
+#   are asked for
+#   loudness: integrated loudness and true peak, per EBU R128
+#   silence:  where the audible part of the track starts and ends
+# returns a dictionary of kind : measurement, which is what AnalysisCache
+#   stores
+def measure_track(src_track: str, loudness: bool, silence: bool, sample_rate: int = 0, job: Optional[FFmpegJob] = None) -> dict:
+    args = ['-i', src_track]
+    measurements: dict = {}
+
+    if loudness:
+        args += ['-map', '0:a:0', '-af', 'ebur128=framelog=quiet:peak=true', '-f', 'null', '-']
+
+    detector = None
+    if silence and np is not None:
+        sample_rate = sample_rate or PCM_SAMPLE_RATE
+        detector = SilenceDetector(sample_rate)
+        args += ['-map', '0:a:0', '-ac', '1', '-ar', str(sample_rate), '-f', PCM_FORMAT, 'pipe:1']
+
+    elif silence:
+        print("numpy is not available, silence can't be trimmed")
+
+    if len(args) == 2:
+        return measurements
+
+    log = run_ffmpeg(args, job, loglevel='info', output_cb=(detector.feed if detector is not None else None))
+
+    if loudness:
+        measurements['loudness'] = {'lufs': parse_db(LOUDNESS_REGEX, log), 'peak_db': parse_db(PEAK_REGEX, log)}
+
+    if detector is not None:
+        measurements['silence'] = detector.finish()
+
+    return measurements
+
+# read the last value a regex matches in FFmpeg's log
+def parse_db(regex: re.Pattern, log: str) -> Optional[float]:
+    matches = regex.findall(log)
+    if not matches:
+        return None
+
+    return float(matches[-1])
+
+# gain that brings a track to the target loudness without clipping
+# tracks that are silent, or already close enough, are left alone
+def loudness_gain(loudness_lufs: Optional[float], peak_db: Optional[float], target_lufs: float) -> float:
+    if loudness_lufs is None or loudness_lufs <= SILENCE_LUFS:
+        return 0.0
+
+    gain = target_lufs - loudness_lufs
+
+    if peak_db is not None:
+        gain = min(gain, Constants.LOUDNESS_MAX_PEAK_DB - peak_db)
+
+    gain = max(-Constants.LOUDNESS_MAX_GAIN_DB, min(gain, Constants.LOUDNESS_MAX_GAIN_DB))
+
+    if abs(gain) < Constants.LOUDNESS_MIN_GAIN_DB:
+        return 0.0
+
+    #rounded so that the same track always gets the same filter, and the
+    #  same cache entry
+    return round(gain, 1)
+
+
+
+# Find where the audible part of a track starts and ends
+#
+# Mono 32-bit float samples are fed in as raw bytes, in chunks of any size.
+#   They're split into short blocks, and a block is audible if its RMS level
+#   is above a threshold. Whole chunks are processed at once with numpy, and
+#   only the first and last audible blocks are remembered, so even very long
+#   tracks take hardly any memory
+class SilenceDetector():
+
+    def __init__(self, sample_rate: int):
+        self.sample_rate = sample_rate
+        self.block = max(1, int(sample_rate * Constants.SILENCE_BLOCK_S))
+
+        #mean square of a block at the threshold
+        self._threshold = 10 ** (Constants.SILENCE_THRESHOLD_DB / 10)
+
+        self._pending = b''
+        self._blocks = 0
+        self._samples = 0
+        self._first = None
+        self._last = None
+
+    def feed(self, data: bytes):
+        data = self._pending + data
+
+        #keep samples that don't make up a whole block for next time
+        whole = (len(data) // (4 * self.block)) * self.block
+        self._pending = data[whole * 4:]
+        self._samples += whole
+
+        self.process(np.frombuffer(data, dtype='<f4', count=whole).reshape(-1, self.block))
+
+    def process(self, blocks):
+        if len(blocks) == 0:
+            return
+
+        loud = np.flatnonzero(np.mean(np.square(blocks, dtype=np.float64), axis=1) > self._threshold)
+
+        if len(loud) > 0:
+            if self._first is None:
+                self._first = self._blocks + loud[0]
+            self._last = self._blocks + loud[-1]
+
+        self._blocks += len(blocks)
+
+    # returns the audible part's start and end, and the track's total
+    #   length, in seconds. Start and end are None for a silent track
+    def finish(self) -> dict:
+        #last, partial block
+        tail = np.frombuffer(self._pending, dtype='<f4', count=len(self._pending) // 4)
+        tail_end = self._samples + len(tail)
+
+        if len(tail) > 0:
+            self.process(np.pad(tail, (0, self.block - len(tail))).reshape(1, -1))
+
+        result = {'start_s': None, 'end_s': None, 'length_s': tail_end / self.sample_rate}
+
+        if self._first is not None:
+            result['start_s'] = (self._first * self.block) / self.sample_rate
+            result['end_s'] = min(tail_end, (self._last + 1) * self.block) / self.sample_rate
+
+        return result
+
+# time range to convert, to cut off a track's leading and trailing silence
+#   but keep padding_s of it at each end
+# returns (start, length) in seconds, or (0, 0) if there's nothing worth
+#   trimming
+def silence_trim(silence: Optional[dict], padding_s: float) -> tuple:
+    if not silence or silence.get('start_s', None) is None:
+        return (0.0, 0.0)
+
+    start_s = max(0.0, silence['start_s'] - padding_s)
+    end_s = min(silence['length_s'], silence['end_s'] + padding_s)
+
+    if start_s + (silence['length_s'] - end_s) < Constants.TRIM_MIN_S:
+        return (0.0, 0.0)
+
+    #rounded so that the same track always gets the same cache entry
+    return (round(start_s, 3), round(end_s - start_s, 3))
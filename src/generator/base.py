@@ -4,25 +4,45 @@
 #Generation tool, datapack design, and resourcepack design by link2_thepast
 
 import os
+import time
 import shutil
-import pyffmpeg
-import tempfile
-import multiprocessing
+import hashlib
 
 from math import ceil
-from typing import Callable
+from typing import Any, Callable, Optional
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from contextlib import contextmanager
+from dataclasses import replace
 from mutagen import MutagenError
-from mutagen.mp3 import MP3, HeaderNotFoundError
 from mutagen.oggvorbis import OggVorbis
-from src.definitions import Status, IMDException, DiscListContents, DiscListEntryContents, MpTaskContents
+from src.definitions import Constants, Status, IMDException, AudioCodec, ConvertMode, ConvertBackend, StagingPolicy
+from src.definitions import DiscListContents, DiscListEntryContents, MpTaskContents, TrackProbeContents, ConvertResultContents, TrackAnalysisContents
+from src.generator.cache import get_cache, hash_file, hash_source
+from src.generator.probe import get_probe_cache
+from src.generator.ffmpeg import FFmpegJob, run_ffmpeg
+from src.generator.staging import create_staging_dir, lock_staging_dir, unlock_staging_dir, unlink_output, STAGING_LOCK_NAME
+from src.generator.ogg import join_vorbis, OggFormatError
+from src.generator.journal import BuildJournal, is_output_intact
+from src.generator.schedule import estimate_cost, estimate_makespan, order_longest_first, pack_batches
+from src.generator.progress import ConvertProgress
+from src.generator.analysis import get_analysis_cache, measure_track, loudness_gain, silence_trim
+from src.generator.budget import get_budget_bytes, get_other_bytes, plan_profiles, get_profile_args
+from src.generator.dedup import find_duplicates
+import src.generator.executor as executor_factory
+import src.generator.pyav as pyav
 
 
 
 class VirtualGenerator():
     def __init__(self):
         self.tmp_path = None
+        self.cache = None
+        self.job = FFmpegJob()
+        self.progress = None
+        self.backend = ConvertBackend.FFMPEG
+        self.analysis_cache = None
+        self.pack_size = 0
 
     def validate(self, entry_list: DiscListContents, settings={}):
         packpng = settings.get('pack', '')
@@ -84,53 +104,273 @@ class VirtualGenerator():
 
 
 
-    def create_tmp(self):
+    def create_tmp(self, settings={}):
         if self.tmp_path != None:
+            unlock_staging_dir(self.tmp_path)
             shutil.rmtree(self.tmp_path)
+            self.tmp_path = None
 
-        self.tmp_path = tempfile.mkdtemp()
+        #stage next to the output by default, so converted tracks can be
+        #  moved into the resourcepack instead of copied
+        #the staging area is named after the pack and where it's written,
+        #  so a failed or interrupted build of the same pack can resume
+        #  from it. Only one build can use it at a time
+        policy = StagingPolicy(settings.get('staging', StagingPolicy.OUTPUT.value))
+        name = settings.get('name', Constants.DEFAULT_PACK_NAME)
+        output_dir = self.get_output_dir(settings)
+        build_id = hashlib.sha256(f'{output_dir}|{name}'.encode('utf-8')).hexdigest()[:16]
+
+        tmp_path = create_staging_dir(policy, build_id, output_dir)
+        if not lock_staging_dir(tmp_path):
+            raise IMDException(Status.BUILD_IN_PROGRESS)
+
+        self.tmp_path = tmp_path
+
+    # directory the packs are written to: 'output_dir' if it's set, or
+    #   the working directory
+    def get_output_dir(self, settings: dict) -> str:
+        return os.path.abspath(settings.get('output_dir', '') or os.curdir)
+
+    # if keep_completed is set, tracks the journal says are finished stay
+    #   in the staging area so the next attempt can resume from them, and
+    #   everything else (partial output, etc.) is removed
+    def cleanup_tmp(self, keep_completed: bool = False):
+        if self.tmp_path == None:
+            return
 
-    def cleanup_tmp(self):
-        if self.tmp_path != None:
+        keep = set()
+        if keep_completed:
+            done = BuildJournal(os.path.join(self.tmp_path, Constants.JOURNAL_NAME)).load().values()
+            keep = {os.path.basename(r.out_track) for r in done if is_output_intact(r)}
+
+        #the lock is held until the staging area is cleaned up, so another
+        #  build can't start using it in the meantime
+        if keep:
+            keep.update([Constants.JOURNAL_NAME, STAGING_LOCK_NAME])
+            for name in os.listdir(self.tmp_path):
+                if name in keep:
+                    continue
+
+                path = os.path.join(self.tmp_path, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+        else:
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+        unlock_staging_dir(self.tmp_path)
+
+        #Windows can't remove the lock file while it's open
+        if not keep:
             shutil.rmtree(self.tmp_path, ignore_errors=True)
-            self.tmp_path = None
+
+        self.tmp_path = None
+
+    # stop a build from another thread. Running conversions are killed and
+    #   the rest are dropped; the build raises Status.CANCELLED
+    def cancel(self):
+        self.job.cancel()
 
 
 
-    def convert_all_to_ogg(self, entry_list: DiscListContents, settings: dict, convert_cb: Callable):
+    def convert_all_to_ogg(self, entry_list: DiscListContents, settings: dict, convert_cb: Callable,
+                           estimate_cb: Optional[Callable] = None, progress_cb: Optional[Callable] = None):
         args: list[MpTaskContents] = []
+        failed: list[MpTaskContents] = []
+        sizes: list[int] = []
+
+        # reuse tracks converted by previous builds or in the background,
+        #   if the user desires
+        # the cache travels to child processes along with the generator
+        self.cache = get_cache(settings)
+        self.backend = pyav.get_backend(settings)
 
         # pre-prepare paths to reduce work and data transfer in
         #   child threads
-        for e in entry_list.entries:
+        # the same audio is only converted once, no matter how many entries
+        #   use it; the rest share the first entry's converted file
+        firsts = find_duplicates(entry_list.track_files)
+
+        for (i, e) in enumerate(entry_list.entries):
+            e.sound_name = entry_list.entries[firsts[i]].internal_name
+
+            if firsts[i] != i:
+                convert_cb()
+                continue
+
             arg = self.prepare_for_convert(e, settings)
+            arg.index = i
             args.append(arg)
 
-        # use multiprocessing to run FFmpeg over many files in parallel, if the user desires
-        if(settings.get('par_proc', False)):
-            cpus = multiprocessing.cpu_count()
+        by_index = {a.index: a for a in args}
+        self.job.check()
 
-            with multiprocessing.Pool(processes=cpus) as pool:
-                result = pool.imap_unordered(self.convert_to_ogg, args)
+        # hash sources for their cache keys here, once, rather than in every
+        #   worker, process or machine that converts a part of them
+        # missing files are reported when they're converted
+        if self.cache is not None:
+            for a in args:
+                try:
+                    a.src_hash = hash_source(a.src_track)
+                except OSError:
+                    pass
+
+        # measure tracks that need it before converting them, since the
+        #   measurements decide how they're converted
+        self.analyze_all(args, settings)
+
+        # pick encoder settings that fit the tracks into the size limit, if
+        #   the user set one. This goes by the tracks' (trimmed) lengths
+        self.plan_budget(args, entry_list, settings)
+
+        self.job.check()
+
+        # pick up work finished by an earlier attempt at this build
+        journal = BuildJournal(os.path.join(self.tmp_path, Constants.JOURNAL_NAME))
+        done = journal.load()
+
+        # track progress through the audio itself, so the progress bar keeps
+        #   moving while long tracks convert
+        progress = None
+        if progress_cb is not None:
+            progress = ConvertProgress(sum(a.probe.length_s for a in args), progress_cb)
+
+        # record a finished track, and point its entry to the converted file
+        def finish(data: MpTaskContents, result: ConvertResultContents):
+            if result.status != Status.SUCCESS:
+                failed.append(data)
+                return
+
+            journal.record(self.get_unit_key(data), result)
+            self.apply_result(entry_list.entries[data.index], result)
+            sizes.append(result.size)
+
+        # run FFmpeg over many files in parallel, if the user desires
+        # otherwise run them one-by-one
+        with journal, executor_factory.get(settings) as executor:
+            self.job.on_cancel(executor.cancel)
+
+            # worker processes can't report back until a task is done, so
+            #   they only update progress as each track finishes
+            self.progress = progress if executor.shares_memory else None
+
+            tasks: list[MpTaskContents] = []
+            costs: list[float] = []
+
+            # split very long tracks into segments that can be encoded
+            #   at the same time, then joined back together
+            segments: dict[str, list[MpTaskContents]] = {}
+            parents: dict[str, tuple[MpTaskContents, MpTaskContents]] = {}     #segment's out_track : (segment, its track)
+            pending: dict[str, int] = {}
+            failed_parents: set[str] = set()
 
-                # imap_unordered yields every time a task finishes; by iterating
-                #   over the returned iterable like this we can cause
-                #   cb_update to run after each task finishes. Only works
-                #   with imap, not map or starmap
-                for r in result:
+            for a in args:
+                result = self.resume_task(a, done)
+                if result is not None:
+                    self.apply_result(entry_list.entries[a.index], result)
+                    sizes.append(result.size)
+                    if progress is not None:
+                        progress.finish(a.out_track, self.get_task_length(a))
                     convert_cb()
+                    continue
 
-        # otherwise, by default, run them one-by-one (multiprocessing doesn't work for
-        #   everyone and it's better to opt-in to an experimental feature than for the app
-        #   to break by default)
-        else:
-            for a in args:
-                self.convert_to_ogg(a)
-                convert_cb()
+                mode = self.plan_conversion(a, a.probe)
+                cost = estimate_cost(a.probe, mode, os.path.getsize(a.src_track))
+
+                segs = self.split_for_convert(a, mode, executor.workers)
+                if not segs:
+                    tasks.append(a)
+                    costs.append(cost)
+                    continue
+
+                segments[a.out_track] = segs
+                pending[a.out_track] = 0
+
+                for seg in segs:
+                    parents[seg.out_track] = seg, a
+
+                    if self.resume_task(seg, done) is None:
+                        pending[a.out_track] += 1
+                        tasks.append(seg)
+                        costs.append(cost / len(segs))
+                    elif progress is not None:
+                        progress.finish(seg.out_track, self.get_task_length(seg))
+
+                # every segment was finished by an earlier attempt
+                if pending[a.out_track] == 0:
+                    finish(a, self.join_segments(a, segs))
+                    convert_cb()
+
+            # convert short clips several at a time, to save starting
+            #   FFmpeg over and over
+            (units, costs) = self.batch_for_convert(tasks, costs, executor.workers, settings)
+
+            if estimate_cb is not None:
+                estimate_cb(estimate_makespan(sorted(costs, reverse=True), executor.workers))
+
+            # the longest tasks are started first so that the last few
+            #   finish at about the same time
+            units = order_longest_first(units, costs)
+
+            for results in executor.imap_unordered(self.convert_batch, units):
+                for r in results:
+                    if r.out_track not in parents:
+                        if progress is not None:
+                            progress.finish(r.out_track, self.get_task_length(by_index[r.index]))
+
+                        finish(by_index[r.index], r)
+                        convert_cb()
+                        continue
+
+                    # segments are journaled on their own, so a failed track
+                    #   only needs its failed segments converted again
+                    (seg, parent) = parents[r.out_track]
+
+                    if progress is not None:
+                        progress.finish(seg.out_track, self.get_task_length(seg))
+
+                    if r.status == Status.SUCCESS:
+                        journal.record(self.get_unit_key(seg), r)
+                    else:
+                        failed_parents.add(parent.out_track)
+
+                    # join a segmented track once all its segments are done
+                    pending[parent.out_track] -= 1
+                    if pending[parent.out_track] > 0:
+                        continue
+
+                    if parent.out_track in failed_parents:
+                        failed.append(parent)
+                    else:
+                        finish(parent, self.join_segments(parent, segments[parent.out_track]))
+
+                    convert_cb()
+
+            self.progress = None
+
+        if progress is not None:
+            progress.emit(force=True)
+
+        # keep the cache under its size limit
+        if self.cache is not None:
+            self.cache.evict()
+
+        # report every track that failed at once, instead of stopping at the first
+        # the staging area is left in place so the next attempt can resume
+        if failed:
+            names = ', '.join(os.path.basename(f.src_track) for f in sorted(failed, key=lambda f: f.index))
+            print(f"Failed to convert: {names}")
+            raise IMDException(Status.PARTIAL_CONVERT, names)
+
+        for (i, e) in enumerate(entry_list.entries):
+            if firsts[i] != i:
+                self.share_track(e, entry_list.entries[firsts[i]])
+
+        # report how big the pack came out, for comparing against the limit
+        self.pack_size = sum(sizes) + get_other_bytes(entry_list, settings)
 
-        # update entry list to point to converted files
-        for (a, e) in zip(args, entry_list.entries):
-            e.track_file = a.out_track
 
 
 
@@ -144,58 +384,273 @@ class VirtualGenerator():
         if settings.get('mix_mono', False):
             args += ' -ac 1'
 
-        # detect whether ogg files should be processed
-        proc_ogg = settings.get('proc_ogg', False) or settings.get('mix_mono', False)
-
-        # prepare input file
-        track_ext = track.split('/')[-1].split('.')[-1]
-        tmp_track = os.path.join(self.tmp_path, internal_name + '.tmp.' + track_ext)
-        shutil.copyfile(track, tmp_track)
-
-        #strip any ID3 metadata from mp3
-        if '.mp3' in tmp_track:
-            try:
-                meta_mp3 = MP3(tmp_track)
-                meta_mp3.delete()
-                meta_mp3.save()
-            except HeaderNotFoundError:
-                #no metadata to be removed, ignore
-                pass
-
-        #exit if metadata removal failed
-        if not os.path.isfile(tmp_track):
-            raise IMDException(Status.BAD_MP3_META)
+        # detect whether ogg files should always be re-encoded, and whether
+        #   the output must be mono. Otherwise the probe decides
+        proc_ogg = settings.get('proc_ogg', False)
+        mix_mono = settings.get('mix_mono', False)
 
         # prepare output file location
+        # the source is read in place; metadata is stripped by FFmpeg
+        #   during conversion instead of from a copy of the source
         out_name = internal_name + '.ogg'
         out_track = os.path.join(self.tmp_path, out_name)
 
-        return MpTaskContents(args, proc_ogg, track, tmp_track, out_track)
+        # read the track's headers up front; this is cheap, and lets tracks
+        #   be scheduled by how long they will take to convert
+        # usually already done when the track was added to the list
+        probe = get_probe_cache().probe(track)
+
+        return MpTaskContents(args, proc_ogg, mix_mono, track, out_track, probe)
+
+    # measure every track that needs it, several at a time if the user
+    #   desires. Measurements are cached by the source's contents, so
+    #   tracks are only ever measured once
+    def analyze_all(self, args: list, settings: dict):
+        if not (settings.get('normalize', False) or settings.get('trim_silence', False)):
+            return
+
+        self.analysis_cache = get_analysis_cache()
+
+        by_index = {a.index: a for a in args}
 
+        with executor_factory.get_local(settings) as executor:
+            self.job.on_cancel(executor.cancel)
 
+            for a in executor.imap_unordered(partial(self.analyze_track, settings=settings), args):
+                self.apply_analysis(by_index[a.index], a, settings)
 
-    def convert_to_ogg(self, data: MpTaskContents):
+    def analyze_track(self, data: MpTaskContents, settings: dict) -> TrackAnalysisContents:
+        cache = self.analysis_cache
+        key = cache.make_key(data.src_track)
+        cached = cache.fetch(key)
 
-        #create FFmpeg reference
-        #TODO: once you update to a new version that's not broken, make sure to
-        #  add 'enable_log=False' to this constructor
-        ffmpeg = pyffmpeg.FFmpeg()
+        # measure whatever isn't cached yet, in one pass over the track
+        loudness = settings.get('normalize', False) and 'loudness' not in cached
+        silence = settings.get('trim_silence', False) and 'silence' not in cached
 
-        # decide whether to convert or copy ogg source files
-        # copy by default, since FFmpeg sometimes fails to convert files,
-        #   and that causes pack generation to fail. Copying is more likely
-        #   to work
-        if(not data.proc_ogg and ".ogg" in data.tmp_track):
-            shutil.copyfile(data.tmp_track, data.out_track)
+        if loudness or silence:
+            try:
+                measured = measure_track(data.src_track, loudness, silence, data.probe.sample_rate, self.job)
+                cache.store(key, measured)
+                cached.update(measured)
+
+            #a broken track is reported when it fails to convert
+            except IMDException as e:
+                if e.status == Status.CANCELLED:
+                    raise
+
+        result = TrackAnalysisContents(index=data.index)
+        result.loudness_lufs = cached.get('loudness', {}).get('lufs', None)
+        result.peak_db = cached.get('loudness', {}).get('peak_db', None)
+        result.silence = cached.get('silence', None)
+
+        return result
+
+    # decide how to convert a track from its measurements
+    def apply_analysis(self, data: MpTaskContents, analysis: TrackAnalysisContents, settings: dict):
+        if settings.get('normalize', False):
+            target = settings.get('loudness_target', Constants.LOUDNESS_TARGET_LUFS)
+            data.gain_db = loudness_gain(analysis.loudness_lufs, analysis.peak_db, target)
+
+        # only convert the audible part of the track, so everything after
+        #   this (scheduling, segments, progress) works with its new length
+        if settings.get('trim_silence', False):
+            padding_s = settings.get('trim_padding_s', Constants.TRIM_PADDING_S)
+            (data.trim_start_s, data.trim_length_s) = silence_trim(analysis.silence, padding_s)
+
+            if data.trim_length_s > 0:
+                data.probe = replace(data.probe, length_s=data.trim_length_s)
+
+    # pick encoder settings for every track so that the resourcepack fits in
+    #   the size limit. Tracks with unknown lengths are guessed at from
+    #   their file size
+    def plan_budget(self, args: list, entry_list: DiscListContents, settings: dict):
+        budget_bytes = get_budget_bytes(entry_list, settings)
+        if budget_bytes <= 0:
             return
 
-        #convert file
+        lengths = []
+        channels = []
+
+        for a in args:
+            length_s = a.probe.length_s
+            if length_s <= 0:
+                length_s = (os.path.getsize(a.src_track) * 8) / Constants.FALLBACK_BITRATE
+
+            lengths.append(length_s)
+            channels.append(1 if (a.mix_mono or a.probe.channels == 1) else 2)
+
+        for (a, profile) in zip(args, plan_profiles(lengths, channels, budget_bytes)):
+            a.profile = profile
+
+    # everything that affects a task's converted file, to tell whether
+    #   work journaled by an earlier attempt can be reused
+    def get_unit_key(self, data: MpTaskContents) -> str:
+        st = os.stat(data.src_track)
+
+        return '|'.join(str(k) for k in [Constants.CACHE_VERSION, data.src_track, st.st_mtime_ns, st.st_size,
+                                         data.args, self.get_filters(data), data.proc_ogg, data.out_track, data.seg_start_s, data.seg_length_s,
+                                         data.trim_start_s, data.trim_length_s, self.get_profile_args(data)])
+
+    # cache key for a track's converted file
+    def get_cache_key(self, data: MpTaskContents) -> str:
+        options = [data.args] + self.get_filters(data)
+        if data.trim_length_s > 0:
+            options.append(f'trim={data.trim_start_s:.3f}:{data.trim_length_s:.3f}')
+
+        options += self.get_profile_args(data)
+
+        return self.cache.make_key(data.src_hash or hash_source(data.src_track), ' '.join(options), data.proc_ogg)
+
+    # seconds of audio a task converts, going by the track's headers
+    def get_task_length(self, data: MpTaskContents) -> float:
+        if data.seg_length_s > 0:
+            return data.seg_length_s
+
+        return max(0.0, data.probe.length_s - data.seg_start_s)
+
+    # part of the source track a task converts, as (start, length) in
+    #   seconds. A length of 0 runs to the end of the track
+    # segments are cut by their filters instead; see get_filters()
+    def get_input_range(self, data: MpTaskContents) -> tuple:
+        if self.is_segment(data):
+            return (0.0, 0.0)
+
+        start_s = data.trim_start_s + data.seg_start_s
+        length_s = data.seg_length_s
+
+        if length_s == 0 and data.trim_length_s > 0:
+            length_s = max(0.0, data.trim_length_s - data.seg_start_s)
+
+        return (start_s, length_s)
+
+    def get_input_args(self, data: MpTaskContents) -> list:
+        (start_s, length_s) = self.get_input_range(data)
+        input_args = []
+
+        #seek before opening the input, so a segment doesn't have to
+        #  decode everything in front of it
+        if start_s > 0:
+            input_args += ['-ss', f'{start_s:.6f}']
+        if length_s > 0:
+            input_args += ['-t', f'{length_s:.6f}']
+
+        return input_args
+
+    # returns the result of a task finished by an earlier attempt, or
+    #   None if it has to be converted (again)
+    def resume_task(self, data: MpTaskContents, done: dict):
+        result = done.get(self.get_unit_key(data), None)
+
+        if result is None or not is_output_intact(result):
+            return None
+
+        #the track may have moved in the list since
+        return replace(result, index=data.index)
+
+
+
+    # convert a track, trying again after a short wait if it fails
+    # failures are returned instead of raised, so one bad track doesn't
+    #   stop the rest of the tracks from converting. Only cancelling the
+    #   build stops it
+    def convert_with_retry(self, data: MpTaskContents) -> ConvertResultContents:
+        delay = Constants.CONVERT_RETRY_DELAY_S
+
+        for attempt in range(Constants.CONVERT_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(delay)
+                delay *= 2
+
+            try:
+                return self.convert_to_ogg(data)
+
+            except IMDException as e:
+                if e.status == Status.CANCELLED:
+                    raise
+
+                status = e.status
+
+        return ConvertResultContents(index=data.index, out_track=data.out_track, status=status)
+
+    # convert a batch of tasks; see batch_for_convert()
+    # a batch is converted by one FFmpeg process. If that fails, e.g. because
+    #   one of the clips is broken, each clip is converted on its own so the
+    #   rest of the batch still succeeds
+    def convert_batch(self, batch: list) -> list:
+        if len(batch) == 1:
+            return [self.convert_with_retry(batch[0])]
+
+        results = []
+        todo = []
+
+        for data in batch:
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.get_cache_key(data)
+
+                if self.cache.fetch(cache_key, data.out_track):
+                    results.append(self.describe_track(data))
+                    continue
+
+            todo.append((data, cache_key))
+
         try:
-            ffmpeg.options(f"-nostdin -y -i {data.tmp_track} -c:a libvorbis{data.args} {data.out_track}")
+            if todo:
+                self.ffmpeg_convert_batch([d for (d, k) in todo])
 
-        except Exception as e:
-            print(e)
-            raise IMDException(Status.FFMPEG_CONVERT_FAIL)
+        except IMDException:
+            return results + [self.convert_with_retry(d) for (d, k) in todo]
+
+        for (data, cache_key) in todo:
+            try:
+                if not os.path.isfile(data.out_track) or os.path.getsize(data.out_track) == 0:
+                    raise IMDException(Status.BAD_OGG_CONVERT)
+
+                if cache_key is not None:
+                    self.cache.store(cache_key, data.out_track)
+
+                results.append(self.describe_track(data))
+
+            except IMDException:
+                results.append(self.convert_with_retry(data))
+
+        return results
+
+    # returns info about the converted track, read while it's still
+    #   in this worker's disk cache
+    def convert_to_ogg(self, data: MpTaskContents) -> ConvertResultContents:
+        is_segment = self.is_segment(data)
+
+        # serve unchanged tracks from the cache instead of converting them again
+        # segments are never cached, only the track they're joined into
+        if self.cache is not None and not is_segment:
+            cache_key = self.get_cache_key(data)
+
+            if self.cache.fetch(cache_key, data.out_track):
+                return self.describe_track(data)
+
+        # decide how much work the track actually needs
+        # only tracks that need encoding are split into segments
+        if is_segment:
+            mode = ConvertMode.ENCODE
+        else:
+            mode = self.plan_conversion(data, data.probe)
+
+        # remux compatible Vorbis without re-encoding; this only rewrites
+        #   the Ogg container, dropping metadata and any bad header data
+        # fall back to a full conversion if the stream can't be remuxed
+        if mode == ConvertMode.REMUX:
+            try:
+                self.convert_track(data, mode)
+            except IMDException as e:
+                if e.status == Status.CANCELLED:
+                    raise
+
+                mode = ConvertMode.ENCODE
+
+        if mode == ConvertMode.ENCODE:
+            self.convert_track(data, mode)
 
         #FIXME: uniquify exceptions
         #exit if file was not converted successfully
@@ -205,35 +660,298 @@ class VirtualGenerator():
         if os.path.getsize(data.out_track) == 0:
             raise IMDException(Status.BAD_OGG_CONVERT)
 
+        # segments are described once they're joined
+        if is_segment:
+            return ConvertResultContents(index=data.index, out_track=data.out_track, size=os.path.getsize(data.out_track))
 
+        if self.cache is not None:
+            self.cache.store(cache_key, data.out_track)
+
+        return self.describe_track(data)
+
+    # decide whether a track can be remuxed as-is, or must be re-encoded
+    # only Vorbis is playable by Minecraft; anything else (including Opus
+    #   saved as '.ogg') is re-encoded, as is Vorbis that doesn't meet the
+    #   target channel count or sample rate
+    def plan_conversion(self, data: MpTaskContents, probe: TrackProbeContents) -> ConvertMode:
+        if data.proc_ogg:
+            return ConvertMode.ENCODE
+
+        #filters and trimming change the audio itself
+        if self.get_filters(data) or data.trim_length_s > 0:
+            return ConvertMode.ENCODE
+
+        #the track has to be re-encoded to fit the pack's size limit
+        if data.profile is not None:
+            return ConvertMode.ENCODE
+
+        if probe.codec != AudioCodec.VORBIS:
+            return ConvertMode.ENCODE
+
+        if probe.channels > (1 if data.mix_mono else 2):
+            return ConvertMode.ENCODE
+
+        if probe.sample_rate > Constants.MAX_SAMPLE_RATE:
+            return ConvertMode.ENCODE
+
+        return ConvertMode.REMUX
+
+    # FFmpeg audio filters to apply to a track while encoding it
+    def get_filters(self, data: MpTaskContents) -> list:
+        filters = []
+
+        if data.gain_db != 0:
+            filters.append(f'volume={data.gain_db:.1f}dB')
+
+        # segments are cut from the whole decoded track, at the rate they're
+        #   encoded at, so they start at exactly the sample they should.
+        #   Seeking is only exact for some formats
+        if self.is_segment(data):
+            rate = self.get_output_rate(data)
+            (start, end) = self.get_segment_range(data)
+            trim_start = round(data.trim_start_s * rate)
+
+            atrim = f'atrim=start_sample={trim_start + start}'
+            if end > 0:
+                atrim += f':end_sample={trim_start + end}'
+
+            filters += [f'aresample={rate}', 'asetpts=N/SR/TB', atrim, 'asetpts=PTS-STARTPTS']
+
+        return filters
+
+    # sample rate a track is encoded at, or 0 if it isn't known
+    def get_output_rate(self, data: MpTaskContents) -> int:
+        rate = data.probe.sample_rate
+
+        if data.profile is not None:
+            rate = min(rate, data.profile.sample_rate) if rate > 0 else data.profile.sample_rate
+
+        return rate
+
+    def is_segment(self, data: MpTaskContents) -> bool:
+        return data.seg_start_s > 0 or data.seg_length_s > 0
+
+    def get_filter_args(self, data: MpTaskContents) -> list:
+        filters = self.get_filters(data)
+        if not filters:
+            return []
+
+        return ['-af', ','.join(filters)]
+
+    # encoder options chosen to fit the size limit, if there is one
+    def get_profile_args(self, data: MpTaskContents) -> list:
+        if data.profile is None:
+            return []
+
+        return get_profile_args(data.profile, data.probe.sample_rate)
+
+    # every option FFmpeg needs to encode a track
+    def get_encode_args(self, data: MpTaskContents) -> list:
+        return ['-c:a', 'libvorbis'] + data.args.split() + self.get_profile_args(data) + self.get_filter_args(data)
+
+    # convert a track with the selected backend
+    def convert_track(self, data: MpTaskContents, mode: ConvertMode):
+        unlink_output(data.out_track)
+
+        if self.backend == ConvertBackend.PYAV:
+            if mode == ConvertMode.REMUX:
+                pyav.remux_track(data.src_track, data.out_track, self.job)
+            else:
+                (start_s, length_s) = self.get_input_range(data)
+                pyav.encode_track(data.src_track, data.out_track, start_s, length_s, data.mix_mono,
+                                  self.get_filters(data), data.profile, self.job, self.get_progress_cb(data))
+
+        elif mode == ConvertMode.REMUX:
+            self.ffmpeg_convert(data, ['-c:a', 'copy'])
+
+        else:
+            self.ffmpeg_convert(data, self.get_encode_args(data))
+
+    # report how far a task has got, keyed by its output so segments of
+    #   the same track are counted separately
+    def get_progress_cb(self, data: MpTaskContents):
+        if self.progress is None:
+            return None
+
+        return lambda out_time_s, speed: self.progress.update(data.out_track, out_time_s, speed)
+
+    # run FFmpeg over a track, with the given codec options
+    # only the first audio stream is kept, which drops cover art and
+    #   other embedded streams, and all metadata (e.g. ID3 tags) is stripped
+    def ffmpeg_convert(self, data: MpTaskContents, codec_args: list):
+        run_ffmpeg(self.get_input_args(data) + ['-i', data.src_track, '-map', '0:a:0', '-map_metadata', '-1'] + codec_args + [data.out_track],
+                   self.job, self.get_progress_cb(data))
+
+    # run one FFmpeg process over several tracks, with an output for each
+    #   input. Output options only apply to the output that follows them,
+    #   so each track gets its own map, metadata and codec options
+    def ffmpeg_convert_batch(self, batch: list):
+        input_args = []
+        output_args = []
+
+        for (i, data) in enumerate(batch):
+            unlink_output(data.out_track)
+            input_args += self.get_input_args(data) + ['-i', data.src_track]
+            output_args += ['-map', f'{i}:a:0', '-map_metadata', '-1'] + self.get_encode_args(data) + [data.out_track]
+
+        run_ffmpeg(input_args + output_args, self.job)
+
+    # group short tracks that need encoding into batches, sized by their
+    #   total length. FFmpeg's startup takes longer than encoding a clip a
+    #   few seconds long, so this saves most of the time spent on packs of
+    #   many short clips. Everything else is converted on its own
+    # returns a list of batches and a list of their costs
+    def batch_for_convert(self, tasks: list, costs: list, workers: int, settings: dict):
+        #there's no process to start when converting in-process
+        if not settings.get('batch', True) or self.backend != ConvertBackend.FFMPEG:
+            return ([[t] for t in tasks], costs)
+
+        units = []
+        unit_costs = []
+        clips = []
+        clip_costs = []
+
+        for (t, c) in zip(tasks, costs):
+            if self.is_batchable(t):
+                clips.append(t)
+                clip_costs.append(c)
+            else:
+                units.append([t])
+                unit_costs.append(c)
+
+        # don't make batches so big that some workers are left with nothing
+        total_s = sum(c.probe.length_s for c in clips)
+        max_length_s = min(Constants.BATCH_MAX_LENGTH_S, total_s / max(1, workers))
+
+        for batch in pack_batches([c.probe.length_s for c in clips], max_length_s, Constants.BATCH_MAX_FILES):
+            units.append([clips[i] for i in batch])
+            unit_costs.append(Constants.JOB_OVERHEAD_S + sum(clip_costs[i] - Constants.JOB_OVERHEAD_S for i in batch))
+
+        return (units, unit_costs)
+
+    # only whole, short tracks that need encoding are batched
+    # the length has to be known up front to size batches
+    def is_batchable(self, data: MpTaskContents) -> bool:
+        if self.is_segment(data):
+            return False
+
+        if not (0 < data.probe.length_s <= Constants.BATCH_CLIP_MAX_S):
+            return False
+
+        return self.plan_conversion(data, data.probe) == ConvertMode.ENCODE
+
+    # split a track that needs encoding into time segments, so one very
+    #   long track can be encoded by several workers at once
+    # returns an empty list if the track shouldn't be split
+    def split_for_convert(self, data: MpTaskContents, mode: ConvertMode, workers: int) -> list:
+        if mode != ConvertMode.ENCODE:
+            return []
+
+        length_s = data.trim_length_s or data.probe.length_s
+        count = min(workers, int(length_s // Constants.SEGMENT_MIN_LENGTH_S))
+        if count < 2:
+            return []
+
+        #segments are cut at exact samples, so the rate has to be known
+        rate = self.get_output_rate(data)
+        if rate == 0:
+            return []
+
+        # a cached track doesn't need converting at all
+        if self.cache is not None:
+            cache_key = self.get_cache_key(data)
+            if os.path.isfile(self.cache.get_path(cache_key)):
+                return []
+
+        #segments start a multiple of the largest block size apart; see
+        #  join_vorbis()
+        align = Constants.SEGMENT_ALIGN_SAMPLES
+        bounds = [round(i * length_s * rate / count / align) * align for i in range(count + 1)]
+        segments = []
+
+        for i in range(count):
+            seg = replace(data,
+                          out_track    = f'{os.path.splitext(data.out_track)[0]}.part{i}.ogg',
+                          seg_start_s  = bounds[i] / rate,
+                          seg_length_s = (bounds[i + 1] - bounds[i]) / rate)
+
+            #the last segment runs to the end, in case the header's length
+            #  was a little short
+            if i == count - 1:
+                seg.seg_length_s = 0.0
+
+            segments.append(seg)
+
+        return segments
+
+    # samples of the track a segment is encoded from, as (start, end), at
+    #   the rate it's encoded at and counted from the start of the trimmed
+    #   track. An end of 0 runs to the end of the track
+    # segments are encoded with some audio from either side, where they
+    #   overlap their neighbours, so they can be joined exactly. The encoder
+    #   takes a few seconds to settle into encoding the same way it would
+    #   have if it had started at the beginning of the track
+    def get_segment_range(self, data: MpTaskContents) -> tuple:
+        rate = self.get_output_rate(data)
+        align = Constants.SEGMENT_ALIGN_SAMPLES
+        warmup = ceil(Constants.SEGMENT_WARMUP_S * rate / align) * align
+        leadout = ceil(Constants.SEGMENT_LEADOUT_S * rate / align) * align
+
+        start = round(data.seg_start_s * rate)
+        end = 0
+
+        if data.seg_length_s > 0:
+            end = start + round(data.seg_length_s * rate) + leadout
+
+        if data.trim_length_s > 0:
+            trim_end = round(data.trim_length_s * rate)
+            end = min(end, trim_end) if end > 0 else trim_end
+
+        return (max(0, start - warmup), end)
+
+    # join a track's encoded segments back into one file, without
+    #   re-encoding them
+    # if they can't be joined, fall back to encoding the whole track
+    def join_segments(self, data: MpTaskContents, segments: list) -> ConvertResultContents:
+        rate = self.get_output_rate(data)
+        starts = [self.get_segment_range(seg)[0] for seg in segments]
+        joins = [round(seg.seg_start_s * rate) for seg in segments[1:]]
 
-    # context manager to simplify moving around the directory
-    #   structure while generating packs. Automatically chdir's
-    #   to the original directory upon exit
-    @contextmanager
-    def set_directory(self, path: str):
-        orig_dir = os.getcwd()
         try:
-            os.chdir(path)
-            yield
+            unlink_output(data.out_track)
+            join_vorbis([seg.out_track for seg in segments], data.out_track, starts, joins)
+
+        except (OggFormatError, OSError) as e:
+            print(e)
+            return self.convert_with_retry(data)
 
         finally:
-            os.chdir(orig_dir)
+            for seg in segments:
+                if os.path.isfile(seg.out_track):
+                    os.remove(seg.out_track)
+
+        if self.cache is not None:
+            self.cache.store(self.get_cache_key(data), data.out_track)
+
+        return self.describe_track(data)
+
+
 
     # detect track length so that the datapack can indicate that
     #   a disc is done playing. Because IMD overrides disc "11"
     #   we need custom logic to tell Minecraft the true length
     #   of a playing disc. Otherwise it would assume IMD discs
     #   are all the same length as "11"
-    # Returns disc length in seconds
-    def get_track_length(self, track_entry: DiscListEntryContents):
+    # Returns disc length in seconds, along with everything else
+    #   worth knowing about a converted track
+    def describe_track(self, data: MpTaskContents) -> ConvertResultContents:
         try:
             #capture track length in seconds
             #ffp = pyffmpeg.FFprobe(track_entry.track_file)
             #print(ffp.metadata)
             #length_s = ffp.duration
-            meta_ogg = OggVorbis(track_entry.track_file)
-            length_s = meta_ogg.info.length
+            info: Any = OggVorbis(data.out_track).info
+            length_s = info.length
 
             #round length so the final number isn't so ridiculous
             #round to 4 decimal places to preserve enough information
@@ -247,7 +965,41 @@ class VirtualGenerator():
         except MutagenError:
             raise IMDException(Status.BAD_OGG_META)
 
-        return length_s
+        return ConvertResultContents(index       = data.index,
+                                     out_track   = data.out_track,
+                                     length_s    = length_s,
+                                     length_t    = self.seconds_to_ticks(length_s),
+                                     channels    = info.channels,
+                                     sample_rate = info.sample_rate,
+                                     size        = os.path.getsize(data.out_track),
+                                     sha256      = hash_file(data.out_track))
+
+    # copy a converted track's info into its disc entry
+    def apply_result(self, track_entry: DiscListEntryContents, result: ConvertResultContents):
+        track_entry.track_file = result.out_track
+        track_entry.length_s = result.length_s
+        track_entry.length_t = result.length_t
+        track_entry.channels = result.channels
+        track_entry.sample_rate = result.sample_rate
+        track_entry.size = result.size
+        track_entry.sha256 = result.sha256
+
+    # point an entry at another entry's converted track
+    def share_track(self, track_entry: DiscListEntryContents, first: DiscListEntryContents):
+        track_entry.track_file = first.track_file
+        track_entry.length_s = first.length_s
+        track_entry.length_t = first.length_t
+        track_entry.channels = first.channels
+        track_entry.sample_rate = first.sample_rate
+        track_entry.size = first.size
+        track_entry.sha256 = first.sha256
+
+    # point entries that use the same texture at one copy of it
+    def share_textures(self, entry_list: DiscListContents):
+        firsts = find_duplicates(entry_list.texture_files)
+
+        for (e, first) in zip(entry_list.entries, firsts):
+            e.texture_name = entry_list.entries[first].internal_name
 
     # Convert from seconds to Minecraft ticks (20t/s)
     # Round up to avoid track getting cut off at the end
@@ -259,10 +1011,26 @@ class VirtualGenerator():
     def sanitize(self, track_entry: DiscListEntryContents):
         return track_entry.title.replace('"', '＂')
 
-    def generate_datapack(self):
+    def generate_datapack(self, entry_list: DiscListContents, user_settings: dict):
         raise NotImplementedError
 
-    def generate_resourcepack(self):
+    def generate_resourcepack(self, entry_list: DiscListContents, user_settings: dict):
         raise NotImplementedError
 
+    # generate the datapack and resourcepack at the same time. They don't
+    #   share any files, so while one is rendered the other's tracks and
+    #   textures can be copied
+    # done_cb is called from this thread as each pack is finished. If one
+    #   pack fails, the other is still finished before the error is raised
+    def generate_packs(self, entry_list: DiscListContents, user_settings: dict, done_cb: Optional[Callable] = None):
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            futures = [pool.submit(self.generate_resourcepack, entry_list, user_settings),
+                       pool.submit(self.generate_datapack, entry_list, user_settings)]
+
+            for f in as_completed(futures):
+                f.result()
+
+                if done_cb is not None:
+                    done_cb()
+
 
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs size budget module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+
+from src.definitions import Constants, DiscListContents, EncodeProfileContents
+from src.generator.dedup import find_duplicates
+
+
+
+# Fit a resourcepack's tracks into a size limit
+#
+# Encoder settings are picked from a ladder, best first. Going down the
+#   ladder lowers Vorbis quality, then mixes to mono, then lowers the sample
+#   rate. Each step's bitrate is what libvorbis averages on dense, full-range
+#   music, so most packs come in under the limit rather than over it
+#
+# Tracks that can only be mono have a ladder of their own, with a step for
+#   each step of the stereo one: the same quality while stereo tracks are
+#   lowering it, and the same settings once they're mixed to mono too
+#
+# Every track starts on the same step, the best one at which the whole pack
+#   fits. Whatever room is left over moves the shortest tracks up a step,
+#   since they cost the least to improve
+EncodeProfileList = [
+    EncodeProfileContents(quality=6, sample_rate=44100, channels=2, bitrate=200000),
+    EncodeProfileContents(quality=5, sample_rate=44100, channels=2, bitrate=160000),
+    EncodeProfileContents(quality=4, sample_rate=44100, channels=2, bitrate=128000),
+    EncodeProfileContents(quality=3, sample_rate=44100, channels=2, bitrate=112000),
+    EncodeProfileContents(quality=2, sample_rate=44100, channels=2, bitrate=96000),
+    EncodeProfileContents(quality=1, sample_rate=44100, channels=2, bitrate=80000),
+    EncodeProfileContents(quality=0, sample_rate=44100, channels=2, bitrate=66000),
+    EncodeProfileContents(quality=2, sample_rate=44100, channels=1, bitrate=64000),
+    EncodeProfileContents(quality=0, sample_rate=44100, channels=1, bitrate=52000),
+    EncodeProfileContents(quality=0, sample_rate=32000, channels=1, bitrate=46000),
+    EncodeProfileContents(quality=2, sample_rate=22050, channels=1, bitrate=37000),
+    EncodeProfileContents(quality=0, sample_rate=22050, channels=1, bitrate=34000),
+]
+
+MonoProfileList = [
+    EncodeProfileContents(quality=6, sample_rate=44100, channels=1, bitrate=110000),
+    EncodeProfileContents(quality=5, sample_rate=44100, channels=1, bitrate=96000),
+    EncodeProfileContents(quality=4, sample_rate=44100, channels=1, bitrate=86000),
+    EncodeProfileContents(quality=3, sample_rate=44100, channels=1, bitrate=76000),
+    EncodeProfileContents(quality=2, sample_rate=44100, channels=1, bitrate=64000),
+    EncodeProfileContents(quality=1, sample_rate=44100, channels=1, bitrate=58000),
+    EncodeProfileContents(quality=0, sample_rate=44100, channels=1, bitrate=52000),
+    EncodeProfileContents(quality=0, sample_rate=44100, channels=1, bitrate=52000),     #stereo tracks are mixed to mono at q2,
+    EncodeProfileContents(quality=0, sample_rate=44100, channels=1, bitrate=52000),     #  then q0, which mono tracks already are
+    EncodeProfileContents(quality=0, sample_rate=32000, channels=1, bitrate=46000),
+    EncodeProfileContents(quality=2, sample_rate=22050, channels=1, bitrate=37000),
+    EncodeProfileContents(quality=0, sample_rate=22050, channels=1, bitrate=34000),
+]
+
+
+
+# bytes available for tracks, after everything else in the resourcepack
+# returns 0 if the user didn't set a limit
+def get_budget_bytes(entry_list: DiscListContents, user_settings: dict) -> int:
+    limit_mb = user_settings.get('size_budget', 0)
+    if not limit_mb:
+        return 0
+
+    return max(1, int(limit_mb * 1024 * 1024 * Constants.BUDGET_HEADROOM) - get_other_bytes(entry_list, user_settings))
+
+# size of everything in the resourcepack besides tracks, roughly
+def get_other_bytes(entry_list: DiscListContents, user_settings: dict) -> int:
+    other_bytes = Constants.BUDGET_OVERHEAD_BYTES + file_size(user_settings.get('pack', ''))
+
+    #textures used by several discs are only stored once
+    texture_files = entry_list.texture_files
+    for (i, first) in enumerate(find_duplicates(texture_files)):
+        if first == i:
+            other_bytes += file_size(texture_files[i])
+
+    return other_bytes
+
+def file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+def estimate_size(profile: EncodeProfileContents, length_s: float) -> int:
+    return Constants.OGG_HEADER_BYTES + int(length_s * profile.bitrate / 8)
+
+# profile for a track at a step of the ladder, given the most channels it
+#   can have
+def profile_at(step: int, channels: int) -> EncodeProfileContents:
+    ladder = EncodeProfileList if channels > 1 else MonoProfileList
+    return ladder[min(step, len(ladder) - 1)]
+
+# pick a profile for each track, given its length and the most channels it
+#   can have, so that the tracks add up to at most budget_bytes
+# if even the smallest profile doesn't fit, every track gets it
+def plan_profiles(lengths: list, channels: list, budget_bytes: int) -> list:
+    def total(step: int) -> int:
+        return sum(estimate_size(profile_at(step, c), l) for (l, c) in zip(lengths, channels))
+
+    step = 0
+    while step < len(EncodeProfileList) - 1 and total(step) > budget_bytes:
+        step += 1
+
+    profiles = [profile_at(step, c) for c in channels]
+    if step == 0:
+        return profiles
+
+    if total(step) > budget_bytes:
+        print("Warning: tracks may not fit in the size limit, even at the lowest quality")
+
+    spare = budget_bytes - total(step)
+
+    for i in sorted(range(len(lengths)), key=lambda i: lengths[i]):
+        better = profile_at(step - 1, channels[i])
+        cost = estimate_size(better, lengths[i]) - estimate_size(profiles[i], lengths[i])
+
+        if cost > spare:
+            break
+
+        profiles[i] = better
+        spare -= cost
+
+    return profiles
+
+# encoder options for a profile. The sample rate is only ever lowered
+def get_profile_args(profile: EncodeProfileContents, sample_rate: int) -> list:
+    if sample_rate > 0:
+        sample_rate = min(sample_rate, profile.sample_rate)
+    else:
+        sample_rate = profile.sample_rate
+
+    return ['-q:a', f'{profile.quality:g}', '-ac', str(profile.channels), '-ar', str(sample_rate)]
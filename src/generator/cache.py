@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs transcode cache module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import time
+import hashlib
+import tempfile
+import threading
+
+from src.definitions import Constants
+from src.generator.staging import link_file
+from src.generator.probe import get_stamp
+
+
+
+# On-disk cache of converted tracks, shared between builds, app instances
+#   and conversion workers. Entries are named after a hash of the source
+#   file's contents plus the FFmpeg arguments used to convert it, so a track
+#   only gets converted again if the file itself or the settings changed
+# The source's hash comes from hash_source(), so each file is only read
+#   once however many keys are made from it
+#
+# Entries are written to a temp file and atomically renamed into place, so
+#   other processes never see a half-written entry. Each hit refreshes the
+#   entry's mtime, and the least recently used entries are evicted once the
+#   cache grows past its size limit
+class TranscodeCache():
+
+    TMP_SUFFIX = '.part'
+    STALE_TMP_AGE_S = 60 * 60
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+
+    # combine a source's hash and its conversion settings into a cache key
+    # the cache version is included so that entries made by an older
+    #   conversion pipeline are never reused
+    def make_key(self, src_hash: str, args: str, proc_ogg: bool) -> str:
+        key = f"{Constants.CACHE_VERSION}|{args}|{proc_ogg}|{src_hash}"
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    # shard entries into subdirectories so no single directory
+    #   ends up with thousands of files
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + '.ogg')
+
+    # link a cached entry to dst and mark it as recently used
+    # returns False on a cache miss
+    # entries are only ever replaced, never modified, so sharing
+    #   them with the staging area is safe
+    def fetch(self, key: str, dst: str) -> bool:
+        entry = self.get_path(key)
+
+        try:
+            link_file(entry, dst)
+            os.utime(entry)
+
+        #entry doesn't exist, or another instance evicted it mid-copy
+        except OSError:
+            return False
+
+        return True
+
+    # add a converted file to the cache
+    # failing to cache a file is not an error, the next build will
+    #   just have to convert it again
+    def store(self, key: str, src: str):
+        entry = self.get_path(key)
+
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=self.TMP_SUFFIX, dir=os.path.dirname(entry))
+            os.close(fd)
+
+        except OSError:
+            return
+
+        try:
+            link_file(src, tmp)
+            os.replace(tmp, entry)
+
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    # remove least recently used entries until the cache fits in max_bytes
+    # safe to run while other instances are reading or writing the cache;
+    #   entries that disappear or can't be removed are skipped
+    def evict(self):
+        entries = []
+        total = 0
+        now = time.time()
+
+        for root, dirs, files in os.walk(self.root):
+            for file in files:
+                path = os.path.join(root, file)
+
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+
+                #clean up temp files left behind by a crashed writer
+                if file.endswith(self.TMP_SUFFIX):
+                    if now - st.st_mtime > self.STALE_TMP_AGE_S:
+                        self.remove_file(path)
+                    continue
+
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+
+            if self.remove_file(path):
+                total -= size
+
+    def remove_file(self, path: str) -> bool:
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+
+        return True
+
+
+
+# get the cache to use for a build, or None if it shouldn't use one
+# converted tracks are cached if the user keeps them between builds, or
+#   if tracks are converted in the background ahead of time
+def get_cache(user_settings: dict):
+    if not (user_settings.get('keep_tmp', False) or user_settings.get('preconvert', False)):
+        return None
+
+    max_bytes = user_settings.get('cache_max_mb', Constants.CACHE_MAX_MB) * 1024 * 1024
+    return TranscodeCache(Constants.CACHE_DIR_NAME, max_bytes)
+
+# Hashes of source files' contents, so each file is only read once between
+#   the transcode cache, the analysis cache and duplicate detection
+#
+# Hashes are kept in memory by path, and only used while the file's
+#   modification time and size are the same as when it was hashed, the same
+#   as probes. A file asked for by several threads at once is hashed by the
+#   first of them while the rest wait
+class SourceHashCache():
+
+    def __init__(self):
+        self._hashes: dict[str, tuple] = {}
+        self._locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    # raises OSError if the file can't be read
+    def hash(self, path: str) -> str:
+        with self._lock:
+            file_lock = self._locks.setdefault(path, threading.Lock())
+
+        with file_lock:
+            #stamp first, so a file that changes while it's hashed is hashed again
+            stamp = get_stamp(path)
+
+            with self._lock:
+                entry = self._hashes.get(path, None)
+
+            if entry is not None and stamp is not None and entry[0] == stamp:
+                return entry[1]
+
+            digest = hash_file(path)
+
+            with self._lock:
+                self._hashes[path] = (stamp, digest)
+
+            return digest
+
+_source_hashes = SourceHashCache()
+
+# SHA-256 of a source file's contents, read once per change to the file
+def hash_source(path: str) -> str:
+    return _source_hashes.hash(path)
+
+# hash a file's contents in chunks, so large files aren't read into memory
+# returns the hex digest of h after adding the file, or of a new
+#   SHA-256 hash if h isn't given
+def hash_file(path: str, h = None) -> str:
+    if h is None:
+        h = hashlib.sha256()
+
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(Constants.HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+
+    return h.hexdigest()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs duplicate detection module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+
+from collections import defaultdict
+
+from src.generator.cache import hash_source
+
+
+
+# Find files with the same contents, e.g. the same track added under
+#   several titles, or one texture used by many discs
+#
+# Only files that have the same size as another file are hashed, so lists
+#   without duplicates cost one stat() per file
+# returns, for each path, the index of the first path with the same
+#   contents, or its own index if there's none before it
+def find_duplicates(paths: list) -> list:
+    firsts = list(range(len(paths)))
+    by_size = defaultdict(list)
+
+    for (i, path) in enumerate(paths):
+        #missing files are reported by whatever tries to use them
+        try:
+            by_size[os.path.getsize(path)].append(i)
+        except OSError:
+            pass
+
+    for same_size in by_size.values():
+        if len(same_size) < 2:
+            continue
+
+        by_hash: dict[str, int] = {}
+        for i in same_size:
+            try:
+                firsts[i] = by_hash.setdefault(hash_source(paths[i]), i)
+            except OSError:
+                pass
+
+    return firsts
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs pack estimate module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+from src.definitions import Constants, AudioCodec, ConvertMode, DiscListContents, PackEstimateContents, TrackProbeContents
+from src.generator.budget import get_budget_bytes, get_other_bytes, file_size, estimate_size, profile_at, plan_profiles
+from src.generator.schedule import estimate_cost, estimate_makespan
+import src.generator.executor as executor_factory
+
+
+
+# Estimate how big a pack will be and how long it will take to convert,
+#   from the tracks' headers alone, so the user knows before generating
+#
+# Encoded tracks are sized at the bitrate libvorbis averages at its
+#   default quality (or at the size limit's, if there is one). Tracks that
+#   would be remuxed keep about their current size. Silence trimming isn't
+#   known ahead of time, so the estimate leans high for trimmed packs
+DEFAULT_STEP = 3                        #q3 on the budget ladders, libvorbis's default quality
+
+
+
+# probes is a dictionary of track file : probe. Tracks that aren't in it
+#   yet are left out, and counted as pending
+def estimate_pack(entry_list: DiscListContents, probes: dict, user_settings: dict) -> PackEstimateContents:
+    files = []
+    pending = 0
+
+    #the same file used by several entries is only stored once
+    for track_file in dict.fromkeys(entry_list.track_files):
+        if not track_file:
+            continue
+
+        if track_file not in probes:
+            pending += 1
+            continue
+
+        files.append(track_file)
+
+    sizes = [file_size(f) for f in files]
+    lengths = []
+    channels = []
+
+    for (track_file, size) in zip(files, sizes):
+        probe = probes[track_file]
+
+        length_s = probe.length_s
+        if length_s <= 0:
+            length_s = (size * 8) / Constants.FALLBACK_BITRATE
+
+        lengths.append(length_s)
+        channels.append(1 if (user_settings.get('mix_mono', False) or probe.channels == 1) else 2)
+
+    budget_bytes = get_budget_bytes(entry_list, user_settings)
+    if budget_bytes > 0:
+        profiles = plan_profiles(lengths, channels, budget_bytes)
+    else:
+        profiles = [profile_at(DEFAULT_STEP, c) for c in channels]
+
+    size_bytes = get_other_bytes(entry_list, user_settings)
+    costs = []
+
+    for (i, track_file) in enumerate(files):
+        mode = plan_mode(probes[track_file], user_settings)
+
+        if mode == ConvertMode.REMUX:
+            size_bytes += sizes[i]
+        else:
+            size_bytes += estimate_size(profiles[i], lengths[i])
+
+        costs.append(estimate_cost(probes[track_file], mode, sizes[i]))
+
+    workers = 1
+    if user_settings.get('par_proc', False):
+        workers = user_settings.get('workers', 0) or executor_factory.available_workers()
+
+    convert_s = estimate_makespan(sorted(costs, reverse=True), workers) if costs else 0.0
+
+    return PackEstimateContents(size_bytes=size_bytes, convert_s=convert_s, pending=pending)
+
+# whether a track would be remuxed or encoded, going by the settings that
+#   apply to every track; see VirtualGenerator.plan_conversion()
+def plan_mode(probe: TrackProbeContents, user_settings: dict) -> ConvertMode:
+    for key in ['proc_ogg', 'normalize', 'trim_silence', 'size_budget']:
+        if user_settings.get(key, False):
+            return ConvertMode.ENCODE
+
+    if probe.codec != AudioCodec.VORBIS:
+        return ConvertMode.ENCODE
+
+    if probe.channels > (1 if user_settings.get('mix_mono', False) else 2):
+        return ConvertMode.ENCODE
+
+    if probe.sample_rate > Constants.MAX_SAMPLE_RATE:
+        return ConvertMode.ENCODE
+
+    return ConvertMode.REMUX
@@ -0,0 +1,421 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs conversion executor module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import math
+import queue
+import threading
+import multiprocessing
+
+from typing import Callable, Iterable, Optional
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+from multiprocessing import AuthenticationError
+
+from src.definitions import Constants, Status, IMDException, ExecutorType
+from src.generator.ffmpeg import watch_for_cancel
+from src.generator.remote import RemoteWorker, WorkerLost, get_key
+
+
+
+# Virtual class for running conversion tasks
+#
+# Executors are used as context managers, and yield results through
+#   imap_unordered() as each task finishes so that the caller can update
+#   its progress bar. Results come back in completion order, not
+#   submission order
+#
+# cancel() may be called from any thread. Tasks that haven't started are
+#   dropped, and FFmpeg processes the executor's workers are running are
+#   killed; imap_unordered() then raises Status.CANCELLED
+class VirtualExecutor():
+
+    #whether tasks run in this process, and so can report back while
+    #  they're still running
+    shares_memory = True
+
+    def __init__(self, workers: int = 1):
+        self.workers = workers
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    def imap_unordered(self, fn: Callable, args: Iterable):
+        raise NotImplementedError
+
+    # tasks running in this process are stopped through their FFmpegJob
+    def cancel(self):
+        pass
+
+
+
+# run tasks one-by-one on the calling thread
+class SerialExecutor(VirtualExecutor):
+
+    def imap_unordered(self, fn: Callable, args: Iterable):
+        for a in args:
+            yield fn(a)
+
+
+
+# run tasks on a pool of threads
+# FFmpeg runs as a subprocess, so threads spend most of their time waiting
+#   and the GIL doesn't get in the way. Nothing needs to be pickled
+class ThreadExecutor(VirtualExecutor):
+
+    def __enter__(self):
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        self._futures = []
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        #drop tasks that haven't started yet if a task failed
+        self._pool.shutdown(wait=True, cancel_futures=(exc_type is not None))
+
+    def imap_unordered(self, fn: Callable, args: Iterable):
+        self._futures = [self._pool.submit(fn, a) for a in args]
+
+        for f in as_completed(self._futures):
+            try:
+                yield f.result()
+            except CancelledError:
+                raise IMDException(Status.CANCELLED)
+
+    def cancel(self):
+        for f in self._futures:
+            f.cancel()
+
+
+
+# run tasks on a pool of processes
+# fn and args are pickled and sent to the child processes
+class ProcessExecutor(VirtualExecutor):
+
+    shares_memory = False
+
+    def __enter__(self):
+        #each worker kills its FFmpeg processes once this is set
+        self._cancel = multiprocessing.Event()
+        self._pool = multiprocessing.Pool(processes=self.workers, initializer=watch_for_cancel,
+                                          initargs=(self._cancel,))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._pool.terminate()
+        self._pool.join()
+
+    def imap_unordered(self, fn: Callable, args: Iterable):
+        # imap_unordered yields every time a task finishes; by iterating
+        #   over the returned iterable like this the caller can update
+        #   progress after each task finishes. Only works with imap,
+        #   not map or starmap
+        yield from self._pool.imap_unordered(fn, args)
+
+    # workers stop early, so their tasks come back as failures right away
+    #   and the pool is terminated on the way out
+    def cancel(self):
+        self._cancel.set()
+
+
+
+# run tasks on conversion workers on other machines (see remote.py), as
+#   well as on local threads
+#
+# Tasks are dealt out to every slot up front, longest first. A slot that
+#   runs out steals from the back of whichever slot has the most left, so
+#   slow machines don't hold up the end of the build. Tasks are only sent to
+#   a worker once it's ready for them, so until then they can be stolen
+# If a worker is lost, the task it was working on goes to the next free
+#   slot and the rest of its tasks are stolen. If every slot is lost, the
+#   build carries on locally
+class RemoteExecutor(VirtualExecutor):
+
+    shares_memory = False
+
+    def __init__(self, workers: int = 1, addresses: Optional[list] = None, key: bytes = b''):
+        super().__init__(workers)
+        self.local_workers = workers
+        self.addresses = addresses or []
+        self.key = key
+
+        self._remotes: list[RemoteWorker] = []
+        self._queues: list[deque[int]] = []
+        self._orphans: deque[int] = deque()
+        self._in_flight = 0
+        self._live = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._results: Optional[queue.Queue] = None
+
+    def __enter__(self):
+        for address in self.addresses:
+            try:
+                self._remotes += RemoteWorker.connect(address, self.key)
+
+            except (OSError, EOFError, AuthenticationError, WorkerLost) as e:
+                print(f"Could not connect to conversion worker {address}: {e}")
+
+        self.workers = self.local_workers + len(self._remotes)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for r in self._remotes:
+            r.close()
+
+    def imap_unordered(self, fn: Callable, args: Iterable):
+        tasks = list(args)
+        slots = [None] * self.local_workers + self._remotes     #None is a local thread
+        results: queue.Queue = queue.Queue()
+        self._results = results
+
+        self._queues = [deque() for s in slots]
+        self._orphans.clear()
+        self._in_flight = 0
+        self._live = len(slots)
+        self._closed = False
+
+        for i in range(len(tasks)):
+            self._queues[i % len(slots)].append(i)
+
+        threads = [threading.Thread(target=self.run_slot, args=(i, slot, fn, tasks, results), daemon=True)
+                   for (i, slot) in enumerate(slots)]
+        for t in threads:
+            t.start()
+
+        try:
+            for i in range(len(tasks)):
+                (ok, value) = results.get()
+                if not ok:
+                    raise value
+
+                yield value
+
+        #drop tasks that haven't started yet, and wait for the rest
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+            for t in threads:
+                t.join()
+
+    # local slots are stopped through their FFmpegJob; remote slots stop
+    #   waiting on their workers, which notice the build is gone
+    def cancel(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+        for r in self._remotes:
+            r.cancel()
+
+        #in case nothing was in flight to fail
+        if self._results is not None:
+            self._results.put((False, IMDException(Status.CANCELLED)))
+
+    def run_slot(self, i: int, slot: Optional[RemoteWorker], fn: Callable, tasks: list, results: queue.Queue):
+        while True:
+            n = self.take(i)
+            if n is None:
+                return
+
+            try:
+                value = fn(tasks[n]) if slot is None else slot.run(fn, tasks[n])
+
+            #only raised by remote slots
+            except WorkerLost as e:
+                assert slot is not None
+                print(f"Lost conversion worker {e}")
+                slot.close()
+
+                with self._cond:
+                    self._orphans.append(n)
+                    self._in_flight -= 1
+                    self._live -= 1
+                    self._cond.notify_all()
+
+                    if self._live > 0:
+                        return
+
+                    #nothing left to convert on; carry on locally
+                    self._live += 1
+                    slot = None
+
+                continue
+
+            except Exception as e:
+                results.put((False, e))
+                value = None
+
+            else:
+                results.put((True, value))
+
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    # pick the next task for a slot: one a lost worker didn't finish, then
+    #   the slot's own, then one stolen from the slot with the most left
+    # waits while other slots are still busy, in case one of them is lost
+    #   and its task has to be taken over. Returns None once nothing is left
+    def take(self, i: int) -> Optional[int]:
+        with self._cond:
+            while not self._closed:
+                victim = max(self._queues, key=len)
+
+                if self._orphans:
+                    n = self._orphans.popleft()
+                elif self._queues[i]:
+                    n = self._queues[i].popleft()
+                elif victim:
+                    n = victim.pop()
+                elif self._in_flight > 0:
+                    self._cond.wait()
+                    continue
+                else:
+                    return None
+
+                self._in_flight += 1
+                return n
+
+            return None
+
+
+
+#dictionary to associate ExecutorType : executor class
+ExecutorFromTypeDict = {
+    ExecutorType.SERIAL:    SerialExecutor,
+    ExecutorType.THREAD:    ThreadExecutor,
+    ExecutorType.PROCESS:   ProcessExecutor,
+    ExecutorType.REMOTE:    RemoteExecutor
+}
+
+# pick an executor based on user settings
+# 'par_proc' enables parallel conversion, 'executor' picks the backend,
+#   and 'workers' overrides the automatically detected worker count
+def get(user_settings: dict) -> VirtualExecutor:
+    if not user_settings.get('par_proc', False):
+        return SerialExecutor()
+
+    executor_type = ExecutorType(user_settings.get('executor', ExecutorType.THREAD.value))
+    workers = user_settings.get('workers', 0) or available_workers()
+
+    # 'remote_workers' lists worker addresses, and 'workers' is how many
+    #   tracks to convert locally at the same time
+    if executor_type == ExecutorType.REMOTE:
+        return RemoteExecutor(workers, user_settings.get('remote_workers', []), get_key(user_settings))
+
+    return ExecutorFromTypeDict[executor_type](workers)
+
+# pick an executor for short work that has to run on this machine, e.g.
+#   because it reads and writes the cache directly
+def get_local(user_settings: dict) -> VirtualExecutor:
+    if not user_settings.get('par_proc', False):
+        return SerialExecutor()
+
+    return ThreadExecutor(user_settings.get('workers', 0) or available_workers())
+
+
+
+# Worker sizing
+#
+# multiprocessing.cpu_count() reports every core on the host, even when
+#   this process is pinned to a few of them or limited by a container's
+#   cgroup. Size the pool from what this process can actually use
+def available_workers() -> int:
+    workers = available_cpus()
+
+    mem = available_memory()
+    if mem is not None:
+        workers = min(workers, mem // Constants.WORKER_MEM_BYTES)
+
+    return max(1, workers)
+
+# cores this process may run on, capped by the cgroup CPU quota
+def available_cpus() -> int:
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        #sched_getaffinity is Linux-only
+        cpus = os.cpu_count() or 1
+
+    quota = cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.ceil(quota))
+
+    return max(1, cpus)
+
+# CPU quota in cores, or None if there is no limit
+def cgroup_cpu_quota() -> Optional[float]:
+    #cgroup v2: "<quota> <period>", or "max <period>" if unlimited
+    try:
+        quota, period = read_sys_file('/sys/fs/cgroup/cpu.max').split()
+        if quota != 'max':
+            return int(quota) / int(period)
+        return None
+
+    except (OSError, ValueError):
+        pass
+
+    #cgroup v1: quota is -1 if unlimited
+    for cpu_dir in ['/sys/fs/cgroup/cpu', '/sys/fs/cgroup/cpu,cpuacct']:
+        try:
+            quota_us = int(read_sys_file(os.path.join(cpu_dir, 'cpu.cfs_quota_us')))
+            period_us = int(read_sys_file(os.path.join(cpu_dir, 'cpu.cfs_period_us')))
+            if quota_us > 0 and period_us > 0:
+                return quota_us / period_us
+            return None
+
+        except (OSError, ValueError):
+            continue
+
+    return None
+
+# memory available to this process in bytes, or None if unknown
+# the smallest of the cgroup's remaining allowance and the
+#   system's available memory
+def available_memory() -> Optional[int]:
+    limits = []
+
+    #cgroup v2
+    try:
+        limit = read_sys_file('/sys/fs/cgroup/memory.max')
+        if limit != 'max':
+            usage = int(read_sys_file('/sys/fs/cgroup/memory.current'))
+            limits.append(int(limit) - usage)
+
+    except (OSError, ValueError):
+        #cgroup v1; unlimited is reported as a very large number
+        try:
+            limit_bytes = int(read_sys_file('/sys/fs/cgroup/memory/memory.limit_in_bytes'))
+            usage = int(read_sys_file('/sys/fs/cgroup/memory/memory.usage_in_bytes'))
+            if limit_bytes < (1 << 60):
+                limits.append(limit_bytes - usage)
+
+        except (OSError, ValueError):
+            pass
+
+    #system-wide, Linux only
+    try:
+        with open('/proc/meminfo', 'r') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    limits.append(int(line.split()[1]) * 1024)
+                    break
+
+    except (OSError, ValueError):
+        pass
+
+    if not limits:
+        return None
+
+    return max(0, min(limits))
+
+def read_sys_file(path: str) -> str:
+    with open(path, 'r') as f:
+        return f.read().strip()
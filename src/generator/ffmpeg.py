@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs FFmpeg runner module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import signal
+import shutil
+import pyffmpeg
+import threading
+import subprocess
+
+from typing import Callable, IO, Optional
+from functools import lru_cache
+
+from src.definitions import Status, IMDException
+
+
+
+# keep FFmpeg from opening a console window when launched from the GUI on Windows
+# doesn't do anything on Mac or Linux
+CREATION_FLAGS = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+# run background conversions at a lower CPU and disk priority, so they
+#   don't slow down the rest of the system
+# Windows uses a priority class, Linux/Mac use nice and (if available) ionice
+LOW_PRIORITY_FLAGS = getattr(subprocess, 'BELOW_NORMAL_PRIORITY_CLASS', 0)
+LOW_PRIORITY_NICE = 10
+IONICE_IDLE = ['-c', '3']
+
+OUTPUT_CHUNK_SIZE = 1024 * 1024
+
+
+
+# Handle for a unit of work that runs FFmpeg, so that it can be cancelled
+#   from another thread. Cancelling kills any FFmpeg process the job is
+#   running, and stops it from starting new ones
+#
+# A job sent to another process (e.g. along with a generator) becomes that
+#   process's own job; see watch_for_cancel()
+class FFmpegJob():
+
+    def __init__(self, low_priority: bool = False):
+        self.low_priority = low_priority
+        self.cancelled = False
+
+        self._procs: set[subprocess.Popen] = set()
+        self._callbacks: list[Callable] = []
+        self._lock = threading.Lock()
+
+    def __reduce__(self):
+        return (get_process_job, ())
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            procs = list(self._procs)
+            callbacks = list(self._callbacks)
+
+        for p in procs:
+            kill_process(p)
+
+        for cb in callbacks:
+            cb()
+
+    # call cb when the job is cancelled, e.g. to stop work the job doesn't
+    #   run itself. Called right away if the job already was
+    def on_cancel(self, cb: Callable):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(cb)
+                return
+
+        cb()
+
+    # stop if the job was cancelled, between steps that don't run FFmpeg
+    def check(self):
+        if self.cancelled:
+            raise IMDException(Status.CANCELLED)
+
+    # returns False if the job was cancelled before the process started
+    def attach(self, proc: subprocess.Popen) -> bool:
+        with self._lock:
+            if self.cancelled:
+                return False
+
+            self._procs.add(proc)
+            return True
+
+    def detach(self, proc: subprocess.Popen):
+        with self._lock:
+            self._procs.discard(proc)
+
+
+
+# in a worker process, every job sent to it becomes this one, so they can
+#   all be cancelled together. Elsewhere each one becomes a new job
+_process_job = None
+
+def get_process_job() -> FFmpegJob:
+    if _process_job is not None:
+        return _process_job
+
+    return FFmpegJob()
+
+# set up a worker process so that its FFmpeg processes are killed when
+#   cancel_event is set, or when the worker itself is terminated
+# Windows terminates processes outright, so there only the event works
+def watch_for_cancel(cancel_event):
+    global _process_job
+    _process_job = FFmpegJob()
+
+    def watch():
+        cancel_event.wait()
+        _process_job.cancel()
+
+    threading.Thread(target=watch, daemon=True).start()
+
+    def terminate(signum, frame):
+        _process_job.cancel()
+        os._exit(1)
+
+    if os.name == 'posix':
+        signal.signal(signal.SIGTERM, terminate)
+
+
+
+# locate the FFmpeg binary bundled with pyffmpeg
+# constructing pyffmpeg.FFmpeg is slow, so only do it once per process
+#TODO: once you update to a new version that's not broken, make sure to
+#  add 'enable_log=False' to this constructor
+@lru_cache(maxsize=None)
+def get_ffmpeg_bin() -> str:
+    return pyffmpeg.FFmpeg().get_ffmpeg_bin()
+
+@lru_cache(maxsize=None)
+def get_ionice_bin():
+    return shutil.which('ionice')
+
+# run FFmpeg with the given arguments
+# arguments are passed as a list and never go through a shell, so
+#   file paths don't need to be quoted or escaped
+# if a job is given, FFmpeg runs at the job's priority and is killed
+#   if the job is cancelled, raising Status.CANCELLED
+# if progress_cb is given, it's called as FFmpeg works with how many seconds
+#   of output it has written so far and how fast it's going
+# if output_cb is given, whatever FFmpeg writes to 'pipe:1' is passed to
+#   it in chunks as it's written. Can't be used along with progress_cb
+# returns FFmpeg's log output, e.g. for filters that report measurements
+#   at a more verbose loglevel
+def run_ffmpeg(args: list, job: Optional[FFmpegJob] = None, progress_cb: Optional[Callable] = None, loglevel: str = 'error',
+               output_cb: Optional[Callable] = None) -> str:
+    cmd = [get_ffmpeg_bin(), '-nostdin', '-y', '-nostats', '-loglevel', loglevel]
+    if progress_cb is not None:
+        cmd += ['-progress', 'pipe:1']
+    cmd += args
+
+    if job is not None:
+        job.check()
+
+    piped = (progress_cb is not None or output_cb is not None)
+
+    flags = CREATION_FLAGS
+
+    low_priority = (job is not None and job.low_priority)
+    if low_priority:
+        flags |= LOW_PRIORITY_FLAGS
+
+        if get_ionice_bin() is not None:
+            cmd = [get_ionice_bin()] + IONICE_IDLE + cmd
+
+    try:
+        proc = subprocess.Popen(cmd,
+                                stdin=subprocess.DEVNULL,
+                                stdout=(subprocess.PIPE if piped else subprocess.DEVNULL),
+                                stderr=subprocess.PIPE,
+                                creationflags=flags)
+
+    except OSError as e:
+        print(e)
+        raise IMDException(Status.FFMPEG_CONVERT_FAIL)
+
+    if low_priority and hasattr(os, 'setpriority'):
+        try:
+            os.setpriority(os.PRIO_PROCESS, proc.pid, LOW_PRIORITY_NICE)
+        except OSError:
+            pass
+
+    if job is not None and not job.attach(proc):
+        kill_process(proc)
+
+    try:
+        if not piped:
+            (stdout, stderr) = proc.communicate()
+
+        #read output as it comes, while draining errors on the side so
+        #  FFmpeg can't block writing them
+        else:
+            (stdout_pipe, stderr_pipe) = (proc.stdout, proc.stderr)
+            assert stdout_pipe is not None and stderr_pipe is not None
+
+            errors = []
+            drain = threading.Thread(target=lambda: errors.append(stderr_pipe.read()), daemon=True)
+            drain.start()
+
+            try:
+                if progress_cb is not None:
+                    read_progress(stdout_pipe, progress_cb)
+                elif output_cb is not None:
+                    for chunk in iter(lambda: stdout_pipe.read(OUTPUT_CHUNK_SIZE), b''):
+                        output_cb(chunk)
+
+            #don't leave FFmpeg blocked writing to a pipe nobody reads
+            except BaseException:
+                kill_process(proc)
+                proc.wait()
+                raise
+
+            proc.wait()
+            drain.join()
+            stderr = errors[0] if errors else b''
+
+    finally:
+        if job is not None:
+            job.detach(proc)
+
+    #killed on purpose, not worth reporting
+    if job is not None:
+        job.check()
+
+    log = stderr.decode('utf-8', errors='replace')
+
+    if proc.returncode != 0:
+        print(log)
+        raise IMDException(Status.FFMPEG_CONVERT_FAIL)
+
+    return log
+
+# parse FFmpeg's machine-readable progress output
+# FFmpeg writes blocks of key=value lines, each ending with a 'progress'
+#   line, so the callback is called once per block
+def read_progress(stream: IO[bytes], progress_cb: Callable):
+    out_time_s = 0.0
+    speed = 0.0
+
+    for line in stream:
+        (key, sep, value) = line.decode('utf-8', errors='replace').strip().partition('=')
+        if not sep:
+            continue
+
+        try:
+            #despite its name, out_time_ms is in microseconds too
+            if key in ('out_time_us', 'out_time_ms'):
+                out_time_s = max(0.0, int(value) / 1000000.0)
+
+            elif key == 'speed':
+                speed = float(value.rstrip('x'))
+
+        #'N/A' until FFmpeg has written some output
+        except ValueError:
+            pass
+
+        if key == 'progress':
+            progress_cb(out_time_s, speed)
+
+def kill_process(proc: subprocess.Popen):
+    try:
+        proc.kill()
+    except OSError:
+        pass
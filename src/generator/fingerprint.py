@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs duplicate track detection module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import bisect
+
+from typing import Any, Optional
+
+from src.definitions import Constants, IMDException
+from src.generator.ffmpeg import FFmpegJob, run_ffmpeg
+from src.generator.analysis import AnalysisCache
+from src.generator.probe import get_probe_cache
+import src.generator.executor as executor_factory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  #type: ignore[assignment]
+
+
+
+# Find tracks that sound the same, even if they're different files, e.g. the
+#   same song at a different bitrate or in a different format
+#
+# Each track gets a fingerprint, made from a low sample rate decode of its
+#   start: for every short frame, one bit per pair of neighbouring frequency
+#   bands, set if the difference in their energy grew since the last frame.
+#   Encoding artifacts barely change which way those differences go, so two
+#   copies of a song have nearly the same bits, and different songs agree on
+#   about half of them
+#
+# Fingerprints are cached with the track's other measurements, so only new
+#   tracks are decoded
+SAMPLE_RATE = 5512
+FRAME = 2048                            #0.37s
+HOP = 512
+BAND_MIN_HZ = 300
+BAND_MAX_HZ = 2000
+BANDS = 16                              #gives BANDS - 1 bits per frame
+
+# lookup table for counting set bits in fingerprint frames
+POPCOUNT: Any = None
+if np is not None:
+    POPCOUNT = np.array([bin(i).count('1') for i in range(1 << (BANDS - 1))], dtype=np.uint8)
+
+
+
+# decode the start of a track and make its fingerprint
+# returns a list of ints, one per frame, or an empty list if the track is
+#   too short to fingerprint
+def compute_fingerprint(src_track: str, job: Optional[FFmpegJob] = None) -> list:
+    chunks: list[bytes] = []
+
+    run_ffmpeg(['-t', str(Constants.FINGERPRINT_MAX_S), '-i', src_track, '-map', '0:a:0', '-ac', '1',
+                '-ar', str(SAMPLE_RATE), '-f', 'f32le', 'pipe:1'], job, output_cb=chunks.append)
+
+    data = b''.join(chunks)
+    samples = np.frombuffer(data, dtype='<f4', count=len(data) // 4)
+
+    count = 1 + (len(samples) - FRAME) // HOP
+    if count < 2:
+        return []
+
+    #every frame at once, as rows of one array
+    frames = samples[np.arange(FRAME)[None, :] + HOP * np.arange(count)[:, None]] * np.hanning(FRAME).astype(np.float32)
+    spectrum = np.square(np.abs(np.fft.rfft(frames, axis=1)))
+
+    #log-spaced bands, like the ear hears them
+    edges = np.round(np.geomspace(BAND_MIN_HZ, BAND_MAX_HZ, BANDS + 1) * FRAME / SAMPLE_RATE).astype(int)
+    energy = np.add.reduceat(spectrum[:, edges[0]:edges[-1]], edges[:-1] - edges[0], axis=1)
+
+    diff = energy[:, :-1] - energy[:, 1:]
+    bits = (diff[1:] - diff[:-1]) > 0
+
+    return (bits.astype(np.uint32) << np.arange(BANDS - 1, dtype=np.uint32)).sum(axis=1).tolist()
+
+# fraction of bits two fingerprints disagree on, at the offset where they
+#   line up best. About 0.5 for unrelated tracks
+def bit_error_rate(a, b) -> float:
+    best = 1.0
+
+    for offset in range(-Constants.FINGERPRINT_MAX_OFFSET, Constants.FINGERPRINT_MAX_OFFSET + 1):
+        (x, y) = (a[offset:], b) if offset >= 0 else (a, b[-offset:])
+        overlap = min(len(x), len(y))
+
+        if overlap < Constants.FINGERPRINT_MIN_FRAMES:
+            continue
+
+        errors = int(POPCOUNT[x[:overlap] ^ y[:overlap]].sum())
+        best = min(best, errors / (overlap * (BANDS - 1)))
+
+    return best
+
+
+
+# Fingerprints of a set of tracks, indexed by length so each track is only
+#   compared with tracks about as long as it is
+class FingerprintIndex():
+
+    def __init__(self):
+        self._lengths = []
+        self._keys = []
+        self._prints = {}
+
+    def add(self, key, length_s: float, fingerprint: list):
+        i = bisect.bisect(self._lengths, length_s)
+        self._lengths.insert(i, length_s)
+        self._keys.insert(i, key)
+        self._prints[key] = np.asarray(fingerprint, dtype=np.uint32)
+
+    # keys of tracks that sound the same as the given one
+    def find(self, length_s: float, fingerprint: list) -> list:
+        tolerance = max(Constants.FINGERPRINT_LENGTH_TOL_S, length_s * Constants.FINGERPRINT_LENGTH_TOL)
+        lo = bisect.bisect_left(self._lengths, length_s - tolerance)
+        hi = bisect.bisect_right(self._lengths, length_s + tolerance)
+
+        query = np.asarray(fingerprint, dtype=np.uint32)
+
+        return [k for k in self._keys[lo:hi]
+                if bit_error_rate(query, self._prints[k]) <= Constants.FINGERPRINT_MAX_ERROR]
+
+
+
+# group tracks that sound the same
+# returns lists of indexes into paths, one list per group of at least two
+#   different files. Tracks that can't be read are left out, since the
+#   build reports them
+def find_near_duplicates(paths: list, cache: AnalysisCache, user_settings: dict) -> list:
+    if np is None:
+        print("numpy is not available, duplicate tracks can't be found")
+        return []
+
+    #the same file used by several entries isn't a duplicate
+    unique = list(dict.fromkeys(paths))
+
+    def measure(path: str):
+        try:
+            key = cache.make_key(path)
+            fingerprint = cache.fetch(key).get('fingerprint', None)
+
+            if fingerprint is None:
+                fingerprint = compute_fingerprint(path)
+                cache.store(key, {'fingerprint': fingerprint})
+
+            return (path, get_probe_cache().probe(path).length_s, fingerprint)
+
+        except (IMDException, OSError):
+            return (path, 0.0, [])
+
+    index = FingerprintIndex()
+    groups: dict[str, list] = {}
+
+    with executor_factory.get_local(user_settings) as executor:
+        for (path, length_s, fingerprint) in executor.imap_unordered(measure, unique):
+            if not fingerprint:
+                continue
+
+            #join the group of the first match, if there is one
+            matches = index.find(length_s, fingerprint)
+            groups[path] = groups[matches[0]] if matches else [path]
+            if matches:
+                groups[path].append(path)
+
+            index.add(path, length_s, fingerprint)
+
+    found = []
+    for group in {id(g): g for g in groups.values()}.values():
+        if len(group) > 1:
+            found.append([i for (i, p) in enumerate(paths) if p in group])
+
+    return sorted(found)
+
+# pick the copy of a track to keep out of several that sound the same: the
+#   one with the highest bitrate, which is usually the least compressed
+def pick_best_copy(paths: list) -> str:
+    def bitrate(path: str) -> float:
+        try:
+            probe = get_probe_cache().probe(path)
+            if probe.bitrate > 0:
+                return probe.bitrate
+
+            return os.path.getsize(path) / max(probe.length_s, 1.0)
+
+        except (IMDException, OSError):
+            return 0.0
+
+    return max(paths, key=bitrate)
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs build journal module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import json
+
+from typing import IO, Optional
+from dataclasses import asdict, fields
+
+from src.definitions import ConvertResultContents
+
+
+
+# Record of conversions finished in a staging area, so that a build that
+#   failed or was interrupted can pick up where it left off
+#
+# Each finished unit of work (a track, or one segment of a long track) is
+#   appended as one line of JSON and flushed right away. A line cut off by
+#   a crash is ignored when the journal is read back. Entries are keyed by
+#   everything that affects the converted file, so a track that was edited
+#   or is converted with different settings is never resumed
+class BuildJournal():
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: Optional[IO[str]] = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a', encoding='utf-8')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # read back finished work, as a dictionary of key : result
+    def load(self) -> dict:
+        done = {}
+        names = {f.name for f in fields(ConvertResultContents)} - {'status'}
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        key = entry.pop('key')
+                        done[key] = ConvertResultContents(**{k: v for (k, v) in entry.items() if k in names})
+
+                    #partially written line
+                    except (ValueError, KeyError, TypeError):
+                        continue
+
+        except FileNotFoundError:
+            pass
+
+        return done
+
+    def record(self, key: str, result: ConvertResultContents):
+        entry = asdict(result)
+        entry.pop('status')
+        entry['key'] = key
+
+        assert self._file is not None, 'journal is not open'
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+
+
+
+# check that a journaled conversion's output is still in the staging area
+# converted tracks are moved out of the staging area once packs are
+#   generated, so a build that failed after that point converts them again
+def is_output_intact(result: ConvertResultContents) -> bool:
+    try:
+        return os.path.getsize(result.out_track) == result.size
+    except OSError:
+        return False
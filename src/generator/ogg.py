@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs Ogg Vorbis stream module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import zlib
+import struct
+
+from typing import List, Optional, Tuple, Union
+
+
+
+# Ogg page header: capture pattern, version, flags, granule position,
+#   stream serial number, page sequence number, checksum, segment count
+PAGE_HEADER = struct.Struct('<4sBBqIIIB')
+CAPTURE_PATTERN = b'OggS'
+
+FLAG_CONTINUED = 0x01
+FLAG_BOS = 0x02
+FLAG_EOS = 0x04
+
+MAX_SEGMENTS = 255
+PAGE_TARGET_SIZE = 4096     #same page size libogg aims for
+
+# Vorbis header packets
+VORBIS_ID_HEADER = b'\x01vorbis'
+VORBIS_SETUP_HEADER = b'\x05vorbis'
+VORBIS_MODE_BITS = 41       #blockflag(1), windowtype(16), transformtype(16), mapping(8)
+VORBIS_MAX_MODES = 64
+
+
+
+# raised when a file isn't a single Ogg Vorbis stream that can be joined
+class OggFormatError(Exception):
+    pass
+
+
+
+# Join Ogg Vorbis files encoded with identical settings into a single
+#   logical stream, without decoding or re-encoding any audio
+#
+# Each part is a stretch of the same track, encoded with some extra audio
+#   on either side that overlaps its neighbours. Once it's a few blocks in,
+#   libvorbis encodes the same audio at the same position into the same
+#   packets, as long as the parts start a multiple of the largest block
+#   size apart. So where two parts overlap they share identical packets,
+#   and joining them at one of those decodes exactly the same as the
+#   whole track would: no samples are added, dropped or changed
+#
+# starts are the sample each part was encoded from, and joins the sample
+#   each pair of parts is joined as close to as possible
+def join_vorbis(part_files: List[str], out_file: str, starts: List[int], joins: List[int]):
+    parts = [read_packets(f) for f in part_files]
+
+    serial, packets = parts[0]
+    if len(packets) < 3:
+        raise OggFormatError(part_files[0])
+
+    headers = [p for (p, g) in packets[:3]]
+    blocksizes, blockflags = parse_vorbis_headers(headers[0], headers[2])
+
+    placed = []
+    for (s, part_packets) in parts:
+        #codebooks are only sent once per stream, so every part must have
+        #  been encoded with the same ones
+        part_headers = [p for (p, g) in part_packets[:3]]
+        if part_headers[0] != headers[0] or part_headers[2] != headers[2]:
+            raise OggFormatError('parts were not encoded with the same settings')
+
+        placed.append(place_packets(part_packets[3:], blocksizes, blockflags))
+
+    #every part starts the way the first one does, since they were all
+    #  encoded the same way. Their own granule positions can be a sample
+    #  out, from rounding the timestamps they were encoded with, though
+    #  where they end is exact
+    offset = placed[0][1]
+    timelines = [([(packet, start + offset + samples) for (packet, samples) in part], start + end)
+                 for ((part, part_offset, end), start) in zip(placed, starts)]
+
+    #keep each part from just after the packet it was joined at
+    audio = []
+    first = 0
+
+    for ((prev, prev_end), (part, part_end), join) in zip(timelines, timelines[1:], joins):
+        (a, b) = find_join(prev, part, first, join)
+        audio += prev[first : a + 1]
+        first = b + 1
+
+    (last, last_end) = timelines[-1]
+    audio += last[first:]
+
+    #the final part's end padding is trimmed as usual
+    audio[-1] = (audio[-1][0], last_end)
+
+    write_packets(out_file, serial, headers, audio)
+
+# count the samples a part's audio packets decode to
+# returns a list of (packet, samples decoded up to and including it), the
+#   offset of the part's granule positions from those counts, and its last
+#   granule position: where its audio really ends, before the encoder's end
+#   padding
+def place_packets(packets: list, blocksizes: Tuple[int, int], blockflags: List[bool]) -> tuple:
+    placed = []
+    samples = 0
+    prev_blocksize = None
+    offset = None
+    end = None
+
+    for (packet, granule) in packets:
+        blocksize = packet_blocksize(packet, blocksizes, blockflags)
+
+        #each packet decodes the overlap of its block with the one before
+        if prev_blocksize is not None:
+            samples += (prev_blocksize + blocksize) // 4
+        prev_blocksize = blocksize
+
+        if granule is not None and granule >= 0:
+            #the part may start with a few samples to skip
+            if offset is None:
+                offset = granule - samples
+            end = granule
+
+        placed.append((packet, samples))
+
+    if end is None:
+        raise OggFormatError('part has no audio')
+
+    return (placed, offset, end)
+
+# find where two overlapping parts share a packet: the same packet, decoding
+#   up to the same sample. Out of those, the one closest to the join
+# returns the index of the shared packet in each part
+def find_join(prev: list, part: list, first: int, join: int) -> Tuple[int, int]:
+    by_end = {end: i for (i, (packet, end)) in enumerate(prev) if i >= first}
+    best = None
+
+    for (j, (packet, end)) in enumerate(part):
+        i = by_end.get(end, None)
+        if i is None or prev[i][0] != packet:
+            continue
+
+        if best is None or abs(end - join) < abs(part[best[1]][1] - join):
+            best = (i, j)
+
+    if best is None:
+        raise OggFormatError('parts have no packets in common where they overlap')
+
+    return best
+
+
+
+# parse an Ogg file into its packets
+# returns the stream serial number, and a list of (packet, granule) where
+#   granule is the page's granule position if the packet is the last one
+#   completed on that page, or None otherwise
+def read_packets(file: str) -> Tuple[int, List[Tuple[bytes, Optional[int]]]]:
+    with open(file, 'rb') as f:
+        data = f.read()
+
+    packets: List[list] = []
+    serial: Optional[int] = None
+    pending = b''
+    pos = 0
+
+    while pos < len(data):
+        if len(data) - pos < PAGE_HEADER.size:
+            raise OggFormatError(f'{file}: truncated page')
+
+        (capture, version, flags, granule, page_serial, seq, crc, nsegs) = PAGE_HEADER.unpack_from(data, pos)
+
+        if capture != CAPTURE_PATTERN or version != 0:
+            raise OggFormatError(f'{file}: bad page header')
+
+        if serial is None:
+            serial = page_serial
+        elif page_serial != serial:
+            raise OggFormatError(f'{file}: more than one logical stream')
+
+        lacing = data[pos + PAGE_HEADER.size : pos + PAGE_HEADER.size + nsegs]
+        pos += PAGE_HEADER.size + nsegs
+
+        last = None
+        for l in lacing:
+            pending += data[pos : pos + l]
+            pos += l
+
+            #a lacing value under 255 ends a packet
+            if l < MAX_SEGMENTS:
+                packets.append([pending, None])
+                last = packets[-1]
+                pending = b''
+
+        if last is not None:
+            last[1] = granule
+
+    if serial is None:
+        raise OggFormatError(f'{file}: no pages')
+
+    return (serial, [(p[0], p[1]) for p in packets])
+
+# write packets to a new Ogg file as a single logical stream
+# headers are given their own pages, as the Vorbis spec requires, and audio
+#   packets are given the granule position of the sample they decode up to
+def write_packets(file: str, serial: int, headers: List[bytes], audio: List[Tuple[bytes, int]]):
+    writer = OggPageWriter(serial)
+
+    with open(file, 'wb') as f:
+        writer.add_packet(headers[0], 0)
+        f.write(writer.flush())
+
+        writer.add_packet(headers[1], 0)
+        writer.add_packet(headers[2], 0)
+        f.write(writer.flush())
+
+        #pages are only flushed once the next packet is known to exist,
+        #  so the last packet always ends up on the end-of-stream page
+        for (packet, granule) in audio:
+            while writer.page_ready():
+                f.write(writer.flush())
+
+            writer.add_packet(packet, granule)
+
+        f.write(writer.flush(eos=True))
+
+
+
+# Build Ogg pages from packets
+class OggPageWriter():
+
+    def __init__(self, serial: int):
+        self.serial = serial
+        self.seq = 0
+        self.lacing: List[int] = []
+        self.body = b''
+        self.granule = -1
+        self.continued = False
+
+        #packets still being laced onto pages, as (remaining data, granule)
+        self._queue: List[Tuple[bytes, int]] = []
+
+    def add_packet(self, packet: bytes, granule: int):
+        self._queue.append((packet, granule))
+        self._fill()
+
+    def page_ready(self) -> bool:
+        return len(self.lacing) >= MAX_SEGMENTS or len(self.body) >= PAGE_TARGET_SIZE
+
+    # move queued packet data onto the current page, until it's full
+    def _fill(self):
+        while self._queue and len(self.lacing) < MAX_SEGMENTS:
+            (packet, granule) = self._queue[0]
+
+            while packet and len(self.lacing) < MAX_SEGMENTS - 1 and len(packet) >= MAX_SEGMENTS:
+                self.lacing.append(MAX_SEGMENTS)
+                self.body += packet[:MAX_SEGMENTS]
+                packet = packet[MAX_SEGMENTS:]
+
+            if len(packet) < MAX_SEGMENTS:
+                #packet ends on this page
+                self.lacing.append(len(packet))
+                self.body += packet
+                self.granule = granule
+                self._queue.pop(0)
+
+            else:
+                #packet continues onto the next page
+                self.lacing.append(MAX_SEGMENTS)
+                self.body += packet[:MAX_SEGMENTS]
+                self._queue[0] = (packet[MAX_SEGMENTS:], granule)
+
+    def flush(self, eos: bool = False) -> bytes:
+        flags = 0
+        if self.continued:
+            flags |= FLAG_CONTINUED
+        if self.seq == 0:
+            flags |= FLAG_BOS
+        if eos and not self._queue:
+            flags |= FLAG_EOS
+
+        header = PAGE_HEADER.pack(CAPTURE_PATTERN, 0, flags, self.granule, self.serial, self.seq, 0, len(self.lacing))
+        page = bytearray(header + bytes(self.lacing) + self.body)
+        struct.pack_into('<I', page, 22, ogg_crc(page))
+
+        #next page continues a packet if this one ended mid-packet
+        self.continued = bool(self.lacing) and self.lacing[-1] == MAX_SEGMENTS
+        self.seq += 1
+        self.lacing = []
+        self.body = b''
+        self.granule = -1
+
+        self._fill()
+
+        #packets too large for one page are flushed over several
+        if eos and self._queue:
+            return bytes(page) + self.flush(eos=True)
+
+        return bytes(page)
+
+
+
+# read block sizes from the identification header, and each mode's
+#   block flag from the end of the setup header
+# the modes are the last thing in the setup header, but everything before
+#   them is variable length. Instead of parsing the whole header they are
+#   found by working backwards from the framing bit, checking that each
+#   candidate mode has the required zero window and transform types and
+#   that the mode count in front of them matches
+def parse_vorbis_headers(id_header: bytes, setup_header: bytes) -> Tuple[Tuple[int, int], List[bool]]:
+    if not id_header.startswith(VORBIS_ID_HEADER) or len(id_header) < 30:
+        raise OggFormatError('missing Vorbis identification header')
+
+    if not setup_header.startswith(VORBIS_SETUP_HEADER):
+        raise OggFormatError('missing Vorbis setup header')
+
+    blocksizes = (1 << (id_header[28] & 0x0F), 1 << (id_header[28] >> 4))
+
+    #Vorbis packs bits starting from the least significant bit of each byte
+    bits = int.from_bytes(setup_header, 'little')
+    framing = bits.bit_length() - 1
+
+    def read(pos, n):
+        return (bits >> pos) & ((1 << n) - 1)
+
+    mode_count = 0
+    for n in range(1, VORBIS_MAX_MODES + 1):
+        mode = framing - VORBIS_MODE_BITS * n
+        if mode - 6 < 0:
+            break
+
+        #window and transform types are always 0, mappings are < 64
+        if read(mode + 1, 16) != 0 or read(mode + 17, 16) != 0 or read(mode + 33, 8) >= VORBIS_MAX_MODES:
+            break
+
+        if read(mode - 6, 6) + 1 == n:
+            mode_count = n
+
+    if mode_count == 0:
+        raise OggFormatError('could not find Vorbis modes')
+
+    start = framing - VORBIS_MODE_BITS * mode_count
+    blockflags = [bool(read(start + VORBIS_MODE_BITS * i, 1)) for i in range(mode_count)]
+
+    return (blocksizes, blockflags)
+
+# block size of an audio packet, from the mode number at its start
+def packet_blocksize(packet: bytes, blocksizes: Tuple[int, int], blockflags: List[bool]) -> int:
+    if not packet or packet[0] & 0x01:
+        raise OggFormatError('expected a Vorbis audio packet')
+
+    mode_bits = (len(blockflags) - 1).bit_length()
+    mode = (int.from_bytes(packet[:2], 'little') >> 1) & ((1 << mode_bits) - 1)
+
+    if mode >= len(blockflags):
+        raise OggFormatError('bad Vorbis mode number')
+
+    return blocksizes[1] if blockflags[mode] else blocksizes[0]
+
+# Ogg page checksum: CRC-32 with polynomial 0x04c11db7, zero initial value,
+#   no reflection and no final XOR
+# zlib's CRC-32 uses the same polynomial, but reflected and with an initial
+#   value and final XOR of 0xffffffff. Feeding it bit-reversed bytes,
+#   cancelling the initial value with a CRC of zeros of the same length,
+#   and reversing the result gives the Ogg checksum at zlib's speed
+def ogg_crc(page: Union[bytes, bytearray]) -> int:
+    reflected = zlib.crc32(bytes(page).translate(BIT_REVERSE_TABLE)) ^ zlib.crc32(bytes(len(page)))
+    return int(f'{reflected:032b}'[::-1], 2)
+
+BIT_REVERSE_TABLE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs background pre-conversion module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import shutil
+import tempfile
+import threading
+import itertools
+
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+
+import src.generator.factory as generator_factory
+from src.definitions import IMDException, DiscListEntryContents
+from src.generator.cache import get_cache
+from src.generator.analysis import get_analysis_cache
+from src.generator.executor import available_workers
+from src.generator.ffmpeg import FFmpegJob
+from src.generator.pyav import get_backend
+
+
+
+# Converts tracks into the transcode cache as soon as they're added to the
+#   track list, so that most of the work is already done by the time the
+#   user generates a pack
+#
+# Work runs at a low priority on a small thread pool, and is cancelled if
+#   a track is removed or replaced before it's done. Tracks are converted
+#   with the settings in use when they were added; if those settings are
+#   changed later, the build just misses the cache and converts as usual
+class PreconvertService():
+
+    STAGING_PREFIX = '.imd_preconvert_'
+
+    def __init__(self, get_settings: Callable, workers: int = 0):
+        self._get_settings = get_settings
+        self._workers = workers or max(1, available_workers() // 2)
+
+        self._analysis_cache = get_analysis_cache()
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._tmp_path: Optional[str] = None
+        self._names = itertools.count()
+
+        #track file : [future, FFmpegJob, number of entries using the track]
+        self._jobs: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    # start converting a track that was added to the list
+    def add(self, track_file: str):
+        settings = self._get_settings()
+
+        if not settings.get('preconvert', False):
+            return
+
+        #with a size limit, how a track is encoded depends on the rest of
+        #  the list, so it can't be converted ahead of time
+        if settings.get('size_budget', 0):
+            return
+
+        if not os.path.isfile(track_file):
+            return
+
+        with self._lock:
+            if track_file in self._jobs:
+                self._jobs[track_file][2] += 1
+                return
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers)
+                self._tmp_path = tempfile.mkdtemp(prefix=self.STAGING_PREFIX)
+
+            job = FFmpegJob(low_priority=True)
+            future = self._pool.submit(self.convert, track_file, settings, job)
+            self._jobs[track_file] = [future, job, 1]
+
+        future.add_done_callback(lambda f: self.forget(track_file, f))
+
+    # stop converting a track that was removed from the list, unless
+    #   another entry still uses it
+    def remove(self, track_file: str):
+        with self._lock:
+            entry = self._jobs.get(track_file, None)
+            if entry is None:
+                return
+
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+
+            del self._jobs[track_file]
+
+        (future, job, count) = entry
+        future.cancel()
+        job.cancel()
+
+    # drop queued work when a build starts, so it doesn't compete with the
+    #   build's own conversions. Conversions already running are left to
+    #   finish, since the build may be able to use them
+    def cancel_pending(self):
+        with self._lock:
+            for (track_file, entry) in list(self._jobs.items()):
+                if entry[0].cancel():
+                    del self._jobs[track_file]
+
+    # stop all work, e.g. when the app closes
+    def shutdown(self):
+        with self._lock:
+            entries = list(self._jobs.values())
+            self._jobs.clear()
+
+        for (future, job, count) in entries:
+            future.cancel()
+            job.cancel()
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            shutil.rmtree(self._tmp_path, ignore_errors=True)
+
+            self._pool = None
+            self._tmp_path = None
+
+    def forget(self, track_file: str, future):
+        with self._lock:
+            entry = self._jobs.get(track_file, None)
+            if entry is not None and entry[0] is future:
+                del self._jobs[track_file]
+
+    # convert a track into the cache, the same way a build would
+    # the cache is the build's own, so it's kept to the size the user chose
+    def convert(self, track_file: str, settings: dict, job: FFmpegJob):
+        cache = get_cache(settings)
+
+        generator = generator_factory.get(settings)
+        generator.tmp_path = self._tmp_path
+        generator.cache = cache
+        generator.job = job
+        generator.backend = get_backend(settings)
+        generator.analysis_cache = self._analysis_cache
+
+        entry = DiscListEntryContents(track_file=track_file, internal_name=f'track{next(self._names)}')
+        data = generator.prepare_for_convert(entry, settings)
+
+        try:
+            generator.apply_analysis(data, generator.analyze_track(data, settings), settings)
+            generator.convert_to_ogg(data)
+            cache.evict()
+
+        #cancelled, or a broken track; if it's broken, the build will report it
+        except IMDException:
+            pass
+
+        finally:
+            if os.path.isfile(data.out_track):
+                os.remove(data.out_track)
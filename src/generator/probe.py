@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs audio probe module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import mutagen
+import threading
+
+from typing import Callable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from mutagen import MutagenError
+from mutagen.mp3 import MP3
+from mutagen.wave import WAVE
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+
+from src.definitions import Constants, AudioCodec, TrackProbeContents
+
+
+
+#dictionary to associate mutagen file type : codec
+CodecFromTypeDict = {
+    OggVorbis:  AudioCodec.VORBIS,
+    OggOpus:    AudioCodec.OPUS,
+    MP3:        AudioCodec.MP3,
+    WAVE:       AudioCodec.WAV
+}
+
+# Opus always decodes at 48kHz, mutagen doesn't report it
+OPUS_SAMPLE_RATE = 48000
+
+
+
+# read stream info from a track's headers, without decoding any audio
+# identifies the file by its contents rather than its extension, so
+#   an Opus stream saved as '.ogg' is still recognized as Opus
+# tracks that can't be identified are reported as AudioCodec.UNKNOWN
+def probe_track(track_file: str) -> TrackProbeContents:
+    try:
+        meta = mutagen.File(track_file)
+    except (MutagenError, OSError):
+        meta = None
+
+    if meta is None:
+        return TrackProbeContents()
+
+    codec = CodecFromTypeDict.get(type(meta), AudioCodec.UNKNOWN)
+
+    if codec == AudioCodec.OPUS:
+        sample_rate = OPUS_SAMPLE_RATE
+    else:
+        sample_rate = getattr(meta.info, 'sample_rate', 0)
+
+    return TrackProbeContents(codec       = codec,
+                              channels    = getattr(meta.info, 'channels', 0),
+                              sample_rate = sample_rate,
+                              length_s    = getattr(meta.info, 'length', 0.0),
+                              bitrate     = getattr(meta.info, 'bitrate', 0))
+
+
+
+# Probes of the tracks in the track list, so each file's headers are only
+#   read once between the UI and the builds that use it
+#
+# Probes are kept in memory by path, and only used while the file's
+#   modification time and size are the same as when it was probed
+class ProbeCache():
+
+    def __init__(self):
+        self._probes = {}
+        self._lock = threading.Lock()
+
+    # returns None if the track hasn't been probed since it last changed
+    def fetch(self, track_file: str) -> Optional[TrackProbeContents]:
+        with self._lock:
+            entry = self._probes.get(track_file, None)
+
+        if entry is None or entry[0] != get_stamp(track_file):
+            return None
+
+        return entry[1]
+
+    def probe(self, track_file: str) -> TrackProbeContents:
+        probe = self.fetch(track_file)
+        if probe is not None:
+            return probe
+
+        #stamp first, so a file that changes while it's probed is probed again
+        #missing files are kept too, so they aren't probed over and over
+        stamp = get_stamp(track_file)
+        probe = probe_track(track_file)
+
+        with self._lock:
+            self._probes[track_file] = (stamp, probe)
+
+        return probe
+
+# modification time and size, or None if the file can't be read
+def get_stamp(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+_probe_cache = ProbeCache()
+
+def get_probe_cache() -> ProbeCache:
+    return _probe_cache
+
+
+
+# Probes tracks as soon as they're added to the track list, on a few
+#   background threads since reading headers is mostly waiting on the disk
+# probed_cb is called with the track's path once its probe is cached. It's
+#   called from a background thread, e.g. to emit a Qt signal
+class ProbeService():
+
+    def __init__(self, probed_cb: Callable, workers: int = Constants.PROBE_WORKERS):
+        self._probed_cb = probed_cb
+        self._workers = workers
+        self._cache = get_probe_cache()
+
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pending: set[str] = set()
+        self._lock = threading.Lock()
+
+    def add(self, track_file: str):
+        if self._cache.fetch(track_file) is not None:
+            self._probed_cb(track_file)
+            return
+
+        with self._lock:
+            if track_file in self._pending:
+                return
+
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers)
+
+            self._pending.add(track_file)
+            self._pool.submit(self.probe, track_file)
+
+    def probe(self, track_file: str):
+        try:
+            self._cache.probe(track_file)
+
+        finally:
+            with self._lock:
+                self._pending.discard(track_file)
+
+        self._probed_cb(track_file)
+
+    # number of tracks still waiting to be probed
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
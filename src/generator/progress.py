@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs conversion progress module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import time
+import threading
+
+from typing import Callable
+
+from src.definitions import Constants
+
+
+
+# Combine the progress of every running conversion into one overall figure
+#
+# Progress is measured in seconds of audio converted, so a long track
+#   counts for more than a short one. Workers report how far into their
+#   track FFmpeg has got and how fast it's going; finished tracks count
+#   in full. Updates come from many worker threads at once, and are passed
+#   on to progress_cb at most once per interval so the UI isn't flooded
+#
+# progress_cb gets the percent complete, the throughput in seconds of
+#   audio converted per second, and the estimated seconds remaining
+class ConvertProgress():
+
+    def __init__(self, total_s: float, progress_cb: Callable, interval_s: float = Constants.PROGRESS_INTERVAL_S):
+        self.total_s = total_s
+        self._progress_cb = progress_cb
+        self._interval_s = interval_s
+
+        self._done_s = 0.0
+        self._done: dict[str, float] = {}     #task : seconds converted
+        self._speed: dict[str, float] = {}    #task : current speed, for running tasks
+
+        self._start = time.monotonic()
+        self._last_emit = 0.0
+        self._lock = threading.Lock()
+
+    # a running task converted up to out_time_s of its track
+    def update(self, task: str, out_time_s: float, speed: float):
+        with self._lock:
+            self._set_done(task, out_time_s)
+
+            if speed > 0:
+                self._speed[task] = speed
+
+        self.emit()
+
+    # a task finished, and converted length_s of audio in total
+    def finish(self, task: str, length_s: float):
+        with self._lock:
+            self._set_done(task, length_s)
+            self._speed.pop(task, None)
+
+        self.emit()
+
+    def _set_done(self, task: str, seconds: float):
+        self._done_s += seconds - self._done.get(task, 0.0)
+        self._done[task] = seconds
+
+    # pass the current progress on, unless it was passed on too recently
+    def emit(self, force: bool = False):
+        now = time.monotonic()
+
+        with self._lock:
+            if not force and (now - self._last_emit) < self._interval_s:
+                return
+
+            self._last_emit = now
+
+            done_s = min(self._done_s, self.total_s)
+            remaining_s = self.total_s - done_s
+
+            #the speed FFmpeg reports is the most up to date, but isn't
+            #  available for cached tracks or from worker processes
+            throughput = sum(self._speed.values())
+            if throughput <= 0:
+                elapsed = now - self._start
+                throughput = (done_s / elapsed) if elapsed > 0 else 0.0
+
+        percent = (100.0 * done_s / self.total_s) if self.total_s > 0 else 100.0
+        eta = (remaining_s / throughput) if throughput > 0 else 0.0
+
+        self._progress_cb(percent, throughput, eta)
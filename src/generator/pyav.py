@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs in-process conversion module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import time
+
+from fractions import Fraction
+from functools import lru_cache
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+from src.definitions import Status, IMDException, ConvertBackend, EncodeProfileContents
+from src.generator.ffmpeg import FFmpegJob
+
+try:
+    import av
+except ImportError:
+    av = None  #type: ignore[assignment]
+
+
+
+# Convert tracks with PyAV, which wraps the same libraries FFmpeg is built
+#   on, instead of running FFmpeg as a subprocess
+#
+# There's no process to start for each track, and paths are passed straight
+#   to the library. PyAV releases the GIL while decoding and encoding, so
+#   conversions still run in parallel on threads. Decoding and encoding are
+#   separate steps, so later stages can work on the decoded audio without
+#   decoding the track a second time
+#
+# PyAV is optional. If it isn't installed, or its build of FFmpeg doesn't
+#   include libvorbis, tracks are converted with the FFmpeg subprocess
+ENCODER = 'libvorbis'
+SAMPLE_FORMAT = 'fltp'
+
+# FFmpeg takes the encoder's quality level (-q:a) in units of this
+QP2LAMBDA = 118
+
+
+
+@lru_cache(maxsize=None)
+def is_available() -> bool:
+    return av is not None and ENCODER in av.codecs_available
+
+# pick a conversion backend based on user settings
+def get_backend(user_settings: dict) -> ConvertBackend:
+    backend = ConvertBackend(user_settings.get('backend', ConvertBackend.FFMPEG.value))
+
+    if backend == ConvertBackend.PYAV and not is_available():
+        print(f"PyAV with {ENCODER} is not available, converting with FFmpeg instead")
+        return ConvertBackend.FFMPEG
+
+    return backend
+
+
+
+# decode a track's first audio stream, or the part of it starting at
+#   start_s and lasting length_s (to the end, if 0)
+# frames are yielded as planar float at the track's sample rate, with
+#   timestamps counted in samples from the start of the decoded part. If
+#   layout is given (e.g. 'mono'), channels are mixed to that layout
+# filters are FFmpeg audio filters, given the same way as to '-af'
+# if max_rate is given, tracks with a higher sample rate are resampled to it
+def decode_audio(src_track: str, start_s: float = 0.0, length_s: float = 0.0, layout: Optional[str] = None,
+                 filters: Sequence[str] = (), max_rate: int = 0, job: Optional[FFmpegJob] = None) -> Iterator:
+    try:
+        with av.open(src_track) as container:
+            stream = container.streams.audio[0]
+            stream.thread_type = 'AUTO'
+
+            rate = stream.codec_context.sample_rate
+            if max_rate > 0:
+                rate = min(rate, max_rate)
+            layout = layout or stream.codec_context.layout.name
+
+            graph = av.filter.Graph()
+            nodes = [graph.add_abuffer(template=stream)]
+
+            #trim exactly to the segment, since seeking only gets close
+            if start_s > 0 or length_s > 0:
+                trim = f'start={start_s:.6f}'
+                if length_s > 0:
+                    trim += f':duration={length_s:.6f}'
+
+                nodes.append(graph.add('atrim', trim))
+                nodes.append(graph.add('asetpts', 'PTS-STARTPTS'))
+
+            for flt in filters:
+                (name, sep, args) = flt.partition('=')
+                nodes.append(graph.add(name, args or None))
+
+            nodes.append(graph.add('aformat', f'sample_fmts={SAMPLE_FORMAT}:channel_layouts={layout}:sample_rates={rate}'))
+            nodes.append(graph.add('abuffersink'))
+
+            for (a, b) in zip(nodes, nodes[1:]):
+                a.link_to(b)
+            graph.configure()
+
+            if start_s > 0:
+                container.seek(int(start_s * av.time_base))
+
+            time_base = Fraction(1, rate)
+            samples = 0
+
+            for frame in container.decode(stream):
+                if job is not None:
+                    job.check()
+
+                graph.push(frame)
+                for f in pull_frames(graph):
+                    f.pts = samples
+                    f.time_base = time_base
+                    samples += f.samples
+                    yield f
+
+            #flush the filters
+            graph.push(None)
+            for f in pull_frames(graph):
+                f.pts = samples
+                f.time_base = time_base
+                samples += f.samples
+                yield f
+
+    except (av.error.FFmpegError, IndexError, ValueError) as e:
+        print(f"{src_track}: {e}")
+        raise IMDException(Status.FFMPEG_CONVERT_FAIL)
+
+def pull_frames(graph) -> Iterator:
+    while True:
+        try:
+            yield graph.pull()
+        except (av.error.BlockingIOError, av.error.EOFError):
+            return
+
+# encode decoded frames to Ogg Vorbis
+# if progress_cb is given, it's called with how many seconds of audio have
+#   been encoded and how fast it's going, the same as FFmpeg reports it
+# quality is the same as FFmpeg's -q:a, or the encoder's default if None
+def encode_vorbis(frames: Iterator, out_track: str, quality: Optional[float] = None, progress_cb: Optional[Callable] = None):
+    options = {}
+    if quality is not None:
+        options = {'global_quality': str(int(quality * QP2LAMBDA)), 'flags': '+qscale'}
+
+    start = time.monotonic()
+    stream: Any = None      #add_stream() is typed as returning a plain Stream, not an AudioStream
+
+    try:
+        with av.open(out_track, 'w', format='ogg') as container:
+            for frame in frames:
+                #the encoder takes its settings from the first frame
+                if stream is None:
+                    stream = container.add_stream(ENCODER, rate=frame.sample_rate, options=options)
+                    stream.layout = frame.layout.name
+                    stream.format = SAMPLE_FORMAT
+
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+
+                if progress_cb is not None:
+                    out_time_s = float(frame.pts * frame.time_base)
+                    progress_cb(out_time_s, out_time_s / max(time.monotonic() - start, 1e-6))
+
+            if stream is None:
+                raise IMDException(Status.BAD_OGG_CONVERT)
+
+            for packet in stream.encode(None):
+                container.mux(packet)
+
+    except (av.error.FFmpegError, ValueError) as e:
+        print(f"{out_track}: {e}")
+        raise IMDException(Status.FFMPEG_CONVERT_FAIL)
+
+# decode and encode a track in one go
+# if a profile is given, the track is encoded with its settings
+def encode_track(src_track: str, out_track: str, start_s: float = 0.0, length_s: float = 0.0, mix_mono: bool = False,
+                 filters: Sequence[str] = (), profile: Optional[EncodeProfileContents] = None, job: Optional[FFmpegJob] = None,
+                 progress_cb: Optional[Callable] = None):
+    if profile is not None:
+        mix_mono = mix_mono or profile.channels == 1
+
+    frames = decode_audio(src_track, start_s, length_s, 'mono' if mix_mono else None, filters,
+                          profile.sample_rate if profile is not None else 0, job)
+    encode_vorbis(frames, out_track, profile.quality if profile is not None else None, progress_cb)
+
+# copy a track's first audio stream into a new Ogg container without
+#   re-encoding it. Metadata isn't copied
+def remux_track(src_track: str, out_track: str, job: Optional[FFmpegJob] = None):
+    try:
+        with av.open(src_track) as src, av.open(out_track, 'w', format='ogg') as dst:
+            in_stream = src.streams.audio[0]
+            out_stream = dst.add_stream(template=in_stream)
+
+            for packet in src.demux(in_stream):
+                if job is not None:
+                    job.check()
+
+                #demuxers end with an empty packet
+                if packet.dts is None:
+                    continue
+
+                packet.stream = out_stream
+                dst.mux(packet)
+
+    except (av.error.FFmpegError, IndexError, ValueError) as e:
+        print(f"{src_track}: {e}")
+        raise IMDException(Status.FFMPEG_CONVERT_FAIL)
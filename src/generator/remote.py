@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs remote conversion module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import sys
+import time
+import socket
+import shutil
+import argparse
+import tempfile
+import threading
+
+from types import MethodType
+from typing import Any, Callable, Optional, Union
+from dataclasses import replace
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener, Connection, answer_challenge, deliver_challenge
+
+from src.definitions import Constants, Status, IMDException, RemoteMessage
+from src.generator.staging import unlink_output
+import src.generator.executor as executor_factory
+
+
+
+# Conversion workers on other machines
+#
+# A worker is a headless process that listens on a TCP port or Unix socket
+#   and converts batches of tracks for a build, with the same generator code
+#   the build uses locally. Builds open one connection per worker slot and
+#   send one batch at a time over it; see RemoteExecutor for how batches are
+#   handed out. Messages are pickled, so connections are authenticated with
+#   a shared key before anything is sent
+#
+# If a worker can see the build's staging area at the same path (the same
+#   machine, or a shared network drive), it reads and writes tracks there
+#   directly. Otherwise source files are sent ahead of the first batch that
+#   needs them, once per connection, and the converted files are sent back.
+#   Files go over the connection in pieces, so neither end holds a whole
+#   track in memory
+#
+# Start a worker with:
+#   IMD_REMOTE_KEY=<key> python -m src.generator.remote --listen 0.0.0.0:7431
+DEFAULT_ADDRESS = '127.0.0.1:7431'
+
+# raised when a worker disconnects or stops responding
+class WorkerLost(Exception):
+    pass
+
+
+
+# 'host:port' for TCP, anything else is a Unix socket path
+def parse_address(address: str) -> Union[tuple, str]:
+    (host, sep, port) = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host, int(port))
+
+    return address
+
+def get_key(user_settings: dict) -> bytes:
+    key = user_settings.get('remote_key', '') or os.environ.get(Constants.REMOTE_KEY_ENV, '')
+    return key.encode('utf-8')
+
+# send a file as FILE messages, the last one shorter than a full piece
+def send_file(send: Callable, path: str, name: str):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(Constants.REMOTE_CHUNK_BYTES)
+            send((RemoteMessage.FILE, name, chunk))
+
+            if len(chunk) < Constants.REMOTE_CHUNK_BYTES:
+                return
+
+# write a piece of a file sent with send_file()
+def write_chunk(path: str, chunk: bytes, first: bool):
+    if first:
+        unlink_output(path)
+
+    with open(path, 'wb' if first else 'ab') as f:
+        f.write(chunk)
+
+
+
+# Build side of a connection to a worker slot
+class RemoteWorker():
+
+    def __init__(self, address: str, conn: Connection, slots: int):
+        self.address = address
+        self.slots = slots
+        self.shared: Optional[bool] = None
+
+        self._conn = conn
+        self._jobs = 0
+        self._sent: set[str] = set()
+        self._cancelled = False
+
+    # connect to a worker, returning a connection for each of its slots
+    @classmethod
+    def connect(cls, address: str, key: bytes) -> list:
+        first = cls.open(address, key)
+        workers = [first]
+
+        for i in range(first.slots - 1):
+            workers.append(cls.open(address, key))
+
+        return workers
+
+    @classmethod
+    def open(cls, address: str, key: bytes):
+        parsed = parse_address(address)
+
+        #Client() waits as long as the OS does for an unreachable host, so
+        #  connect with a timeout and authenticate the same way it would
+        if isinstance(parsed, tuple):
+            sock = socket.create_connection(parsed, timeout=Constants.REMOTE_CONNECT_TIMEOUT_S)
+            sock.settimeout(None)
+
+            conn = Connection(sock.detach())
+            answer_challenge(conn, key)
+            deliver_challenge(conn, key)
+
+        else:
+            conn = Client(parsed, authkey=key)
+
+        if not conn.poll(Constants.REMOTE_TIMEOUT_S):
+            conn.close()
+            raise WorkerLost(address)
+
+        (message, slots) = conn.recv()
+        if message != RemoteMessage.HELLO:
+            conn.close()
+            raise WorkerLost(address)
+
+        return cls(address, conn, slots)
+
+    # run fn over a batch of tasks on the worker, and return its result
+    # raises WorkerLost if the worker goes away before it's done
+    def run(self, fn: Callable, unit: list):
+        if self.shared is None:
+            self.shared = self.check_shared(os.path.dirname(unit[0].out_track))
+
+        #segments of a track, and tracks retried after a failure, reuse
+        #  the copy the worker already has
+        if not self.shared:
+            for data in unit:
+                if data.src_track not in self._sent:
+                    send_file(self.send, data.src_track, data.src_track)
+                    self._sent.add(data.src_track)
+
+        self._jobs += 1
+        self.send((RemoteMessage.JOB, self._jobs, fn, unit))
+
+        written: set[str] = set()
+        try:
+            message = self.receive()
+            while message[0] in (RemoteMessage.ALIVE, RemoteMessage.FILE):
+                if message[0] == RemoteMessage.FILE:
+                    write_chunk(message[1], message[2], message[1] not in written)
+                    written.add(message[1])
+
+                message = self.receive()
+
+        #FFmpeg may outlive a lost worker and keep writing, and files may
+        #  only have been partly sent, so unlink them; whoever converts the
+        #  batch next writes new ones
+        except (WorkerLost, IMDException):
+            for data in unit:
+                if os.path.isfile(data.out_track):
+                    os.remove(data.out_track)
+            raise
+
+        #the batch itself failed, the same as it would have locally
+        if message[0] == RemoteMessage.ERROR:
+            raise message[2]
+
+        (tag, job, results) = message
+        return results
+
+    # check whether the worker sees the staging area at the same path, by
+    #   asking it to read back a file written there
+    def check_shared(self, staging_dir: str) -> bool:
+        token = os.urandom(16).hex()
+        (fd, probe) = tempfile.mkstemp(prefix='.imd_probe_', dir=staging_dir)
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(token)
+
+            self.send((RemoteMessage.PROBE, probe, token))
+            (message, shared) = self.receive()
+
+        finally:
+            os.remove(probe)
+
+        return shared
+
+    # wait for the next message; the worker sends one every few seconds
+    #   while it's busy, so a long silence means it's gone
+    # raises Status.CANCELLED if the build is cancelled while waiting
+    def receive(self):
+        deadline = time.monotonic() + Constants.REMOTE_TIMEOUT_S
+
+        try:
+            while not self._conn.poll(Constants.CANCEL_POLL_S):
+                if self._cancelled:
+                    raise IMDException(Status.CANCELLED)
+
+                if time.monotonic() > deadline:
+                    raise WorkerLost(f'{self.address}: timed out')
+
+            return self._conn.recv()
+
+        except (OSError, EOFError) as e:
+            raise WorkerLost(f'{self.address}: {str(e) or "disconnected"}')
+
+    def send(self, message: tuple):
+        try:
+            self._conn.send(message)
+        except OSError as e:
+            raise WorkerLost(f'{self.address}: {e}')
+
+    # stop waiting for the worker. Once the connection is closed, the
+    #   worker notices on its next heartbeat and kills its FFmpeg processes
+    def cancel(self):
+        self._cancelled = True
+
+    def close(self):
+        try:
+            self._conn.send((RemoteMessage.BYE,))
+        except OSError:
+            pass
+
+        self._conn.close()
+
+
+
+# Worker side
+#
+# listen for builds and convert whatever they send, one batch at a time
+#   per connection. If stream is set, files are always sent over the
+#   connection even if the worker could reach them directly
+def serve(address: str, key: bytes, slots: int, stream: bool = False):
+    with Listener(parse_address(address), authkey=key) as listener:
+        print(f"Conversion worker listening on {address} with {slots} slots")
+
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError, EOFError) as e:
+                print(f"Rejected connection: {e}")
+                continue
+
+            threading.Thread(target=handle_connection, args=(conn, slots, stream), daemon=True).start()
+
+# source files sent over a connection are kept for as long as it's open,
+#   keyed by the build's paths, since later batches may need them again
+def handle_connection(conn: Connection, slots: int, stream: bool):
+    lock = threading.Lock()
+    shared = False
+    sources: dict[str, str] = {}
+    src_path = None
+
+    try:
+        conn.send((RemoteMessage.HELLO, slots))
+
+        while True:
+            message = conn.recv()
+
+            if message[0] == RemoteMessage.PROBE:
+                shared = not stream and read_probe(message[1]) == message[2]
+                conn.send((RemoteMessage.PROBE, shared))
+
+            elif message[0] == RemoteMessage.FILE:
+                (tag, name, chunk) = message
+                if src_path is None:
+                    src_path = tempfile.mkdtemp(prefix='.imd_remote_src_')
+
+                first = name not in sources
+                if first:
+                    sources[name] = os.path.join(src_path, f'src{len(sources)}' + os.path.splitext(name)[1])
+
+                write_chunk(sources[name], chunk, first)
+
+            elif message[0] == RemoteMessage.JOB:
+                run_job(conn, lock, message, shared, sources)
+
+            else:
+                break
+
+    except (OSError, EOFError):
+        pass
+
+    finally:
+        conn.close()
+        if src_path is not None:
+            shutil.rmtree(src_path, ignore_errors=True)
+
+def read_probe(path: str) -> str:
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return ''
+
+# convert one batch, sending heartbeats until it's done
+def run_job(conn: Connection, lock: threading.Lock, message: tuple, shared: bool, sources: dict):
+    (tag, job, fn, unit) = message
+    done = threading.Event()
+
+    def heartbeat():
+        while not done.wait(Constants.REMOTE_HEARTBEAT_S):
+            try:
+                with lock:
+                    conn.send((RemoteMessage.ALIVE,))
+
+            #the build went away, e.g. it was cancelled; nobody is
+            #  waiting for the batch, so stop converting it
+            except OSError:
+                fn.__self__.job.cancel()
+                return
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    def send(message: tuple):
+        with lock:
+            conn.send(message)
+
+    tmp_path = None
+    try:
+        outputs = {}
+        if shared:
+            results = fn(unit)
+
+        else:
+            tmp_path = tempfile.mkdtemp(prefix='.imd_remote_')
+            (results, outputs) = run_streamed(fn, unit, sources, tmp_path)
+
+        reply = (RemoteMessage.DONE, job, results)
+
+    except Exception as e:
+        reply = (RemoteMessage.ERROR, job, e)
+
+    finally:
+        done.set()
+
+    try:
+        for (local, out_track) in outputs.items():
+            send_file(send, local, out_track)
+
+        send(reply)
+
+    finally:
+        if tmp_path is not None:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+# convert a batch in a local staging area, from source files sent ahead
+#   of it. Results are reported with the build's paths, and the converted
+#   files that were written are returned as local path : build's path
+def run_streamed(fn: MethodType, unit: list, sources: dict, tmp_path: str):
+    generator: Any = fn.__self__
+    generator.tmp_path = tmp_path
+    generator.cache = None
+
+    local_unit = []
+    out_tracks = {}
+
+    for data in unit:
+        out_track = os.path.join(tmp_path, os.path.basename(data.out_track))
+
+        local_unit.append(replace(data, src_track=sources[data.src_track], out_track=out_track))
+        out_tracks[out_track] = data.out_track
+
+    results = [replace(r, out_track=out_tracks[r.out_track]) for r in fn(local_unit)]
+    outputs = {local: out_track for (local, out_track) in out_tracks.items() if os.path.isfile(local)}
+
+    return (results, outputs)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Infinite Music Discs conversion worker')
+    parser.add_argument('--listen', default=DEFAULT_ADDRESS, help="'host:port' or a Unix socket path")
+    parser.add_argument('--slots', type=int, default=0, help="tracks to convert at once (default: one per core)")
+    parser.add_argument('--stream', action='store_true', help="always send files over the connection")
+    args = parser.parse_args()
+
+    key = get_key({})
+    if not key:
+        sys.exit(f"Set {Constants.REMOTE_KEY_ENV} to the key builds will use to connect")
+
+    serve(args.listen, key, args.slots or executor_factory.available_workers(), args.stream)
+
+
+
+if __name__ == '__main__':
+    main()
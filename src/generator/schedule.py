@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs conversion scheduling module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import heapq
+
+from src.definitions import Constants, ConvertMode, TrackProbeContents
+
+
+
+# Estimate how long a conversion will take, in seconds of one worker's time
+# Estimates only need to rank tracks against each other and give the user
+#   a rough idea of how long to wait, so they come from cheap header
+#   probes rather than from timing anything
+def estimate_cost(probe: TrackProbeContents, mode: ConvertMode, size: int) -> float:
+    if mode == ConvertMode.REMUX:
+        return Constants.JOB_OVERHEAD_S + (size / Constants.REMUX_BYTES_PER_S)
+
+    #fall back to a typical bitrate if the headers didn't report a length
+    length_s = probe.length_s
+    if length_s <= 0:
+        length_s = (size * 8) / Constants.FALLBACK_BITRATE
+
+    return Constants.JOB_OVERHEAD_S + (length_s / Constants.ENCODE_SPEED)
+
+# order tasks longest-first, so that long tracks start right away instead of
+#   being picked up last and finishing alone while every other worker is idle
+# sorted() is stable, so tracks with equal costs keep their list order
+def order_longest_first(tasks: list, costs: list) -> list:
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    return [tasks[i] for i in order]
+
+# estimate the wall-clock time of running tasks with the given costs on
+#   a number of workers, by handing each task in order to whichever
+#   worker frees up first
+def estimate_makespan(costs: list, workers: int) -> float:
+    finish_times = [0.0] * max(1, min(workers, len(costs)))
+
+    for c in costs:
+        t = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, t + c)
+
+    return max(finish_times)
+
+# group short tasks into batches, so each batch can be converted by a single
+#   FFmpeg process instead of paying its startup cost for every task
+# tasks are added in order until a batch reaches max_length_s of audio or
+#   max_count tasks. Returns lists of indexes into lengths
+def pack_batches(lengths: list, max_length_s: float, max_count: int) -> list:
+    batches = []
+    batch: list[int] = []
+    batch_length_s = 0.0
+
+    for (i, length_s) in enumerate(lengths):
+        if batch and (batch_length_s + length_s > max_length_s or len(batch) >= max_count):
+            batches.append(batch)
+            batch = []
+            batch_length_s = 0.0
+
+        batch.append(i)
+        batch_length_s += length_s
+
+    if batch:
+        batches.append(batch)
+
+    return batches
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs staging area module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import shutil
+import tempfile
+import threading
+
+from typing import IO
+
+from src.definitions import StagingPolicy
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  #type: ignore[assignment]
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None  #type: ignore[assignment]
+
+
+
+# Linux ioctl for cloning a file's extents (btrfs, XFS, etc.)
+FICLONE = 0x40049409
+
+TMPFS_PATH = '/dev/shm'
+STAGING_PREFIX = '.imd_tmp_'
+STAGING_LOCK_NAME = 'build.lock'
+
+#open lock files of the staging areas this process is building in, by path
+#  kept here rather than on the generator, which is sent to worker processes
+_staging_locks: dict[str, IO[bytes]] = {}
+_staging_locks_lock = threading.Lock()
+
+
+
+# create the directory that converted tracks are staged in
+#   OUTPUT: in output_dir, next to the generated packs, so staged files
+#     can be renamed into the pack instead of copied
+#   TMPFS:  in memory, if the system has a tmpfs mount
+#   SYSTEM: in the system temp directory
+# the directory is named after the build, and is reused if a previous
+#   attempt at the same build left it behind, so that finished work
+#   can be resumed
+def create_staging_dir(policy: StagingPolicy, build_id: str, output_dir: str) -> str:
+    if policy == StagingPolicy.OUTPUT:
+        parent = output_dir
+    elif policy == StagingPolicy.TMPFS and os.path.isdir(TMPFS_PATH):
+        parent = TMPFS_PATH
+    else:
+        parent = tempfile.gettempdir()
+
+    path = os.path.join(parent, STAGING_PREFIX + build_id)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+
+    return path
+
+# take an exclusive lock on a staging area for as long as a build uses it,
+#   so two builds never share one, whether they're in this process or not
+# returns False if another build holds it
+def lock_staging_dir(path: str) -> bool:
+    with _staging_locks_lock:
+        if path in _staging_locks:
+            return False
+
+        f = open(os.path.join(path, STAGING_LOCK_NAME), 'a+b')
+
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif msvcrt is not None:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+        except OSError:
+            f.close()
+            return False
+
+        _staging_locks[path] = f
+        return True
+
+def unlock_staging_dir(path: str):
+    with _staging_locks_lock:
+        f = _staging_locks.pop(path, None)
+
+    #closing the file releases the lock
+    if f is not None:
+        f.close()
+
+# move a file the app owns (e.g. a staged track) to its final location
+# a rename if both paths are on the same filesystem, a copy otherwise
+def move_file(src: str, dst: str):
+    try:
+        os.replace(src, dst)
+    except OSError:
+        shutil.move(src, dst)
+
+# remove a staged output before it's written again
+# staged outputs may be hardlinked to transcode cache entries, and writers
+#   open their output in place, so writing over a linked file would change
+#   the cache entry too. Unlinking first gives the writer a new file
+def unlink_output(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# give dst the same contents as src by hardlinking, falling back to a copy
+# only safe for files that are replaced rather than modified in place,
+#   since both paths share the same data
+def link_file(src: str, dst: str):
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+# copy a file the app doesn't own (e.g. a user's disc texture)
+# use a copy-on-write clone if the filesystem supports it, so the
+#   copy is free but editing one file never changes the other
+def clone_file(src: str, dst: str):
+    if fcntl is not None:
+        try:
+            with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+                fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+            return
+
+        except OSError:
+            pass
+
+    shutil.copyfile(src, dst)
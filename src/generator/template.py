@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs pack template module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import json
+import string
+
+from typing import Callable, Optional, Union
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+from json.encoder import encode_basestring_ascii
+
+from src.contents.base import thaw
+
+
+
+# Compiled templates for the files in src.contents
+#
+# Templates are JSON-like dicts and lists, or plain text, whose strings are
+#   str.format() strings, e.g. 'give_{entry.internal_name}.mcfunction'.
+#   Strings containing '(int){' or '(float){' are cast to that type after
+#   formatting
+#
+# Each template is compiled once per build, straight to the text it will be
+#   written as: parts without fields are serialized up front, and the rest
+#   becomes one format string with a slot for each field. Rendering a file
+#   for each disc then only looks up the fields, escapes them, and fills
+#   them in. Output is the same as json.dump(..., indent=4)
+INT_MARKER = '(int){'
+FLOAT_MARKER = '(float){'
+INDENT = ' ' * 4
+
+FORMATTER = string.Formatter()
+
+
+
+# A str.format() string, split into its literal text and a getter for each
+#   field. Fields are looked up in a context dictionary, the same one the
+#   string would otherwise be formatted with
+# fields with a conversion or format spec are rare enough to just be
+#   formatted the usual way
+class FormatString():
+
+    def __init__(self, text: str):
+        self.text = text
+        self.literals = []
+        self.getters = []
+        self.fallback = False
+
+        #the parser also splits literal text at escaped braces, so join it
+        #  back up into one literal before each field
+        literal_text = ''
+
+        for (literal, field, spec, conversion) in FORMATTER.parse(text):
+            literal_text += literal
+
+            if field is None:
+                continue
+
+            getter = make_getter(field)
+            if getter is None or spec or conversion:
+                self.fallback = True
+                break
+
+            self.literals.append(literal_text)
+            self.getters.append(getter)
+            literal_text = ''
+
+        self.literals.append(literal_text)
+
+        self._fmt = '{}'.join(escape_braces(l) for l in self.literals)
+
+        #strings without fields only need formatting once, to unescape braces
+        self.static = not (self.getters or self.fallback)
+        self.value = ''.join(self.literals) if self.static else None
+
+    def render(self, ctx: dict) -> str:
+        if self.fallback:
+            return self.text.format(**ctx)
+
+        return self._fmt.format(*[g(ctx) for g in self.getters])
+
+# getter for a field like 'pack_name' or 'entry.title'
+# returns None for fields it doesn't handle, e.g. indexes
+def make_getter(field: str):
+    (name, dot, attrs) = field.partition('.')
+
+    if not all(p.isidentifier() for p in field.split('.')):
+        return None
+
+    if not attrs:
+        return itemgetter(name)
+
+    get_attrs = attrgetter(attrs)
+    return lambda ctx: get_attrs(ctx[name])
+
+def escape_braces(text: str) -> str:
+    return text.replace('{', '{{').replace('}', '}}')
+
+def constant(value) -> Callable:
+    return lambda ctx: value
+
+# split off a '(int){' or '(float){' marker
+# returns (format string, type to cast to or None)
+def parse_typed(text: str) -> tuple:
+    if INT_MARKER in text:
+        return (FormatString(text.replace(INT_MARKER, '{')), int)
+
+    if FLOAT_MARKER in text:
+        return (FormatString(text.replace(FLOAT_MARKER, '{')), float)
+
+    return (FormatString(text), None)
+
+
+
+# JSON that has already been serialized, e.g. a rendered entry that goes
+#   inside another file. Written as it is, indented to where it goes
+class JSONText(str):
+    pass
+
+# serialize JSON like json.dumps(obj, indent=4), starting at the given
+#   indent level
+def dump_json(obj, level: int = 0) -> str:
+    if type(obj) == JSONText:
+        return obj.replace('\n', '\n' + INDENT * level)
+
+    if type(obj) == dict:
+        if not obj:
+            return '{}'
+
+        inner = '\n' + INDENT * (level + 1)
+        items = [dump_key(k) + ': ' + dump_json(v, level + 1) for (k, v) in obj.items()]
+        return '{' + inner + (',' + inner).join(items) + '\n' + INDENT * level + '}'
+
+    if type(obj) in [list, tuple]:
+        if not obj:
+            return '[]'
+
+        inner = '\n' + INDENT * (level + 1)
+        items = [dump_json(v, level + 1) for v in obj]
+        return '[' + inner + (',' + inner).join(items) + '\n' + INDENT * level + ']'
+
+    return json.dumps(obj)
+
+def dump_key(key) -> str:
+    if type(key) == str:
+        return encode_basestring_ascii(key)
+
+    #non-string keys are written as strings, as json.dumps() does
+    return encode_basestring_ascii(json.dumps(key))
+
+
+
+# compile a JSON-like template into a function of a context dictionary,
+#   for templates whose rendered value is needed rather than their text
+# returns (static, value): value is the rendered template if static is
+#   set, otherwise a function that renders it
+def compile_json(obj) -> tuple:
+    if type(obj) == str:
+        (fmt, cast) = parse_typed(obj)
+
+        if fmt.static:
+            return (True, cast(fmt.value) if cast else fmt.value)
+
+        render = fmt.render
+        return (False, (lambda ctx: cast(render(ctx))) if cast else render)
+
+    if type(obj) == list:
+        items = [compile_json(v) for v in obj]
+
+        if all(static for (static, v) in items):
+            return (True, [v for (static, v) in items])
+
+        fns = [constant(v) if static else v for (static, v) in items]
+        return (False, lambda ctx: [f(ctx) for f in fns])
+
+    if type(obj) == dict:
+        #keys are formatted too
+        items = [(compile_json(k) if type(k) == str else (True, k), compile_json(v)) for (k, v) in obj.items()]
+
+        if all(ks and vs for ((ks, k), (vs, v)) in items):
+            return (True, {k: v for ((ks, k), (vs, v)) in items})
+
+        pairs = [(constant(k) if ks else k, constant(v) if vs else v) for ((ks, k), (vs, v)) in items]
+        return (False, lambda ctx: {k(ctx): v(ctx) for (k, v) in pairs})
+
+    #numbers, bools, None, JSONText
+    return (True, obj)
+
+# compile a dict template whose items are added to another dict, e.g. one
+#   entry of sounds.json. Renders to a dict of formatted key : JSONText
+def compile_items(obj: dict) -> Callable:
+    items = [(FormatString(k), JSONTemplate(v)) for (k, v) in obj.items()]
+    return lambda ctx: {k.render(ctx): v.render_json(ctx) for (k, v) in items}
+
+
+
+# A JSON-like template compiled to the text it serializes to
+#
+# The text is kept as a list of parts, each either a literal string or a
+#   function of the context that returns text, then joined into one format
+#   string with a slot for each function
+class JSONTemplate():
+
+    def __init__(self, obj, level: int = 0):
+        parts = compile_parts(obj, level)
+
+        literals = ['']
+        self._slots = []
+
+        for p in parts:
+            if type(p) == str:
+                literals[-1] += p
+            else:
+                self._slots.append(p)
+                literals.append('')
+
+        self._fmt = '{}'.join(escape_braces(l) for l in literals)
+        self.static = not self._slots
+        self.value: Optional[str] = literals[0] if self.static else None
+
+    def render(self, ctx: dict) -> str:
+        if self.value is not None:
+            return self.value
+
+        return self._fmt.format(*[s(ctx) for s in self._slots])
+
+    # render as JSON to go inside another file
+    def render_json(self, ctx: dict) -> JSONText:
+        return JSONText(self.render(ctx))
+
+def compile_parts(obj, level: int) -> list:
+    if type(obj) == str:
+        return compile_str_parts(obj)
+
+    if type(obj) in [dict, list] and obj:
+        (static, value) = compile_json(obj)
+        if static:
+            return [dump_json(value, level)]
+
+        #keys that render the same would be merged, as in a dict
+        if type(obj) == dict and len(obj) > 1 and not all(type(k) == str and FormatString(k).static for k in obj):
+            return [lambda ctx: dump_json(value(ctx), level)]
+
+        (opening, closing) = ('{', '}') if type(obj) == dict else ('[', ']')
+        items = obj.items() if type(obj) == dict else [(None, v) for v in obj]
+        inner = '\n' + INDENT * (level + 1)
+
+        parts = [opening]
+        for (i, (k, v)) in enumerate(items):
+            parts.append(inner if i == 0 else ',' + inner)
+
+            if type(obj) == dict:
+                parts += (compile_str_parts(k) if type(k) == str else [dump_key(k)]) + [': ']
+
+            parts += compile_parts(v, level + 1)
+
+        parts.append('\n' + INDENT * level + closing)
+        return parts
+
+    return [dump_json(obj, level)]
+
+# a string's text: its literal text escaped once, and a slot for each field
+#   that escapes the field's value
+def compile_str_parts(text: str) -> list:
+    (fmt, cast) = parse_typed(text)
+
+    if fmt.static:
+        return [dump_json(cast(fmt.value) if cast else fmt.value)]
+
+    if cast is int:
+        render = fmt.render
+        return [lambda ctx: str(int(render(ctx)))]
+
+    if cast is not None:
+        render = fmt.render
+        return [lambda ctx: dump_json(cast(render(ctx)))]
+
+    if fmt.fallback:
+        render = fmt.render
+        return [lambda ctx: encode_basestring_ascii(render(ctx))]
+
+    parts: list[Union[str, Callable]] = ['"']
+    for (literal, getter) in zip(fmt.literals, fmt.getters + [None]):
+        parts.append(encode_basestring_ascii(literal)[1:-1])
+
+        if getter is not None:
+            parts.append(lambda ctx, getter=getter: encode_basestring_ascii(f'{getter(ctx)}')[1:-1])
+
+    parts.append('"')
+    return parts
+
+
+
+# A compiled file from src.contents: a dictionary with the file's 'path'
+#   (a list of format strings), how it 'repeat's, and its 'contents'
+#   (a JSON-like dict, or text). If 'format_contents' is False the
+#   contents are written as they are
+class PackFileTemplate():
+
+    def __init__(self, src: dict):
+        self.repeat = src['repeat']
+        self.path = FormatString(os.path.join(*src['path']))
+
+        contents = src['contents']
+        formatted = src.get('format_contents', True)
+
+        if type(contents) == str:
+            text = contents.lstrip()
+            self._render = FormatString(text).render if formatted else constant(text)
+
+        elif type(contents) == dict:
+            if formatted:
+                self._render = JSONTemplate(contents).render
+            else:
+                self._render = constant(dump_json(contents))
+
+        else:
+            self._render = constant('')
+
+    def get_path(self, ctx: dict) -> str:
+        return self.path.render(ctx)
+
+    def render(self, ctx: dict) -> str:
+        return self._render(ctx)
+
+# compiled templates for every file in a pack's contents
+# contents are shared by every build and never change, so each pack
+#   version's files are only compiled once
+@lru_cache(maxsize=None)
+def compile_contents(contents) -> tuple:
+    return tuple(PackFileTemplate(thaw(f)) for f in contents.contents)
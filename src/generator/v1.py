@@ -20,6 +20,10 @@ from src.generator.base import VirtualGenerator
 
 
 class GeneratorV1(VirtualGenerator):
+    # legacy packs are always written to the working directory
+    def get_output_dir(self, settings: dict) -> str:
+        return os.getcwd()
+
     def generate_datapack(self, entry_list: DiscListContents, user_settings={}):
         titles = entry_list.titles
         internal_names = entry_list.internal_names
@@ -207,9 +211,13 @@ class GeneratorV1(VirtualGenerator):
 
 
     def generate_resourcepack(self, entry_list: DiscListContents, user_settings={}):
+        self.share_textures(entry_list)
+
         texture_files = entry_list.texture_files
         track_files = entry_list.track_files
         internal_names = entry_list.internal_names
+        sound_names = [e.sound_name for e in entry_list.entries]
+        texture_names = [e.texture_name for e in entry_list.entries]
 
         #read settings
         pack_format = user_settings.get('version').get('rp', Constants.DEFAULT_PACK_FORMAT)
@@ -237,7 +245,7 @@ class GeneratorV1(VirtualGenerator):
 
             for i, name in enumerate(internal_names):
                 pack.write('\n"music_disc.{}": '.format(name))
-                pack.write(json.dumps({'sounds': [{'name': 'records/{}'.format(name), 'stream':True}]}, indent=4))
+                pack.write(json.dumps({'sounds': [{'name': 'records/{}'.format(sound_names[i]), 'stream':True}]}, indent=4))
 
                 if i < len(internal_names)-1:
                     pack.write(',\n')
@@ -258,15 +266,17 @@ class GeneratorV1(VirtualGenerator):
             music_disc_11.close()
 
             #write 'music_disc_*.json' files
-            for name in internal_names:
+            for i, name in enumerate(internal_names):
                 music_disc = open(os.path.join(resourcepack_name, 'assets', 'minecraft', 'models', 'item', 'music_disc_%s.json' % name), 'w', encoding='utf-8')
-                music_disc.write(json.dumps({'parent': 'item/generated', 'textures': {'layer0': 'item/music_disc_{}'.format(name)}}, indent=4))
+                music_disc.write(json.dumps({'parent': 'item/generated', 'textures': {'layer0': 'item/music_disc_{}'.format(texture_names[i])}}, indent=4))
                 music_disc.close()
 
-            #copy sound and texture files
+            #copy sound and texture files, once for entries that share them
             for i, name in enumerate(internal_names):
-                shutil.copyfile(track_files[i], os.path.join(resourcepack_name, 'assets', 'minecraft', 'sounds', 'records', '%s.ogg' % name))
-                shutil.copyfile(texture_files[i], os.path.join(resourcepack_name, 'assets', 'minecraft', 'textures', 'item', 'music_disc_%s.png' % name))
+                if sound_names[i] == name:
+                    shutil.copyfile(track_files[i], os.path.join(resourcepack_name, 'assets', 'minecraft', 'sounds', 'records', '%s.ogg' % name))
+                if texture_names[i] == name:
+                    shutil.copyfile(texture_files[i], os.path.join(resourcepack_name, 'assets', 'minecraft', 'textures', 'item', 'music_disc_%s.png' % name))
 
         except UnicodeEncodeError:
             raise IMDException(Status.BAD_UNICODE_CHAR)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs pack output module
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import time
+import zipfile
+import threading
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from src.definitions import Constants, WriteMetricsContents
+from src.generator.staging import move_file, clone_file
+
+
+
+# permissions of files extracted from a pack's .zip: rw-r--r--
+ZIP_FILE_MODE = 0o644
+
+
+
+# The files of a pack, as they're written
+#
+# use as a context manager: everything is written by the end of the block,
+#   paths are relative to the pack's root
+class PackFileSystem():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+    # add a rendered file
+    def write(self, path: str, text: str):
+        raise NotImplementedError
+
+    # add a track or texture. Files the app owns can be moved in, rather
+    #   than copied
+    def add_file(self, path: str, src: str, move: bool = False):
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        raise NotImplementedError
+
+
+
+# In-memory stage for the files of a pack, written to disk in batches
+#
+# A large pack is tens of thousands of small files. Writing each one as it's
+#   rendered means checking for and making its directory, then opening,
+#   writing and closing it, one file after another. Instead, rendered files
+#   are held in memory along with the set of directories they need. Every
+#   batch of files makes its new directories once, parents first, and is
+#   handed to a pool of threads, so the next batch is rendered while this
+#   one is written, and slow disks and network shares have several writes
+#   in flight
+#
+# Only a few batches are held at once, so memory use stays bounded however
+#   many discs there are
+class VirtualFileSystem(PackFileSystem):
+
+    def __init__(self, root: str, workers: int = Constants.VFS_WRITE_WORKERS,
+                 batch_bytes: int = Constants.VFS_BATCH_BYTES):
+        self.root = root
+        self.metrics = WriteMetricsContents()
+
+        self._batch_bytes = batch_bytes
+        self._max_in_flight = 2 * workers
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._in_flight: deque[Future] = deque()
+
+        self._files: dict[str, bytes] = {}
+        self._buffered = 0
+        self._dirs: set[str] = set()        #directories the held files need, relative to root
+        self._made = {''}                   #directories that exist
+
+        self._lock = threading.Lock()
+
+    # on an error, files already handed to the pool are still finished,
+    #   so no thread is left writing into the pack
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.flush()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    # stage a rendered file, at a path relative to the root
+    # a file written twice keeps the last text, as if it were overwritten
+    def write(self, path: str, text: str):
+        data = encode_text(text)
+
+        self._buffered += len(data) - len(self._files.get(path, b''))
+        self._files[path] = data
+        self.add_dir(os.path.dirname(path))
+
+        if self._buffered >= self._batch_bytes:
+            self.submit()
+
+    # put a track or texture into the pack, at a path relative to the root
+    # these are too big to hold in memory, so they're written right away
+    def add_file(self, path: str, src: str, move: bool = False):
+        self.add_dir(os.path.dirname(path))
+        self.make_dirs()
+
+        start = time.perf_counter()
+
+        if move:
+            move_file(src, os.path.join(self.root, path))
+        else:
+            clone_file(src, os.path.join(self.root, path))
+
+        with self._lock:
+            self.metrics.assets += 1
+            self.metrics.bytes += os.path.getsize(os.path.join(self.root, path))
+            self.metrics.write_s += time.perf_counter() - start
+
+    # write everything that's held, and wait for it to be written
+    def flush(self):
+        self.submit()
+
+        while self._in_flight:
+            self._in_flight.popleft().result()
+
+    # hand the held files to the pool
+    def submit(self):
+        if not self._files:
+            return
+
+        #files only go to the pool once their directories exist
+        self.make_dirs()
+
+        files = list(self._files.items())
+        self._files = {}
+        self._buffered = 0
+
+        #wait for the oldest batch if too many are held
+        while len(self._in_flight) >= self._max_in_flight:
+            self._in_flight.popleft().result()
+
+        self._in_flight.append(self._pool.submit(self.write_files, files))
+
+    # a directory and any of its parents that aren't known yet
+    def add_dir(self, path: str):
+        while path not in self._made and path not in self._dirs:
+            self._dirs.add(path)
+            path = os.path.dirname(path)
+
+    # make the new directories, parents first since they sort first
+    def make_dirs(self):
+        start = time.perf_counter()
+        made = 0
+
+        for d in sorted(self._dirs):
+            try:
+                os.mkdir(os.path.join(self.root, d))
+                made += 1
+            except FileExistsError:
+                pass
+
+        self._made |= self._dirs
+        self._dirs = set()
+
+        with self._lock:
+            self.metrics.dirs += made
+            self.metrics.write_s += time.perf_counter() - start
+
+    def write_files(self, files: list):
+        start = time.perf_counter()
+        written = 0
+
+        for (path, data) in files:
+            with open(os.path.join(self.root, path), 'wb') as dst:
+                written += dst.write(data)
+
+        with self._lock:
+            self.metrics.files += len(files)
+            self.metrics.bytes += written
+            self.metrics.write_s += time.perf_counter() - start
+
+    def describe(self) -> str:
+        return (f"{self.root}: {self.metrics.files} files and {self.metrics.assets} tracks/textures "
+                f"in {self.metrics.dirs} new directories, {describe_throughput(self.metrics)}")
+
+
+
+# A pack written straight into a .zip archive
+#
+# Rendered files go into the archive as they're written, and tracks and
+#   textures are streamed into it from where they already are, so no copy
+#   of the pack is ever put on disk just to be read back and zipped. Only
+#   one file is held in memory at a time, however big the pack is
+#
+# files are stored without compression, as packs always have been: .ogg
+#   and .png files barely compress
+class ZipFileSystem(PackFileSystem):
+
+    def __init__(self, path: str):
+        self.root = path
+        self.metrics = WriteMetricsContents()
+
+        self._zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED)
+        self._date_time = time.localtime()[:6]
+
+    # a half-written archive can't be opened, so it's removed on an error
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self._zip.close()
+        finally:
+            if exc_type is not None and os.path.exists(self.root):
+                os.remove(self.root)
+
+    def write(self, path: str, text: str):
+        data = encode_text(text)
+
+        info = zipfile.ZipInfo(path, date_time=self._date_time)
+        info.external_attr = ZIP_FILE_MODE << 16
+
+        start = time.perf_counter()
+        self._zip.writestr(info, data)
+
+        self.metrics.files += 1
+        self.metrics.bytes += len(data)
+        self.metrics.write_s += time.perf_counter() - start
+
+    # stream a track or texture into the archive; moved files are removed
+    #   once they're in it, so converted tracks don't take up space twice
+    def add_file(self, path: str, src: str, move: bool = False):
+        start = time.perf_counter()
+        self._zip.write(src, path)
+
+        self.metrics.assets += 1
+        self.metrics.bytes += self._zip.infolist()[-1].file_size
+        self.metrics.write_s += time.perf_counter() - start
+
+        if move:
+            os.remove(src)
+
+    def describe(self) -> str:
+        return (f"{self.root}: {self.metrics.files} files and {self.metrics.assets} tracks/textures, "
+                f"{describe_throughput(self.metrics)}")
+
+
+
+# how much was written, and how fast
+# with several writer threads, the rate is per thread: the time is added
+#   up across them
+def describe_throughput(metrics: WriteMetricsContents) -> str:
+    mb = metrics.bytes / (1024 * 1024)
+    if metrics.write_s <= 0:
+        return f"{mb:.1f} MB written"
+
+    return f"{mb:.1f} MB written in {metrics.write_s:.2f}s ({mb / metrics.write_s:.1f} MB/s)"
+
+
+
+# text as it's written to a file opened in text mode: UTF-8, with the
+#   platform's line endings
+def encode_text(text: str) -> bytes:
+    if os.linesep != '\n':
+        text = text.replace('\n', os.linesep)
+
+    return text.encode('utf-8')
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs size budget tests
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.generator.budget import EncodeProfileList, MonoProfileList, estimate_size, plan_profiles
+
+
+
+def test_generous_budget_keeps_mono_at_best_quality():
+    (mono, stereo) = plan_profiles([180, 180], [1, 2], 10**9)
+
+    assert (mono.quality, mono.channels) == (6, 1)
+    assert (stereo.quality, stereo.channels) == (6, 2)
+
+def test_ladders_only_get_smaller():
+    for ladder in [EncodeProfileList, MonoProfileList]:
+        sizes = [estimate_size(p, 180) for p in ladder]
+        assert sizes == sorted(sizes, reverse=True)
+
+    assert len(MonoProfileList) == len(EncodeProfileList)
+
+def test_tight_budget_fits():
+    lengths = [120, 180, 240]
+    channels = [1, 2, 2]
+    budget = 6 * 1024 * 1024
+
+    profiles = plan_profiles(lengths, channels, budget)
+    assert sum(estimate_size(p, l) for (p, l) in zip(profiles, lengths)) <= budget
+    assert profiles[1].quality < 6
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs pack generation tests
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import sys
+import math
+import wave
+import struct
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.definitions import Status, IMDException, DiscListContents, DiscListEntryContents, PackFormatsDict
+import src.generator.factory as generator_factory
+from src.contents.datapack.factory import AbstractDatapackFactory
+
+
+
+PNG = bytes.fromhex('89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+                    '1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082')
+
+
+
+def make_wav(path: str, seconds: float, rate: int = 44100):
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b''.join(struct.pack('<h', int(8000 * math.sin(i / 20.0)))
+                               for i in range(int(seconds * rate))))
+
+def make_entries(path) -> DiscListContents:
+    texture = os.path.join(path, 'disc.png')
+    with open(texture, 'wb') as f:
+        f.write(PNG)
+
+    entries = []
+    for (name, seconds) in [('alpha', 1.0), ('bravo', 1.5)]:
+        track = os.path.join(path, f'{name}.wav')
+        make_wav(track, seconds)
+        entries.append(DiscListEntryContents(texture_file=texture, track_file=track, title=name.title(), internal_name=name))
+
+    return DiscListContents(entries)
+
+# run a whole build, the way GeneratePackWorker does
+def build(path, entry_list=None, **kw):
+    entry_list = entry_list or make_entries(path)
+    settings = {'pack': entry_list.entries[0].texture_file, 'version': PackFormatsDict['1.21'], 'name': 'imd',
+                'zip': False, 'mix_mono': False, 'legacy_dp': False, 'par_proc': False}
+    settings.update(kw)
+
+    generator = generator_factory.get(settings)
+    generator.validate(entry_list, settings)
+    generator.create_tmp(settings)
+    generator.convert_all_to_ogg(entry_list, settings, lambda: None)
+
+    for e in entry_list.entries:
+        e.title = generator.sanitize(e)
+
+    generator.generate_packs(entry_list, settings)
+    generator.cleanup_tmp()
+
+    return entry_list
+
+
+
+def test_folder_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build(tmp_path)
+
+    for pack in ['imd_dp', 'imd_rp']:
+        assert os.path.isfile(os.path.join(pack, 'pack.mcmeta'))
+        assert os.path.isfile(os.path.join(pack, 'pack.png'))
+
+    sounds = os.path.join('imd_rp', 'assets', 'imd', 'sounds', 'records')
+    assert sorted(os.listdir(sounds)) == ['alpha.ogg', 'bravo.ogg']
+
+def test_zip_build(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build(tmp_path, zip=True)
+
+    assert not os.path.exists('imd_dp') and not os.path.exists('imd_rp')
+
+    with zipfile.ZipFile('imd_rp.zip') as rp_zip:
+        names = rp_zip.namelist()
+
+    assert 'pack.mcmeta' in names
+    assert 'assets/imd/sounds/records/alpha.ogg' in names
+
+def test_output_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    out = os.path.join(tmp_path, 'out')
+    os.makedirs(out)
+    build(tmp_path, output_dir=out)
+
+    assert sorted(os.listdir(out)) == ['imd_dp', 'imd_rp']
+    assert not os.path.exists('imd_dp') and not os.path.exists('imd_rp')
+
+def test_one_build_per_staging_area(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (first, second) = (generator_factory.get({}), generator_factory.get({}))
+    first.create_tmp({'name': 'imd'})
+
+    #the same pack to the same place has to wait
+    with pytest.raises(IMDException) as e:
+        second.create_tmp({'name': 'imd'})
+    assert e.value.status == Status.BUILD_IN_PROGRESS
+    assert second.tmp_path is None
+
+    #the same pack written elsewhere is a different build
+    os.makedirs('other')
+    second.create_tmp({'name': 'imd', 'output_dir': 'other'})
+    assert second.tmp_path != first.tmp_path
+
+    first.cleanup_tmp()
+    second.cleanup_tmp()
+
+    first.create_tmp({'name': 'imd'})
+    first.cleanup_tmp()
+
+def test_shared_contents_are_read_only():
+    pack_format = PackFormatsDict['1.21']['dp']
+    dp = AbstractDatapackFactory().get(pack_format)
+    assert dp is AbstractDatapackFactory().get(pack_format)
+
+    with pytest.raises(TypeError):
+        dp.contents[0]['contents'] = ''
+    with pytest.raises(AttributeError):
+        dp.contents[0]['path'].append('x')
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs Ogg Vorbis joining tests
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import sys
+import math
+import wave
+import random
+import struct
+
+from dataclasses import replace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.definitions import Constants, ConvertMode, DiscListEntryContents
+from src.generator.ogg import join_vorbis, read_packets
+from src.generator.v2 import GeneratorV2
+
+
+
+RATE = 44100
+LENGTH_S = 40.0
+
+
+
+# a tone that wanders in pitch, with noise and clicks, so no stretch of the
+#   track encodes the same as any other
+def make_wav(path: str):
+    rng = random.Random(1)
+    frames = []
+    phase = 0.0
+
+    for i in range(int(LENGTH_S * RATE)):
+        phase += 2 * math.pi * (220 + 60 * math.sin(i / RATE * 0.7)) / RATE
+        value = 0.3 * math.sin(phase) + 0.05 * rng.uniform(-1, 1) + (0.6 if i % (RATE // 3) == 0 else 0)
+        frames.append(struct.pack('<h', int(max(-1.0, min(1.0, value)) * 32000)))
+
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(RATE)
+        f.writeframes(b''.join(frames))
+
+def last_granule(path: str) -> int:
+    return [g for (p, g) in read_packets(path)[1] if g is not None][-1]
+
+def audio_packets(path: str) -> list:
+    return [p for (p, g) in read_packets(path)[1]]
+
+
+
+def test_join_segments(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Constants, 'SEGMENT_MIN_LENGTH_S', 12)
+    monkeypatch.setattr(Constants, 'SEGMENT_WARMUP_S', 8.0)
+
+    src = os.path.join(tmp_path, 'src.wav')
+    make_wav(src)
+
+    generator = GeneratorV2()
+    generator.create_tmp({'name': 'test'})
+
+    data = generator.prepare_for_convert(DiscListEntryContents(track_file=src, internal_name='track'), {})
+    segments = generator.split_for_convert(data, ConvertMode.ENCODE, 3)
+    assert len(segments) == 3
+
+    for seg in segments:
+        generator.convert_to_ogg(seg)
+
+    #join the way join_segments() does, without its fallback to encoding
+    #  the whole track
+    starts = [generator.get_segment_range(seg)[0] for seg in segments]
+    joins = [round(seg.seg_start_s * RATE) for seg in segments[1:]]
+    join_vorbis([seg.out_track for seg in segments], data.out_track, starts, joins)
+
+    whole = replace(data, out_track=os.path.join(tmp_path, 'whole.ogg'))
+    generator.convert_to_ogg(whole)
+
+    #nothing is added or lost at the joins
+    assert last_granule(data.out_track) == int(LENGTH_S * RATE)
+    assert last_granule(whole.out_track) == int(LENGTH_S * RATE)
+
+    #and the audio is exactly what encoding the track in one go gives
+    assert audio_packets(data.out_track) == audio_packets(whole.out_track)
+
+    generator.cleanup_tmp()
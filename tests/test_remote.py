@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+#
+#Infinite Music Discs remote conversion tests
+#Generation tool, datapack design, and resourcepack design by link2_thepast
+
+import os
+import sys
+import time
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from src.definitions import DiscListContents, DiscListEntryContents
+import src.generator.executor          #imports remote, which needs it loaded first
+import src.generator.remote as remote
+
+from test_generate import PNG, build, make_wav
+
+
+
+NAMES = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot']
+
+def make_entries(path) -> DiscListContents:
+    texture = os.path.join(path, 'disc.png')
+    with open(texture, 'wb') as f:
+        f.write(PNG)
+
+    #tracks of different lengths, so none are converted once for the others
+    entries = []
+    for (i, name) in enumerate(NAMES):
+        track = os.path.join(path, f'{name}.wav')
+        make_wav(track, 1.0 + i / 10)
+        entries.append(DiscListEntryContents(texture_file=texture, track_file=track, title=name.title(), internal_name=name))
+
+    return DiscListContents(entries)
+
+# start a worker with one slot on a Unix socket, in this process
+def start_worker(address: str, stream: bool):
+    threading.Thread(target=remote.serve, args=(address, b'key', 1, stream), daemon=True).start()
+
+    deadline = time.monotonic() + 10
+    while not os.path.exists(address):
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason="workers listen on Unix sockets")
+def test_lost_worker(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+
+    #the first worker to get a batch dies without answering, so the batch
+    #  and the rest of its queue have to be taken over by the other slots
+    jobs = []
+    run_job = remote.run_job
+
+    def dying_run_job(conn, lock, message, shared, sources):
+        jobs.append(conn)
+        if conn is jobs[0]:
+            conn.close()
+            raise OSError('worker killed')
+
+        run_job(conn, lock, message, shared, sources)
+
+    monkeypatch.setattr(remote, 'run_job', dying_run_job)
+
+    addresses = [str(tmp_path / 'w0.sock'), str(tmp_path / 'w1.sock')]
+    start_worker(addresses[0], stream=True)
+    start_worker(addresses[1], stream=False)
+
+    build(tmp_path, make_entries(tmp_path), par_proc=True, executor='remote', remote_workers=addresses,
+          remote_key='key', workers=1, batch=False)
+
+    #nothing more was sent to the lost worker, but every track was converted
+    assert 'Lost conversion worker' in capsys.readouterr().out
+    assert jobs.count(jobs[0]) == 1
+
+    sounds = os.path.join('imd_rp', 'assets', 'imd', 'sounds', 'records')
+    assert sorted(os.listdir(sounds)) == sorted(f'{n}.ogg' for n in NAMES)